@@ -1,29 +1,143 @@
+import glob
 import multiprocessing
 import os
+import sys
+import tempfile
+
+# Serving profile, selected with GUNICORN_PROFILE:
+#   production - preloaded app, threaded (gthread) workers, memory-driven recycling
+#   async      - preloaded app, uvicorn workers serving treatment_center.asgi
+#                (requires uvicorn; Django runs the sync views in one thread per
+#                worker, so this only pays off for async views and long polling)
+#   debug      - one sync worker with auto-reload and debug logging
+PROFILE = os.environ.get('GUNICORN_PROFILE', 'production')
+
+PROFILES = {
+    'production': {
+        'wsgi_app': 'treatment_center.wsgi:application',
+        'worker_class': 'gthread',
+        'workers': multiprocessing.cpu_count() + 1,
+        'threads': 4,
+        'preload_app': True,
+        'reload': False,
+        'loglevel': 'info',
+    },
+    'async': {
+        'wsgi_app': 'treatment_center.asgi:application',
+        'worker_class': 'uvicorn.workers.UvicornWorker',
+        'workers': multiprocessing.cpu_count() + 1,
+        'threads': 1,
+        'preload_app': True,
+        'reload': False,
+        'loglevel': 'info',
+    },
+    'debug': {
+        'wsgi_app': 'treatment_center.wsgi:application',
+        'worker_class': 'sync',
+        'workers': 1,
+        'threads': 1,
+        'preload_app': False,
+        'reload': True,
+        'loglevel': 'debug',
+    },
+}
+
+if PROFILE not in PROFILES:
+    raise RuntimeError(f"Unknown GUNICORN_PROFILE {PROFILE!r}, expected one of {', '.join(PROFILES)}")
+_profile = PROFILES[PROFILE]
+
+# Application
+wsgi_app = _profile['wsgi_app']
+preload_app = _profile['preload_app']
+reload = _profile['reload']
 
 # Binding
-bind = "...:8"
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
 
 # Worker Processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+workers = int(os.environ.get('GUNICORN_WORKERS', _profile['workers']))
+worker_class = _profile['worker_class']
+threads = int(os.environ.get('GUNICORN_THREADS', _profile['threads']))
 
 # Logging
-errorlog = '/var/log/treatment_center/gunicorn_error.log'
-accesslog = '/var/log/treatment_center/gunicorn_access.log'
-loglevel = 'debug'
+errorlog = os.environ.get('GUNICORN_ERROR_LOG', '/var/log/treatment_center/gunicorn_error.log')
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '/var/log/treatment_center/gunicorn_access.log')
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', _profile['loglevel'])
 capture_output = True
 
 # Timeouts
-timeout = 12
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
 keepalive = 5
 
 # Process Name
 proc_name = "treatment_center"
 
-# Additional Worker Settings
-max_requests = 1
-max_requests_jitter = 5
+# Worker recycling: a worker is replaced once its resident memory passes
+# GUNICORN_MAX_WORKER_MEMORY_MB. max_requests is only a backstop for slow
+# leaks; recycling after every request re-imports Django on each hit.
+# Uvicorn workers do not run post_request, so they rely on max_requests.
+max_worker_memory_mb = int(os.environ.get('GUNICORN_MAX_WORKER_MEMORY_MB', 300))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+# Cache invalidation only reaches other workers through a shared backend (see
+# treatment_app.caching)
+if workers > 1:
+    cache_backend = os.environ.setdefault('TREATMENT_CACHE_BACKEND', 'file')
+    if cache_backend == 'locmem':
+        raise RuntimeError(
+            f"TREATMENT_CACHE_BACKEND=locmem cannot be shared by {workers} workers, use file or db"
+        )
+
+# Workers share their /metrics counters through this directory (see
+# treatment_app.metrics); it is emptied when gunicorn starts
+metrics_dir = os.environ.setdefault(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'treatment_center_metrics')
+)
 
 # Additional Gunicorn settings
 forwarded_allow_ips = '*'  # Allow all IPs to set forwarded headers
+
+
+def _resident_memory_mb():
+    """
+    Current resident set size of this process in MB, or None if unknown.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # ru_maxrss is the peak, in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except (ImportError, OSError):
+        return None
+
+
+def on_starting(server):
+    # Counters of a previous run; Prometheus sees the restart as a reset
+    for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+        os.unlink(path)
+
+
+def post_fork(server, worker):
+    # Connections opened while preloading must not be shared between workers
+    if preload_app:
+        from django.db import connections
+        connections.close_all()
+
+
+def post_request(worker, req, environ, resp):
+    if not max_worker_memory_mb:
+        return
+    memory = _resident_memory_mb()
+    if memory is not None and memory > max_worker_memory_mb:
+        worker.log.info(
+            "Worker %s uses %.0f MB (limit %s MB), recycling", worker.pid, memory, max_worker_memory_mb
+        )
+        worker.alive = False
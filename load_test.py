@@ -0,0 +1,220 @@
+"""
+Load-test harness for the main views.
+
+Logs in once, then hammers each path with concurrent keep-alive clients
+for a fixed duration and reports requests per second and latency
+percentiles. Save a run before a change and one after, then compare:
+
+    python load_test.py --username admin --password ... --save before.json
+    # change gunicorn_config.py / settings, restart gunicorn
+    python load_test.py --username admin --password ... --save after.json
+    python load_test.py --compare before.json after.json
+
+Only the standard library is used, so it runs from any machine that can
+reach the server.
+"""
+
+import argparse
+import http.client
+import json
+import re
+import statistics
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlencode, urlsplit
+
+
+def default_paths():
+    today = date.today()
+    window = urlencode({'start': today - timedelta(days=7), 'end': today + timedelta(days=35)})
+    return [
+        '/',
+        '/families/',
+        '/children/',
+        '/treatments/',
+        '/documents/',
+        f'/treatments/calendar/?{window}',
+        '/api/v1/families/',
+    ]
+
+
+class Session:
+    """
+    Connection settings and the cookies of a logged-in user.
+    """
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme or 'http'
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or (443 if self.scheme == 'https' else 80)
+        self.cookies = {}
+
+    def connect(self):
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=30)
+
+    def headers(self, **extra):
+        headers = {
+            'Host': self.host,
+            # Gunicorn sits behind an SSL proxy, tell Django the request is secure
+            'X-Forwarded-Proto': 'https',
+        }
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        headers.update(extra)
+        return headers
+
+    def store_cookies(self, response):
+        for header in response.headers.get_all('Set-Cookie') or []:
+            name, _, rest = header.partition('=')
+            self.cookies[name.strip()] = rest.split(';', 1)[0]
+
+    def login(self, username, password, path='/accounts/login/'):
+        connection = self.connect()
+        connection.request('GET', path, headers=self.headers())
+        response = connection.getresponse()
+        body = response.read().decode('utf-8', 'replace')
+        self.store_cookies(response)
+        match = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', body)
+        if not match:
+            raise SystemExit(f'No CSRF token on {path} (status {response.status})')
+
+        form = urlencode({'username': username, 'password': password, 'csrfmiddlewaretoken': match.group(1)})
+        connection.request('POST', path, body=form, headers=self.headers(**{
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Referer': f'https://{self.host}{path}',
+        }))
+        response = connection.getresponse()
+        response.read()
+        self.store_cookies(response)
+        connection.close()
+        if response.status != 302 or 'sessionid' not in self.cookies:
+            raise SystemExit(f'Login failed for {username} (status {response.status})')
+
+
+def run_path(session, path, concurrency, duration):
+    """
+    Request ``path`` from ``concurrency`` threads for ``duration`` seconds.
+    """
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        connection = session.connect()
+        own_latencies, own_errors = [], 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=session.headers())
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    own_errors += 1
+            except (OSError, http.client.HTTPException):
+                own_errors += 1
+                connection.close()
+                connection = session.connect()
+                continue
+            own_latencies.append(time.perf_counter() - started)
+        connection.close()
+        with lock:
+            latencies.extend(own_latencies)
+            errors.append(own_errors)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+
+    def percentile(fraction):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 1)
+
+    return {
+        'path': path,
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'rps': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 1) if latencies else None,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def print_header():
+    print(f"{'path':<50} {'req':>7} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+
+
+def print_row(row):
+    print(
+        f"{row['path'][:50]:<50} {row['requests']:>7} {row['errors']:>5} {row['rps']:>8} "
+        f"{row['p50_ms']!s:>8} {row['p95_ms']!s:>8} {row['p99_ms']!s:>8}"
+    )
+
+
+def compare(before_file, after_file):
+    with open(before_file) as f:
+        before = {row['path']: row for row in json.load(f)['results']}
+    with open(after_file) as f:
+        after = {row['path']: row for row in json.load(f)['results']}
+
+    print(f"{'path':<50} {'before':>9} {'after':>9} {'change':>8} {'p95 before':>11} {'p95 after':>10}")
+    for path, new in after.items():
+        old = before.get(path)
+        if old is None:
+            continue
+        change = f"{(new['rps'] / old['rps'] - 1) * 100:+.0f}%" if old['rps'] else 'n/a'
+        print(
+            f"{path[:50]:<50} {old['rps']:>9} {new['rps']:>9} {change:>8} "
+            f"{old['p95_ms']!s:>11} {new['p95_ms']!s:>10}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the main views of the treatment center')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--path', action='append', dest='paths', help='path to test (repeatable)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per path')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two saved runs')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    session = Session(args.base_url)
+    if args.username:
+        session.login(args.username, args.password or '')
+
+    print_header()
+    results = []
+    for path in args.paths or default_paths():
+        results.append(run_path(session, path, args.concurrency, args.duration))
+        print_row(results[-1])
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'base_url': args.base_url,
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,5 +7,4 @@ source venv/bin/activate
 gunicorn \
     --config gunicorn_config.py \
     --log-level=debug \
-    --capture-output \
-    treatment_center.wsgi:application
+    --capture-output
@@ -0,0 +1,163 @@
+"""
+Therapist visibility index.
+
+Works out which user may see which family, child and treatment and keeps
+the answer in the ``TherapistAccess`` table, so list views can scope their
+querysets with a single indexed lookup instead of OR-joining three tables
+and de-duplicating the result on every request.
+
+Visibility rules:
+- Family: the family's therapist and the therapists of its children
+- Child: the child's therapist and the family's therapist
+- Treatment: the treating therapist, the child's therapist and the
+  family's therapist
+
+Signals keep the index current for regular saves. Code that bypasses
+signals (``QuerySet.update()``, ``bulk_create()``) must call
+``sync_families()`` itself.
+"""
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Family, Child, Treatment, Document, TherapistAccess
+
+
+def _treatment_rows(treatments):
+    rows = treatments.values_list(
+        'pk', 'family_id', 'child_id', 'child__family_id', 'therapist_id',
+        'child__therapist__user_id', 'family__therapist_id', 'child__family__therapist_id'
+    )
+    for (treatment_id, family_id, child_id, child_family_id, therapist_id,
+         child_user_id, family_user_id, child_family_user_id) in rows:
+        owner_family_id = family_id or child_family_id
+        users = {therapist_id, child_user_id, family_user_id, child_family_user_id} - {None}
+        for user_id in users:
+            yield (user_id, owner_family_id, child_id, treatment_id)
+
+
+def iter_access_rows(family_ids=None, family_model=Family, child_model=Child, treatment_model=Treatment):
+    """
+    Yield ``(user_id, family_id, child_id, treatment_id)`` for every access
+    grant of the given families (all families when ``family_ids`` is None).
+
+    The model arguments let data migrations pass historical models.
+    """
+    families = family_model.objects.all()
+    children = child_model.objects.all()
+    treatments = treatment_model.objects.all()
+    if family_ids is not None:
+        families = families.filter(pk__in=family_ids)
+        children = children.filter(family_id__in=family_ids)
+        treatments = treatments.filter(Q(family_id__in=family_ids) | Q(child__family_id__in=family_ids))
+
+    family_therapist = dict(families.values_list('pk', 'therapist_id'))
+    family_users = {pk: {user_id} - {None} for pk, user_id in family_therapist.items()}
+
+    for child_id, family_id, child_user_id in children.values_list('pk', 'family_id', 'therapist__user_id'):
+        for user_id in {child_user_id, family_therapist.get(family_id)} - {None}:
+            yield (user_id, family_id, child_id, None)
+        if child_user_id is not None:
+            family_users.setdefault(family_id, set()).add(child_user_id)
+
+    for family_id, users in family_users.items():
+        for user_id in users:
+            yield (user_id, family_id, None, None)
+
+    yield from _treatment_rows(treatments)
+
+
+def create_access_rows(rows, model=TherapistAccess, batch_size=500):
+    """
+    Bulk insert ``(user_id, family_id, child_id, treatment_id)`` rows.
+    """
+    model.objects.bulk_create(
+        [
+            model(user_id=user_id, family_id=family_id, child_id=child_id, treatment_id=treatment_id)
+            for user_id, family_id, child_id, treatment_id in rows
+        ],
+        batch_size=batch_size
+    )
+
+
+def sync_families(family_ids):
+    """
+    Rebuild every access row owned by the given families.
+    """
+    family_ids = {pk for pk in family_ids if pk is not None}
+    if not family_ids:
+        return
+    treatments = Treatment.objects.filter(Q(family_id__in=family_ids) | Q(child__family_id__in=family_ids))
+    with transaction.atomic():
+        TherapistAccess.objects.filter(Q(family_id__in=family_ids) | Q(treatment__in=treatments)).delete()
+        create_access_rows(iter_access_rows(family_ids))
+
+
+def sync_child(child):
+    """
+    Rebuild access rows after a child was saved.
+
+    Covers the child's current family and any family it was moved out of,
+    since a child's therapist also grants access to the family.
+    """
+    family_ids = set(TherapistAccess.objects.filter(child=child).values_list('family_id', flat=True))
+    family_ids.add(child.family_id)
+    sync_families(family_ids)
+
+
+def sync_treatment(treatment):
+    """
+    Rebuild the access rows of a single treatment.
+    """
+    with transaction.atomic():
+        TherapistAccess.objects.filter(treatment=treatment).delete()
+        create_access_rows(_treatment_rows(Treatment.objects.filter(pk=treatment.pk)))
+
+
+def rebuild_access_index():
+    """
+    Drop and rebuild the whole index. Returns the number of rows written.
+    """
+    with transaction.atomic():
+        TherapistAccess.objects.all().delete()
+        rows = list(iter_access_rows())
+        create_access_rows(rows)
+    return len(rows)
+
+
+def check_access_index():
+    """
+    Compare the index with the rows it should contain.
+
+    Returns a ``(missing, stale)`` pair of row sets; both are empty when the
+    index is consistent.
+    """
+    expected = set(iter_access_rows())
+    actual = set(TherapistAccess.objects.values_list('user_id', 'family_id', 'child_id', 'treatment_id'))
+    return expected - actual, actual - expected
+
+
+def scope_queryset(queryset, user):
+    """
+    Restrict a Family, Child, Treatment or Document queryset to the rows
+    ``user`` may see. Documents follow the visibility of their family.
+
+    Superusers see everything.
+    """
+    if user.is_superuser:
+        return queryset
+
+    entries = TherapistAccess.objects.filter(user=user)
+    model = queryset.model
+    if model is Treatment:
+        visible = entries.filter(treatment__isnull=False).values('treatment_id')
+    elif model is Child:
+        visible = entries.filter(child__isnull=False, treatment__isnull=True).values('child_id')
+    elif model is Family:
+        visible = entries.filter(child__isnull=True, treatment__isnull=True).values('family_id')
+    elif model is Document:
+        visible = entries.filter(child__isnull=True, treatment__isnull=True).values('family_id')
+        return queryset.filter(family_id__in=visible)
+    else:
+        raise ValueError(f"No access index for {model.__name__}")
+    return queryset.filter(pk__in=visible)
@@ -1,8 +1,70 @@
+import csv
+import io
+
+from django import forms
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.urls import path
 from django.utils.translation import gettext_lazy as _
-from .models import Family, Child, Document, Treatment, TherapistProfile
+from . import importing, series, uploads
+from .models import Family, Child, Document, Treatment, TreatmentSeries, TherapistProfile, ScheduledJob, JobRun, Report, Upload
+
+class CsvImportForm(forms.Form):
+    file = forms.FileField(label=_('קובץ CSV (UTF-8)'))
+    dry_run = forms.BooleanField(label=_('בדיקה בלבד, ללא שמירה'), required=False)
+
+class CsvImportMixin:
+    """
+    Adds a CSV upload page to the changelist (see treatment_app.importing).
+    The import runs in the request, so files over ADMIN_IMPORT_MAX_ROWS rows
+    are refused and left to ``manage.py import_records``.
+    """
+    import_kind = None
+    change_list_template = 'admin/treatment_app/change_list_import.html'
+    # Row errors listed on the result page
+    shown_errors = 200
+
+    def get_urls(self):
+        name = f'{self.model._meta.app_label}_{self.model._meta.model_name}_import'
+        return [path('import-csv/', self.admin_site.admin_view(self.import_csv_view), name=name)] + super().get_urls()
+
+    def import_csv_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        importer = importing.IMPORTERS[self.import_kind]
+        form = CsvImportForm(request.POST or None, request.FILES or None)
+        result = error = None
+        if request.method == 'POST' and form.is_valid():
+            upload = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+            try:
+                rows = sum(1 for _ in csv.reader(upload)) - 1
+                if rows > settings.ADMIN_IMPORT_MAX_ROWS:
+                    error = _(
+                        'הקובץ מכיל %(rows)d שורות ומכאן ניתן לייבא עד %(max)d. '
+                        'קבצים גדולים יותר מייבאים עם manage.py import_records %(kind)s'
+                    ) % {'rows': rows, 'max': settings.ADMIN_IMPORT_MAX_ROWS, 'kind': self.import_kind}
+                else:
+                    upload.seek(0)
+                    result = importing.import_csv(self.import_kind, upload, dry_run=form.cleaned_data['dry_run'])
+            except (importing.ImportFileError, UnicodeDecodeError, csv.Error) as e:
+                error = str(e)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': _('ייבוא CSV'),
+            'form': form,
+            'result': result,
+            'dry_run': result is not None and form.cleaned_data['dry_run'],
+            'errors': result.errors[:self.shown_errors] if result else [],
+            'error': error,
+            'columns': importer.columns(),
+            'required': importer.required,
+        }
+        return TemplateResponse(request, 'admin/treatment_app/import_csv.html', context)
 
 class ChildInline(admin.TabularInline):
     model = Child
@@ -47,7 +109,8 @@ admin.site.unregister(User)
 admin.site.register(User, CustomUserAdmin)
 
 @admin.register(Family)
-class FamilyAdmin(admin.ModelAdmin):
+class FamilyAdmin(CsvImportMixin, admin.ModelAdmin):
+    import_kind = 'families'
     list_display = ('name', 'phone', 'email', 'therapist')
     search_fields = ('name', 'phone', 'email')
     list_filter = ('therapist',)
@@ -68,7 +131,8 @@ class FamilyAdmin(admin.ModelAdmin):
     )
 
 @admin.register(Child)
-class ChildAdmin(admin.ModelAdmin):
+class ChildAdmin(CsvImportMixin, admin.ModelAdmin):
+    import_kind = 'children'
     list_display = ('name', 'family', 'therapist', 'birth_date', 'gender')
     list_filter = ('family', 'therapist', 'gender')
     search_fields = ('name', 'family__name')
@@ -106,7 +170,7 @@ class ChildAdmin(admin.ModelAdmin):
     )
 
 @admin.register(Treatment)
-class TreatmentAdmin(admin.ModelAdmin):
+class TreatmentAdmin(CsvImportMixin, admin.ModelAdmin):
     """
     Admin configuration for Treatment model.
     
@@ -114,7 +178,9 @@ class TreatmentAdmin(admin.ModelAdmin):
     - Customized list display
     - Filtering options
     - Search capabilities
+    - CSV import
     """
+    import_kind = 'treatments'
     list_display = [
         'get_client_name', 
         'scheduled_date', 
@@ -165,6 +231,25 @@ class TreatmentAdmin(admin.ModelAdmin):
             kwargs['queryset'] = Child.objects.order_by('family__name', 'name')
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
+@admin.register(TreatmentSeries)
+class TreatmentSeriesAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'therapist', 'frequency', 'start_date', 'end_date', 'cancelled_at')
+    list_filter = ('frequency', 'therapist')
+    search_fields = ('family__name', 'child__name')
+    readonly_fields = ('created_by', 'created_at', 'cancelled_at')
+
+    def get_readonly_fields(self, request, obj=None):
+        # Dates and client are fixed once the sessions exist
+        if obj is not None:
+            return self.readonly_fields + ('family', 'child', 'frequency', 'start_date', 'end_date')
+        return self.readonly_fields
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            series.update_series(obj, form.changed_data)
+        else:
+            series.create_series(obj, created_by=request.user)
+
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
     list_display = ('name', 'document_type', 'family', 'child', 'created_at')
@@ -182,3 +267,49 @@ class DocumentAdmin(admin.ModelAdmin):
             'fields': ('notes',)
         }),
     )
+
+@admin.register(ScheduledJob)
+class ScheduledJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'enabled', 'next_run_at', 'last_status', 'last_finished_at', 'locked_by')
+    list_editable = ('enabled',)
+    readonly_fields = ('name', 'locked_by', 'locked_until', 'last_started_at', 'last_finished_at', 'last_status')
+
+@admin.register(JobRun)
+class JobRunAdmin(admin.ModelAdmin):
+    list_display = ('job', 'status', 'started_at', 'duration_ms', 'worker')
+    list_filter = ('job', 'status')
+    date_hierarchy = 'started_at'
+    readonly_fields = ('job', 'worker', 'status', 'started_at', 'finished_at', 'duration_ms', 'result', 'error')
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(Report)
+class ReportAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'subject_id', 'period', 'status', 'requested_by', 'requested_at', 'size')
+    list_filter = ('kind', 'status')
+    date_hierarchy = 'requested_at'
+    readonly_fields = (
+        'kind', 'subject_id', 'period', 'content_key', 'status', 'requested_by', 'requested_at',
+        'started_at', 'finished_at', 'size', 'error',
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(Upload)
+class UploadAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'user', 'size', 'offset', 'created_at', 'updated_at')
+    date_hierarchy = 'created_at'
+    readonly_fields = ('id', 'user', 'filename', 'size', 'sha256', 'offset', 'created_at', 'updated_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    # Deleting an upload deletes what it has received so far
+    def delete_model(self, request, obj):
+        uploads.abort(obj)
+
+    def delete_queryset(self, request, queryset):
+        for upload in queryset:
+            uploads.abort(upload)
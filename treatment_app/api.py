@@ -0,0 +1,185 @@
+"""
+REST API (``/api/v1/``): read-only records and resumable document uploads.
+
+Lists use cursor pagination (see ``treatment_app.pagination``) and every
+queryset is scoped through the access index.
+"""
+
+import io
+
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import scheduling, uploads
+from .access import scope_queryset
+from .routers import ReplicaReadMixin
+from .filters import FamilyFilter, ChildFilter, TreatmentFilter, DocumentFilter
+from .models import Family, Child, Treatment, Document, Upload
+from .serializers import (
+    FamilySerializer, ChildSerializer, TreatmentSerializer, DocumentSerializer, DocumentUploadSerializer,
+    UploadSerializer, user_display_name,
+)
+
+
+class ScopedReadOnlyViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Read-only viewset that scopes to the requesting user, reads from the
+    replica when one is configured and fetches only the relations needed by
+    the requested ``?fields=``.
+    """
+
+    def get_queryset(self):
+        queryset = scope_queryset(self.queryset.model.objects.all(), self.request.user)
+        return self.get_serializer_class().optimize_queryset(queryset, self.request)
+
+
+class FamilyViewSet(ScopedReadOnlyViewSet):
+    queryset = Family.objects.all()
+    serializer_class = FamilySerializer
+    filterset_class = FamilyFilter
+
+
+class ChildViewSet(ScopedReadOnlyViewSet):
+    queryset = Child.objects.all()
+    serializer_class = ChildSerializer
+    filterset_class = ChildFilter
+
+
+class TreatmentViewSet(ScopedReadOnlyViewSet):
+    queryset = Treatment.objects.all()
+    serializer_class = TreatmentSerializer
+    filterset_class = TreatmentFilter
+
+
+class DocumentViewSet(ScopedReadOnlyViewSet):
+    queryset = Document.objects.all()
+    serializer_class = DocumentSerializer
+    filterset_class = DocumentFilter
+
+
+class UploadViewSet(viewsets.ViewSet):
+    """
+    Resumable document uploads (see ``uploads``):
+
+    - ``POST uploads/`` with ``filename``, ``size`` and ``sha256`` starts one
+    - ``PATCH uploads/<id>/`` sends a chunk as the raw body, with the offset
+      it starts at in an ``Upload-Offset`` header; a wrong offset is
+      answered with 409 and the right one
+    - ``GET uploads/<id>/`` tells how far an upload has got
+    - ``POST uploads/<id>/finish/`` with the document's ``name``,
+      ``document_type``, ``family``/``child`` and ``notes`` creates it
+    - ``DELETE uploads/<id>/`` abandons an upload
+    """
+
+    lookup_value_regex = '[0-9a-f-]{36}'
+
+    def get_upload(self, pk):
+        return get_object_or_404(Upload, pk=pk, user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = UploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            upload = uploads.start(request.user, **serializer.validated_data)
+        except uploads.UploadError as e:
+            raise ValidationError({'detail': str(e)})
+        return Response(UploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None, *args, **kwargs):
+        return Response(UploadSerializer(self.get_upload(pk)).data)
+
+    def partial_update(self, request, pk=None, *args, **kwargs):
+        upload = self.get_upload(pk)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            raise ValidationError({'Upload-Offset': 'expected the offset of the chunk in bytes'})
+        try:
+            # The body is read as a stream, never parsed or held in memory
+            uploads.write_chunk(upload, offset, request.stream or io.BytesIO())
+        except uploads.OffsetMismatch as e:
+            return Response({'detail': str(e), 'offset': e.offset}, status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as e:
+            raise ValidationError({'detail': str(e)})
+        return Response(UploadSerializer(upload).data)
+
+    def destroy(self, request, pk=None, *args, **kwargs):
+        uploads.abort(self.get_upload(pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['post'])
+    def finish(self, request, pk=None, *args, **kwargs):
+        upload = self.get_upload(pk)
+        serializer = DocumentUploadSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        try:
+            name = uploads.finish(upload)
+        except uploads.UploadError as e:
+            raise ValidationError({'detail': str(e)})
+        with transaction.atomic():
+            document = serializer.save(file=name)
+            upload.delete()
+        return Response(
+            DocumentSerializer(document, context={'request': request}).data, status=status.HTTP_201_CREATED
+        )
+
+
+class FreeSlotsView(ReplicaReadMixin, APIView):
+    """
+    Free time per therapist for one week (Sunday to Thursday, 08:00-20:00).
+
+    ``?week=`` is any date in the week (default: today), ``?duration=`` the
+    shortest gap worth listing in minutes (default 60) and ``?therapist=``
+    (repeatable, superusers only) limits the therapists; other users see
+    only their own calendar. All therapists are computed from one query.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            week = parse_date(request.query_params.get('week') or timezone.localdate().isoformat())
+        except ValueError:
+            week = None
+        if week is None:
+            raise ValidationError({'week': 'expected YYYY-MM-DD'})
+        try:
+            duration = int(request.query_params.get('duration', 60))
+        except ValueError:
+            raise ValidationError({'duration': 'expected minutes'})
+        if not 15 <= duration <= 12 * 60:
+            raise ValidationError({'duration': 'between 15 and 720 minutes'})
+
+        therapists = scheduling.active_therapists().order_by('first_name', 'last_name', 'username')
+        if not request.user.is_superuser:
+            therapists = therapists.filter(pk=request.user.pk)
+        elif request.query_params.getlist('therapist'):
+            try:
+                therapists = therapists.filter(pk__in=[int(pk) for pk in request.query_params.getlist('therapist')])
+            except ValueError:
+                raise ValidationError({'therapist': 'expected user ids'})
+
+        days = scheduling.week_days(week)
+        return Response({
+            'week_start': days[0].isoformat(),
+            'duration': duration,
+            'therapists': [
+                {
+                    'id': entry['therapist'].pk,
+                    'name': user_display_name(entry['therapist']),
+                    'days': [
+                        {
+                            'date': day.isoformat(),
+                            'free': [[start.strftime('%H:%M'), end.strftime('%H:%M')] for start, end in gaps],
+                        }
+                        for day, gaps in entry['days']
+                    ],
+                }
+                for entry in scheduling.free_slots(week, therapists, min_minutes=duration)
+            ],
+        })
@@ -0,0 +1,18 @@
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+
+from . import api
+
+router = DefaultRouter()
+router.register('families', api.FamilyViewSet, basename='family')
+router.register('children', api.ChildViewSet, basename='child')
+router.register('treatments', api.TreatmentViewSet, basename='treatment')
+router.register('documents', api.DocumentViewSet, basename='document')
+router.register('uploads', api.UploadViewSet, basename='upload')
+
+app_name = 'api'
+
+urlpatterns = [
+    path('free-slots/', api.FreeSlotsView.as_view(), name='free-slots'),
+    path('', include(router.urls)),
+]
@@ -0,0 +1,75 @@
+"""
+SQLite backend tuned for several gunicorn workers sharing one database file.
+
+Every new connection switches to WAL journaling, so readers no longer wait
+for a writer, and sets ``synchronous``, cache, mmap and busy-timeout pragmas.
+The busy timeout follows ``OPTIONS['timeout']`` (seconds, as for the stock
+backend), so there is one setting for how long to wait on a lock.
+Transactions start with ``BEGIN IMMEDIATE``: a deferred transaction that
+reads and then writes cannot wait out another writer and fails at once with
+"database is locked", while an immediate one queues on the busy timeout.
+
+Use it as the ``ENGINE`` and override pragmas through ``OPTIONS``::
+
+    'ENGINE': 'treatment_app.backends.sqlite3',
+    'OPTIONS': {
+        'pragmas': {'mmap_size': 0},
+        'transaction_mode': 'IMMEDIATE',
+    },
+"""
+
+from django.db.backends.sqlite3 import base
+
+# sqlite3.connect()'s default lock timeout, in seconds
+DEFAULT_TIMEOUT = 5
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # Durable across application crashes; only a power loss can drop the
+    # last transactions, which is the usual trade-off under WAL
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,  # negative means KiB, so ~20 MB per connection
+    'mmap_size': 268435456,  # 256 MB
+    'temp_store': 'MEMORY',
+}
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # Options consumed here rather than passed to sqlite3.connect()
+        params.pop('pragmas', None)
+        params.pop('transaction_mode', None)
+        return params
+
+    @property
+    def pragmas(self):
+        options = self.settings_dict['OPTIONS']
+        # busy_timeout first, so the pragmas below wait for a lock instead of failing
+        busy_timeout = int(options.get('timeout', DEFAULT_TIMEOUT) * 1000)  # ms
+        return {'busy_timeout': busy_timeout, **DEFAULT_PRAGMAS, **options.get('pragmas', {})}
+
+    @property
+    def transaction_mode(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode', 'IMMEDIATE').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ValueError(f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}")
+        return mode
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            if name == 'journal_mode':
+                # Persistent in the file; switching it needs an exclusive lock,
+                # so only do it when it actually changes
+                current = conn.execute('PRAGMA journal_mode').fetchone()[0]
+                if current.upper() == str(value).upper():
+                    continue
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
@@ -0,0 +1,81 @@
+"""
+Versioned cache keys for rendered fragments and feeds.
+
+Every cached model has a version number in the cache. Signals bump it on
+``post_save``/``post_delete`` (see ``treatment_app.signals``), and every
+key built from ``cache_version()`` embeds the versions of the models it
+depends on, so a write makes the dependent entries unreachable without
+having to know or delete them. The backend is chosen by ``CACHES`` in
+settings; use a shared backend (file or database) when running several
+gunicorn workers, or invalidation only reaches the worker that saved.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+FRAGMENT_CACHE_TIMEOUT = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 300)
+
+
+def _version_key(model):
+    return f'cache-version:{model._meta.label_lower}'
+
+
+def _new_version():
+    # A version key may be evicted; starting it again from a number never
+    # used before keeps entries cached under the old one unreachable
+    return time.time_ns()
+
+
+def bump_cache_version(model):
+    """
+    Invalidate every cache entry that depends on ``model``.
+    """
+    key = _version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _new_version(), timeout=None)
+
+
+def cache_version(*models):
+    """
+    Return a string combining the current versions of ``models``.
+    """
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    for key in missing:
+        cache.add(key, _new_version(), timeout=None)
+        versions[key] = cache.get(key)
+    return '.'.join(str(versions[key]) for key in keys)
+
+
+def request_cache_key(request, *models):
+    """
+    Build a per-request key part from model versions, the query string and
+    today's date (list pages show past-due flags and ages that move daily).
+    """
+    return ':'.join([
+        cache_version(*models),
+        request.GET.urlencode(),
+        timezone.localdate().isoformat(),
+    ])
+
+
+class CachedFragmentMixin:
+    """
+    Adds ``fragment_cache_key`` and ``fragment_cache_timeout`` to the context
+    of a list view, for use with ``{% cache %}`` around the rendered rows.
+
+    ``cache_models`` lists the models whose changes invalidate the fragment.
+    """
+    cache_models = ()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['fragment_cache_timeout'] = FRAGMENT_CACHE_TIMEOUT
+        context['fragment_cache_key'] = request_cache_key(self.request, *self.cache_models)
+        return context
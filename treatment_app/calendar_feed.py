@@ -0,0 +1,168 @@
+"""
+Calendar feed for FullCalendar.
+
+The feed is scoped through the access index and summarised by one
+aggregate query (row count and latest ``updated_at`` of the treatments and
+of the families and children whose names are their titles) over the
+requested window. That summary drives the ETag, so an unchanged window is answered
+with ``304 Not Modified`` before any row is loaded, and it keys the cache
+of serialized events, so identical windows are serialized only once.
+
+Clients can pass ``since=<cursor>`` to receive only events updated after
+the cursor, or whose family or child was. Every response carries
+``X-Calendar-Cursor`` (the latest ``updated_at`` in the window) and ``X-Calendar-Total`` (the number of
+events in the window); a client whose merged event count differs from the
+total has missed a deletion and should refetch the window without ``since``.
+"""
+
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .access import scope_queryset
+from .caching import FRAGMENT_CACHE_TIMEOUT
+from .models import Treatment
+
+CHILD_COLOR = '#007bff'  # Bootstrap primary blue
+FAMILY_COLOR = '#28a745'  # Bootstrap success green
+UNKNOWN_COLOR = '#6c757d'  # Bootstrap secondary gray
+PAST_DUE_COLOR = '#dc3545'  # Bootstrap danger red
+# Cancelled sessions stay in the feed so incremental refetches replace them
+CANCELLED_COLOR = '#adb5bd'  # Bootstrap gray-500
+
+EVENT_FIELDS = (
+    'id', 'scheduled_date', 'start_time', 'end_time', 'type', 'status',
+    'child_id', 'child__name', 'family__name'
+)
+
+_PK_PLACEHOLDER = 987654321
+
+
+class FeedError(ValueError):
+    """
+    Raised for feed parameters that cannot be parsed.
+    """
+
+
+class CalendarFeed:
+    """
+    One calendar window for one user, built from the request's query string.
+    """
+
+    def __init__(self, request):
+        self.user = request.user
+        self.start = self._parse_date(request.GET.get('start'), 'start')
+        self.end = self._parse_date(request.GET.get('end'), 'end')
+        self.treatment_type = request.GET.get('type') or None
+        self.treatment_status = request.GET.get('status') or None
+        self.since = None
+        if request.GET.get('since'):
+            self.since = parse_datetime(request.GET['since'].replace(' ', '+'))
+            if self.since is None:
+                raise FeedError('since')
+        self.today = timezone.localdate()
+        self._summary = None
+
+    @staticmethod
+    def _parse_date(value, name):
+        # FullCalendar sends full ISO datetimes; only the date part matters here
+        parsed = parse_date((value or '')[:10])
+        if parsed is None:
+            raise FeedError(name)
+        return parsed
+
+    def window(self):
+        """
+        Treatments in the requested window the user may see.
+        """
+        treatments = scope_queryset(Treatment.objects.all(), self.user).filter(
+            scheduled_date__range=[self.start, self.end]
+        )
+        if self.treatment_type:
+            treatments = treatments.filter(type=self.treatment_type)
+        if self.treatment_status:
+            treatments = treatments.filter(status=self.treatment_status)
+        return treatments
+
+    def summary(self):
+        """
+        ``(total, last_updated)`` of the window, computed with one query.
+        Renaming a family or child changes the titles, so their
+        ``updated_at`` counts too.
+        """
+        if self._summary is None:
+            result = self.window().order_by().aggregate(
+                total=Count('pk'), treatment=Max('updated_at'),
+                family=Max('family__updated_at'), child=Max('child__updated_at'),
+            )
+            updated = [result[name] for name in ('treatment', 'family', 'child') if result[name]]
+            self._summary = (result['total'], max(updated, default=None))
+        return self._summary
+
+    def etag(self):
+        total, last_updated = self.summary()
+        parts = [
+            self.user.pk, self.start, self.end, self.treatment_type, self.treatment_status,
+            self.since and self.since.isoformat(), total, last_updated and last_updated.isoformat(),
+            self.today,
+        ]
+        return hashlib.md5(repr(parts).encode()).hexdigest()
+
+    def cursor(self):
+        last_updated = self.summary()[1]
+        if last_updated is None:
+            return self.since.isoformat() if self.since else ''
+        return last_updated.isoformat()
+
+    def events(self):
+        """
+        Serialized events, served from the cache while the window is unchanged.
+        """
+        key = f'calendar-feed:{self.etag()}'
+        events = cache.get(key)
+        if events is None:
+            events = self._serialize()
+            cache.set(key, events, FRAGMENT_CACHE_TIMEOUT)
+        return events
+
+    def _serialize(self):
+        treatments = self.window()
+        if self.since:
+            treatments = treatments.filter(
+                Q(updated_at__gt=self.since) | Q(family__updated_at__gt=self.since)
+                | Q(child__updated_at__gt=self.since)
+            )
+
+        type_labels = {value: str(label) for value, label in Treatment.TreatmentType.choices}
+        url_template = reverse('treatment_app:treatment-detail', kwargs={'pk': _PK_PLACEHOLDER})
+        scheduled = Treatment.TreatmentStatus.SCHEDULED
+        cancelled = Treatment.TreatmentStatus.CANCELLED
+
+        events = []
+        for row in treatments.values(*EVENT_FIELDS).order_by():
+            if row['child_id']:
+                client_name, color = row['child__name'], CHILD_COLOR
+            elif row['family__name']:
+                client_name, color = row['family__name'], FAMILY_COLOR
+            else:
+                client_name, color = 'לקוח לא מזוהה', UNKNOWN_COLOR
+
+            if row['status'] == scheduled and row['scheduled_date'] < self.today:
+                color = PAST_DUE_COLOR
+            elif row['status'] == cancelled:
+                color = CANCELLED_COLOR
+
+            day = row['scheduled_date'].isoformat()
+            events.append({
+                'id': row['id'],
+                'title': f"{client_name} - {type_labels.get(row['type'], row['type'])}",
+                'start': f"{day}T{row['start_time']}" if row['start_time'] else day,
+                'end': f"{day}T{row['end_time']}" if row['end_time'] else day,
+                'color': color,
+                'url': url_template.replace(str(_PK_PLACEHOLDER), str(row['id'])),
+            })
+        return events
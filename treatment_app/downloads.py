@@ -0,0 +1,116 @@
+"""
+Serving generated files with conditional and range requests.
+
+Browsers' PDF viewers and download managers fetch large files in byte
+ranges and resume interrupted downloads; ``file_response`` answers a single
+``Range: bytes=...`` with 206 Partial Content (honouring ``If-Range``), a
+matching ``If-None-Match`` with 304, and anything else with the whole file.
+Multiple ranges in one request are answered with the whole file, which
+RFC 9110 allows.
+
+With ``settings.SENDFILE`` set, the view only checks access and the web
+server sends the file (and answers ranges itself): ``'x-accel-redirect'``
+for nginx, which maps ``accel_url`` to an ``internal`` location, or
+``'x-sendfile'`` for Apache/LiteSpeed, which gets the file's path.
+"""
+
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, quote_etag
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    ``(start, end)`` (inclusive) of a single-range ``Range`` header for a
+    file of ``size`` bytes; None to send the whole file; ``ValueError`` if
+    the range cannot be satisfied.
+    """
+    match = _RANGE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # bytes=-N: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError('empty suffix range')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        raise ValueError('range not satisfiable')
+    return start, end
+
+
+def _read(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _content(request, path, size, etag, content_type):
+    header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    # A stale If-Range (the file changed) asks for the whole file
+    if header and request.method == 'GET' and (not if_range or if_range == etag):
+        try:
+            byte_range = parse_range(header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            response = StreamingHttpResponse(_read(path, start, end - start + 1), status=206, content_type=content_type)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            return response
+    response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['Content-Length'] = size
+    return response
+
+
+def _sendfile(path, content_type, accel_url):
+    if settings.SENDFILE == 'x-sendfile':
+        header, value = 'X-Sendfile', os.fspath(path)
+    elif settings.SENDFILE == 'x-accel-redirect' and accel_url:
+        header, value = 'X-Accel-Redirect', accel_url
+    else:
+        return None
+    response = HttpResponse(content_type=content_type)
+    response[header] = value
+    return response
+
+
+def file_response(request, path, content_type, etag, filename=None, as_attachment=False,
+                  accel_url=None, cache_control='private, no-cache'):
+    """
+    Response for the file at ``path``, whose content is identified by
+    ``etag`` (unquoted). ``accel_url`` is the (quoted) URL of the file under
+    nginx's internal location, if it is under one.
+    """
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = _sendfile(path, content_type, accel_url)
+        if response is None:
+            response = _content(request, path, os.path.getsize(path), etag, content_type)
+        if filename:
+            response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = cache_control
+    return response
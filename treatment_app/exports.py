@@ -0,0 +1,352 @@
+"""
+Streaming CSV and XLSX exports of treatments, families and children.
+
+Rows are read with ``values_list()`` and ``iterator(chunk_size=...)``, so
+no model instances are built and memory stays flat however many years are
+exported. The file is produced while it is sent: CSV row by row, XLSX as a
+zip written on the fly (the sheet uses inline strings, so no shared-string
+table has to be collected first). Only the standard library is needed.
+
+Exports are scoped through the access index like the list views and take
+the same filters as the REST API (``treatment_app.filters``); the family
+export also takes the family list's ``?q=`` search.
+"""
+
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime, time
+from xml.sax.saxutils import escape
+
+from django.utils import timezone
+
+from .access import scope_queryset
+from .filters import FamilyFilter, ChildFilter, TreatmentFilter
+from .models import Family, Child, Treatment
+from . import search
+
+CHUNK_SIZE = 2000
+# Bytes collected before a chunk is handed to the response
+FLUSH_SIZE = 64 * 1024
+
+
+def _person(first_name, last_name, username):
+    return ' '.join(part for part in (first_name, last_name) if part) or username or ''
+
+
+def _choices(model, field):
+    return {value: str(label) for value, label in model._meta.get_field(field).flatchoices}
+
+
+class Export:
+    """
+    One exportable list: its rows, headers and filters.
+    """
+
+    def __init__(self, model, filterset_class, headers, fields, ordering, convert):
+        self.model = model
+        self.filterset_class = filterset_class
+        self.headers = headers
+        self.fields = fields
+        self.ordering = ordering
+        self.convert = convert
+
+    def queryset(self, request):
+        """
+        The rows ``request.user`` may see, filtered by the query string.
+        Returns ``(queryset, errors)``.
+        """
+        queryset = scope_queryset(self.model.objects.all(), request.user)
+        filterset = self.filterset_class(request.GET, queryset=queryset)
+        if not filterset.is_valid():
+            return None, filterset.errors
+        queryset = filterset.qs
+        if self.model is Family:
+            queryset = search.filter_families(queryset, request.GET.get('q'))
+        return queryset, None
+
+    def rows(self, queryset):
+        values = queryset.order_by(*self.ordering).values_list(*self.fields)
+        for row in values.iterator(chunk_size=CHUNK_SIZE):
+            yield self.convert(row)
+
+
+def _treatment_exporter():
+    types = _choices(Treatment, 'type')
+    statuses = _choices(Treatment, 'status')
+
+    def convert(row):
+        (pk, scheduled_date, actual_date, start_time, end_time, kind, status, family_name, child_family_name,
+         child_name, first_name, last_name, username, summary, next_steps, needs_summary) = row
+        return (
+            pk, scheduled_date, actual_date, start_time, end_time, types.get(kind, kind),
+            statuses.get(status, status), family_name or child_family_name or '', child_name or '',
+            _person(first_name, last_name, username), summary or '', next_steps or '', needs_summary,
+        )
+
+    return Export(
+        Treatment, TreatmentFilter,
+        headers=(
+            'מזהה', 'תאריך מתוכנן', 'תאריך בפועל', 'שעת התחלה', 'שעת סיום', 'סוג טיפול', 'סטטוס',
+            'משפחה', 'ילד', 'מטפל', 'סיכום טיפול', 'המשך טיפול', 'נדרש סיכום',
+        ),
+        fields=(
+            'pk', 'scheduled_date', 'actual_date', 'start_time', 'end_time', 'type', 'status',
+            'family__name', 'child__family__name', 'child__name',
+            'therapist__first_name', 'therapist__last_name', 'therapist__username',
+            'summary', 'next_steps', 'needs_summary',
+        ),
+        ordering=('-scheduled_date', 'start_time', 'pk'),
+        convert=convert,
+    )
+
+
+def _family_exporter():
+    statuses = _choices(Family, 'family_status')
+
+    def convert(row):
+        pk, name, address, phone, email, status, first_name, last_name, username, created_at = row
+        return (
+            pk, name, address, phone, email or '', statuses.get(status, status or ''),
+            _person(first_name, last_name, username), created_at,
+        )
+
+    return Export(
+        Family, FamilyFilter,
+        headers=('מזהה', 'שם משפחה', 'כתובת', 'טלפון', 'דוא"ל', 'מצב משפחתי', 'מטפל', 'נוצר ב'),
+        fields=(
+            'pk', 'name', 'address', 'phone', 'email', 'family_status',
+            'therapist__first_name', 'therapist__last_name', 'therapist__username', 'created_at',
+        ),
+        ordering=('name', 'pk'),
+        convert=convert,
+    )
+
+
+def _child_exporter():
+    genders = _choices(Child, 'gender')
+
+    def convert(row):
+        pk, name, family_name, birth_date, gender, school, grade, first_name, last_name, username, created_at = row
+        return (
+            pk, name, family_name, birth_date, genders.get(gender, gender), school, grade,
+            _person(first_name, last_name, username), created_at,
+        )
+
+    return Export(
+        Child, ChildFilter,
+        headers=('מזהה', 'שם הילד', 'משפחה', 'תאריך לידה', 'מין', 'בית ספר', 'כיתה', 'מטפל', 'נוצר ב'),
+        fields=(
+            'pk', 'name', 'family__name', 'birth_date', 'gender', 'school', 'grade',
+            'therapist__user__first_name', 'therapist__user__last_name', 'therapist__user__username', 'created_at',
+        ),
+        ordering=('family__name', 'name', 'pk'),
+        convert=convert,
+    )
+
+
+EXPORTS = {
+    'treatments': _treatment_exporter(),
+    'families': _family_exporter(),
+    'children': _child_exporter(),
+}
+
+
+def _local(value):
+    # Aware datetimes are shown in the center's time zone, without an offset
+    return timezone.localtime(value).replace(tzinfo=None) if timezone.is_aware(value) else value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'כן' if value else 'לא'
+    if isinstance(value, datetime):
+        return _local(value).strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, time):
+        return value.strftime('%H:%M')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def stream_csv(headers, rows):
+    """
+    Yield the CSV file in chunks. Starts with a byte order mark so Excel
+    opens the Hebrew text as UTF-8.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('﻿')
+    writer.writerow(headers)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+# XML 1.0 does not allow most control characters, even escaped
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+# Cell styles, by index into cellXfs below
+_DATE_STYLE, _TIME_STYLE, _DATETIME_STYLE = 1, 2, 3
+
+_XLSX_FILES = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="3">'
+        '<numFmt numFmtId="164" formatCode="dd/mm/yyyy"/>'
+        '<numFmt numFmtId="165" formatCode="hh:mm"/>'
+        '<numFmt numFmtId="166" formatCode="dd/mm/yyyy hh:mm"/>'
+        '</numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Arial"/></font></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="4">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="166" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '</cellXfs>'
+        '</styleSheet>'
+    ),
+}
+
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetViews><sheetView workbookViewId="0" rightToLeft="1">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    '</sheetView></sheetViews>'
+    '<sheetData>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+
+def _column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _xlsx_cell(ref, value):
+    if value is None or value == '':
+        return ''
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        serial = (_local(value) - _EXCEL_EPOCH).total_seconds() / 86400
+        return f'<c r="{ref}" s="{_DATETIME_STYLE}"><v>{serial:.6f}</v></c>'
+    if isinstance(value, date):
+        return f'<c r="{ref}" s="{_DATE_STYLE}"><v>{(value - _EXCEL_EPOCH.date()).days}</v></c>'
+    if isinstance(value, time):
+        serial = (value.hour * 3600 + value.minute * 60 + value.second) / 86400
+        return f'<c r="{ref}" s="{_TIME_STYLE}"><v>{serial:.6f}</v></c>'
+    text = escape(_INVALID_XML.sub('', str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+class _Chunks:
+    """
+    Write-only file object collecting what the zip writer produces.
+    Without ``seek``/``tell`` ``zipfile`` streams entries with data descriptors.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts, self.size = [], 0
+        return data
+
+
+def stream_xlsx(headers, rows, sheet_name='Sheet1'):
+    """
+    Yield an XLSX workbook with one sheet (right-to-left, header row frozen)
+    in chunks.
+    """
+    chunks = _Chunks()
+    with zipfile.ZipFile(chunks, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in _XLSX_FILES.items():
+            workbook.writestr(name, content)
+        workbook.writestr('xl/workbook.xml', _WORKBOOK.format(name=escape(sheet_name, {'"': '&quot;'})))
+        yield chunks.take()
+
+        letters = [_column_letter(index) for index in range(len(headers))]
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(_SHEET_START.encode())
+            sheet.write(_xlsx_row(1, letters, headers).encode())
+            for number, row in enumerate(rows, start=2):
+                sheet.write(_xlsx_row(number, letters, row).encode())
+                if chunks.size >= FLUSH_SIZE:
+                    yield chunks.take()
+            sheet.write(_SHEET_END.encode())
+    yield chunks.take()
+
+
+def _xlsx_row(number, letters, values):
+    cells = ''.join(_xlsx_cell(f'{letter}{number}', value) for letter, value in zip(letters, values))
+    return f'<row r="{number}">{cells}</row>'
@@ -0,0 +1,48 @@
+"""
+FilterSets for the REST API.
+"""
+
+import django_filters
+
+from .models import Family, Child, Treatment, Document
+
+
+class FamilyFilter(django_filters.FilterSet):
+    name = django_filters.CharFilter(lookup_expr='icontains')
+    created_after = django_filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='gte')
+    updated_since = django_filters.IsoDateTimeFilter(field_name='updated_at', lookup_expr='gte')
+
+    class Meta:
+        model = Family
+        fields = ['name', 'therapist', 'family_status', 'parents_type', 'social_worker']
+
+
+class ChildFilter(django_filters.FilterSet):
+    name = django_filters.CharFilter(lookup_expr='icontains')
+    born_after = django_filters.DateFilter(field_name='birth_date', lookup_expr='gte')
+    born_before = django_filters.DateFilter(field_name='birth_date', lookup_expr='lte')
+    updated_since = django_filters.IsoDateTimeFilter(field_name='updated_at', lookup_expr='gte')
+
+    class Meta:
+        model = Child
+        fields = ['name', 'family', 'therapist', 'gender']
+
+
+class TreatmentFilter(django_filters.FilterSet):
+    scheduled_after = django_filters.DateFilter(field_name='scheduled_date', lookup_expr='gte')
+    scheduled_before = django_filters.DateFilter(field_name='scheduled_date', lookup_expr='lte')
+    updated_since = django_filters.IsoDateTimeFilter(field_name='updated_at', lookup_expr='gte')
+
+    class Meta:
+        model = Treatment
+        fields = ['family', 'child', 'therapist', 'type', 'status', 'needs_summary']
+
+
+class DocumentFilter(django_filters.FilterSet):
+    name = django_filters.CharFilter(lookup_expr='icontains')
+    created_after = django_filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = django_filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='lte')
+
+    class Meta:
+        model = Document
+        fields = ['name', 'family', 'child', 'document_type']
@@ -7,13 +7,14 @@ from datetime import datetime
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Fieldset, Row, Column, Submit, Div, HTML
 
-from .models import Family, Child, Treatment, Document, TherapistProfile, SocialWorker
+from .models import Family, Child, Treatment, TreatmentSeries, Document, TherapistProfile, SocialWorker
+from .scheduling import find_conflicts
 
 def validate_weekday(value):
     """
     Validate that the treatment is scheduled on a weekday (Sunday to Thursday)
     """
-    if value.weekday() > 4:  # Friday or Saturday
+    if value.weekday() in (4, 5):  # Friday or Saturday
         raise ValidationError(_('טיפולים מתוכננים רק בימים ראשון עד חמישי'))
 
 def validate_treatment_start_time(value):
@@ -32,6 +33,39 @@ def validate_treatment_end_time(value):
     if value > max_time:
         raise ValidationError(_('שעת סיום מאוחרת מדי. טיפולים מסתיימים עד 20:00'))
 
+# Divorced families need the details and consent forms of both parents
+DIVORCED_FAMILY_REQUIRED = {
+    'father_name': _('שם האב נדרש למשפחות גרושות'),
+    'mother_name': _('שם האם נדרש למשפחות גרושות'),
+    'father_phone': _('טלפון האב נדרש למשפחות גרושות'),
+    'mother_phone': _('טלפון האם נדרש למשפחות גרושות'),
+    'father_consent_form': _('טופס הסכמה לאב נדרש למשפחות גרושות'),
+    'mother_consent_form': _('טופס הסכמה לאם נדרש למשפחות גרושות'),
+}
+
+def divorced_family_errors(data):
+    """
+    Errors, by field, of a divorced family missing parent details or consent forms
+    """
+    if data.get('family_status') != 'divorced':
+        return {}
+    return {field: message for field, message in DIVORCED_FAMILY_REQUIRED.items() if not data.get(field)}
+
+def clean_treatment_dates(data):
+    """
+    Apply the treatment scheduling rules to cleaned form data in place:
+    a missing scheduled date defaults to the actual date, a treatment with
+    an actual date is completed, and it must end after it starts.
+    """
+    if not data.get('scheduled_date') and data.get('actual_date'):
+        data['scheduled_date'] = data['actual_date']
+    if data.get('actual_date'):
+        data['status'] = 'COMPLETED'
+    start_time = data.get('start_time')
+    end_time = data.get('end_time')
+    if start_time and end_time and start_time >= end_time:
+        raise ValidationError(_('שעת סיום חייבת להיות לאחר שעת ההתחלה'))
+
 class FamilyForm(forms.ModelForm):
     FAMILY_STATUS_CHOICES = [
         ('intact', 'משפחה שלמה'),
@@ -200,23 +234,10 @@ class FamilyForm(forms.ModelForm):
 
     def clean(self):
         cleaned_data = super().clean()
-        family_status = cleaned_data.get('family_status')
 
         # Validate fields based on family status
-        if family_status == 'divorced':
-            # Require both parent details and consent forms
-            if not cleaned_data.get('father_name'):
-                self.add_error('father_name', _('שם האב נדרש למשפחות גרושות'))
-            if not cleaned_data.get('mother_name'):
-                self.add_error('mother_name', _('שם האם נדרש למשפחות גרושות'))
-            if not cleaned_data.get('father_phone'):
-                self.add_error('father_phone', _('טלפון האב נדרש למשפחות גרושות'))
-            if not cleaned_data.get('mother_phone'):
-                self.add_error('mother_phone', _('טלפון האם נדרש למשפחות גרושות'))
-            if not cleaned_data.get('father_consent_form'):
-                self.add_error('father_consent_form', _('טופס הסכמה לאב נדרש למשפחות גרושות'))
-            if not cleaned_data.get('mother_consent_form'):
-                self.add_error('mother_consent_form', _('טופס הסכמה לאם נדרש למשפחות גרושות'))
+        for field, message in divorced_family_errors(cleaned_data).items():
+            self.add_error(field, message)
 
         return cleaned_data
 
@@ -489,26 +510,128 @@ class TreatmentForm(forms.ModelForm):
 
     def clean(self):
         cleaned_data = super().clean()
-        scheduled_date = cleaned_data.get('scheduled_date')
-        actual_date = cleaned_data.get('actual_date')
-        status = cleaned_data.get('status')
-
-        # If no scheduled date, use actual date
-        if not scheduled_date and actual_date:
-            cleaned_data['scheduled_date'] = actual_date
-
-        # If actual date is provided, set status to COMPLETED
-        if actual_date:
-            cleaned_data['status'] = 'COMPLETED'
-
-        # Validate that end time is after start time
+        clean_treatment_dates(cleaned_data)
         start_time = cleaned_data.get('start_time')
         end_time = cleaned_data.get('end_time')
-        if start_time and end_time and start_time >= end_time:
-            raise ValidationError(_('שעת סיום חייבת להיות לאחר שעת ההתחלה'))
+
+        # The therapist must not be booked at the same time
+        therapist = cleaned_data.get('therapist')
+        day = cleaned_data.get('scheduled_date')
+        if therapist and day and start_time and end_time and cleaned_data.get('status') != Treatment.TreatmentStatus.CANCELLED:
+            exclude = [self.instance.pk] if self.instance.pk else []
+            conflict = find_conflicts(therapist, day, start_time, end_time, exclude=exclude).first()
+            if conflict:
+                raise ValidationError(
+                    _('למטפל כבר נקבע טיפול בשעות %(start)s-%(end)s ביום זה: %(treatment)s'),
+                    params={
+                        'start': conflict.start_time.strftime('%H:%M'),
+                        'end': conflict.end_time.strftime('%H:%M'),
+                        'treatment': conflict,
+                    },
+                )
 
         return cleaned_data
 
+class TreatmentSeriesForm(forms.ModelForm):
+    """
+    Form for scheduling a weekly or biweekly series of sessions.
+
+    Every session falls on the weekday of the start date; the scheduling
+    constraints of single treatments (Sunday to Thursday, 08:00 to 20:00)
+    are checked by the model for the whole series.
+    """
+    class Meta:
+        model = TreatmentSeries
+        fields = [
+            'type', 'family', 'child', 'therapist', 'frequency',
+            'start_date', 'end_date', 'start_time', 'end_time',
+        ]
+        widgets = {
+            'type': forms.Select(attrs={'class': 'form-control'}),
+            'family': forms.Select(attrs={'class': 'form-control'}),
+            'child': forms.Select(attrs={'class': 'form-control'}),
+            'therapist': forms.Select(attrs={'class': 'form-control'}),
+            'frequency': forms.Select(attrs={'class': 'form-control'}),
+            'start_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
+            'end_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
+            'start_time': forms.TimeInput(attrs={'type': 'time'}),
+            'end_time': forms.TimeInput(attrs={'type': 'time'}),
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.helper = FormHelper()
+        self.helper.form_method = 'post'
+        self.helper.form_tag = False
+        self.helper.layout = Layout(
+            Fieldset(
+                _('פרטי הסדרה'),
+                Row(
+                    Column('type', css_class='form-group col-md-6 mb-0'),
+                    Column('frequency', css_class='form-group col-md-6 mb-0'),
+                    css_class='form-row'
+                ),
+                Row(
+                    Column('family', css_class='form-group col-md-6 mb-0'),
+                    Column('child', css_class='form-group col-md-6 mb-0'),
+                    css_class='form-row'
+                ),
+                Row(
+                    Column('therapist', css_class='form-group col-md-12 mb-0'),
+                    css_class='form-row'
+                ),
+            ),
+            Fieldset(
+                _('מועדים'),
+                Row(
+                    Column('start_date', css_class='form-group col-md-3 mb-0'),
+                    Column('end_date', css_class='form-group col-md-3 mb-0'),
+                    Column('start_time', css_class='form-group col-md-3 mb-0'),
+                    Column('end_time', css_class='form-group col-md-3 mb-0'),
+                    css_class='form-row'
+                ),
+            ),
+            Submit('submit', _('צור סדרה'), css_class='btn btn-primary')
+        )
+
+class TreatmentSeriesUpdateForm(forms.ModelForm):
+    """
+    Change the time, type or therapist of all remaining sessions of a series.
+    """
+    class Meta:
+        model = TreatmentSeries
+        fields = ['type', 'therapist', 'start_time', 'end_time']
+        widgets = {
+            'type': forms.Select(attrs={'class': 'form-control'}),
+            'therapist': forms.Select(attrs={'class': 'form-control'}),
+            'start_time': forms.TimeInput(attrs={'type': 'time'}),
+            'end_time': forms.TimeInput(attrs={'type': 'time'}),
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.helper = FormHelper()
+        self.helper.form_method = 'post'
+        self.helper.form_tag = False
+        self.helper.layout = Layout(
+            Fieldset(
+                _('שינוי הטיפולים הבאים בסדרה'),
+                Row(
+                    Column('type', css_class='form-group col-md-6 mb-0'),
+                    Column('therapist', css_class='form-group col-md-6 mb-0'),
+                    css_class='form-row'
+                ),
+                Row(
+                    Column('start_time', css_class='form-group col-md-6 mb-0'),
+                    Column('end_time', css_class='form-group col-md-6 mb-0'),
+                    css_class='form-row'
+                ),
+            ),
+            Submit('submit', _('שמור'), css_class='btn btn-primary')
+        )
+
 class DocumentForm(forms.ModelForm):
     class Meta:
         model = Document
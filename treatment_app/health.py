@@ -0,0 +1,88 @@
+"""
+Liveness and readiness probes for load balancers and orchestrators.
+
+``HealthCheckMiddleware`` answers ``/healthz`` and ``/readyz`` before any
+other middleware runs, so probes skip sessions, CSRF, authentication, the
+HTTPS redirect and host validation. ``/healthz`` only says the process is
+serving. ``/readyz`` runs the checks below: each database answers a
+``SELECT 1``, the media directory is writable and the collected static
+files are there.
+
+A process runs the checks at most once every ``HEALTH_CHECK_SECONDS``.
+Probes in between get the last results; while one request refreshes them,
+the others do not wait for it but get the previous results too.
+"""
+
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+def check_databases():
+    for alias in connections:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+
+
+def check_media():
+    if not os.access(settings.MEDIA_ROOT, os.W_OK | os.X_OK):
+        raise OSError(f'{settings.MEDIA_ROOT} is not a writable directory')
+
+
+def check_static():
+    if not os.path.isdir(settings.STATIC_ROOT):
+        raise OSError(f'{settings.STATIC_ROOT} does not exist, run collectstatic')
+
+
+CHECKS = {
+    'database': check_databases,
+    'media': check_media,
+    'static': check_static,
+}
+
+
+def run_checks():
+    """
+    Run every check: ``{name: {'ok', 'ms', 'error'}}``.
+    """
+    results = {}
+    for name, check in CHECKS.items():
+        started = time.perf_counter()
+        try:
+            check()
+        except Exception as e:
+            result = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+        else:
+            result = {'ok': True}
+        result['ms'] = round((time.perf_counter() - started) * 1000, 2)
+        results[name] = result
+    return results
+
+
+_lock = threading.Lock()
+_results = None
+_checked_at = 0.0
+
+
+def readiness():
+    """
+    The latest check results and their age in seconds, refreshed when older
+    than ``HEALTH_CHECK_SECONDS``.
+    """
+    global _results, _checked_at
+    now = time.monotonic()
+    stale = _results is None or now - _checked_at >= settings.HEALTH_CHECK_SECONDS
+    # Only the first probe to find the results stale runs the checks; the
+    # first probe of all has nothing older to return, so it waits
+    if stale and _lock.acquire(blocking=_results is None):
+        try:
+            if _results is None or now - _checked_at >= settings.HEALTH_CHECK_SECONDS:
+                _results = run_checks()
+                _checked_at = time.monotonic()
+        finally:
+            _lock.release()
+    return _results, max(0.0, time.monotonic() - _checked_at)
@@ -0,0 +1,423 @@
+"""
+Bulk import of families, children and treatments from CSV.
+
+Used by ``manage.py import_records`` and the "ייבוא CSV" page of the
+family, child and treatment admin. The file is read as a stream and
+handled in chunks of ``CHUNK_SIZE`` rows:
+
+1. every cell is cleaned by the same form field as in ``FamilyForm``,
+   ``ChildForm`` or ``TreatmentForm`` (date formats, Sunday–Thursday,
+   08:00–20:00, choices, lengths), followed by the forms' row rules
+   (divorced families, treatment dates);
+2. references (therapist by username, family and child by id or name) are
+   looked up with one query per chunk, and treatments are checked for
+   double-booking with one query (``scheduling.batch_conflicts``);
+3. the valid rows are written with ``bulk_create`` in one transaction per
+   chunk, which also brings the access and search indexes up to date.
+
+Rows with errors are skipped and reported by line number; the other rows
+of their chunk are still imported. Choice columns accept either the code
+(``COMPLETED``) or the Hebrew label (``הושלם``).
+"""
+
+import csv
+from itertools import islice
+
+from django import forms
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from . import access, scheduling, search
+from .caching import bump_cache_version
+from .forms import ChildForm, FamilyForm, TreatmentForm, clean_treatment_dates, divorced_family_errors
+from .models import Child, Family, TherapistProfile, Treatment
+
+CHUNK_SIZE = 1000
+BATCH_SIZE = 500
+
+
+class ImportFileError(Exception):
+    """
+    The file as a whole cannot be imported (unknown or missing columns).
+    """
+
+
+class RowError:
+    def __init__(self, line, column, message):
+        self.line = line
+        self.column = column
+        self.message = str(message)
+
+    def __str__(self):
+        column = f' [{self.column}]' if self.column else ''
+        return f'{self.line}{column}: {self.message}'
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.errors = []
+
+    @property
+    def failed(self):
+        return len({error.line for error in self.errors})
+
+
+class _StoredFileField(forms.CharField):
+    """
+    Path of a file already in the media storage, e.g. a consent form copied
+    over from the old system.
+    """
+
+    def validate(self, value):
+        super().validate(value)
+        if value and not default_storage.exists(value):
+            raise ValidationError(_('הקובץ לא נמצא: %(path)s'), params={'path': value})
+
+
+def _choice_labels(field):
+    return {str(label): value for value, label in getattr(field, 'choices', ()) if value not in ('', None)}
+
+
+class Importer:
+    """
+    Imports rows of one model. Subclasses name the columns cleaned by form
+    fields (``fields``), the reference columns resolved in ``check_chunk``
+    (``references``) and the columns a file must have (``required``).
+    """
+    model = None
+    fields = {}
+    references = ()
+    required = ()
+
+    def __init__(self, dry_run=False, chunk_size=CHUNK_SIZE):
+        self.dry_run = dry_run
+        self.chunk_size = chunk_size
+        self.labels = {column: _choice_labels(field) for column, field in self.fields.items()}
+        # Lookups are kept for the whole file
+        self.users = {}
+        self.families = {}
+
+    @classmethod
+    def columns(cls):
+        return [*cls.fields, *cls.references]
+
+    def check_header(self, header):
+        """
+        Raise ``ImportFileError`` unless ``header`` has every required
+        column and no unknown ones.
+        """
+        header = {column.strip() for column in header or ()}
+        problems = []
+        unknown = header - set(self.columns())
+        missing = set(self.required) - header
+        if unknown:
+            problems.append(f"unknown columns: {', '.join(sorted(unknown))}")
+        if missing:
+            problems.append(f"missing columns: {', '.join(sorted(missing))}")
+        if problems:
+            raise ImportFileError('; '.join(problems))
+
+    def run(self, rows):
+        """
+        Import the dicts in ``rows`` (e.g. a ``csv.DictReader``; line
+        numbers count the header as line 1). Returns an ``ImportResult``.
+        """
+        result = ImportResult()
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                return result
+            first = result.rows + 2
+            result.rows += len(chunk)
+            self.import_chunk([(first + offset, row) for offset, row in enumerate(chunk)], result)
+
+    def import_chunk(self, numbered, result):
+        cleaned = []
+        for line, row in numbered:
+            data, errors = self.clean_row(line, row)
+            result.errors.extend(errors)
+            if not errors:
+                cleaned.append((line, data))
+
+        problems = {}
+        self.check_chunk(cleaned, problems)
+        result.errors.extend(RowError(line, column, message) for line, (column, message) in sorted(problems.items()))
+        instances = [self.build(data) for line, data in cleaned if line not in problems]
+        if instances and not self.dry_run:
+            with transaction.atomic():
+                created = self.model.objects.bulk_create(instances, batch_size=BATCH_SIZE)
+                self.after_create(created)
+            bump_cache_version(self.model)
+        result.created += len(instances)
+
+    def clean_row(self, line, row):
+        data, errors = {}, []
+        row = {(key or '').strip(): value for key, value in row.items()}
+        for column, field in self.fields.items():
+            if column not in row:
+                # Columns missing from the file keep the model default
+                continue
+            value = (row[column] or '').strip()
+            value = self.labels[column].get(value, value)
+            try:
+                data[column] = field.clean(value)
+            except ValidationError as e:
+                errors.extend(RowError(line, column, message) for message in e.messages)
+        for column in self.references:
+            data[column] = (row.get(column) or '').strip()
+        if not errors:
+            try:
+                self.clean_data(data)
+            except ValidationError as e:
+                by_column = e.message_dict if hasattr(e, 'error_dict') else {'': e.messages}
+                for column, messages in by_column.items():
+                    errors.extend(RowError(line, column, message) for message in messages)
+        return data, errors
+
+    def clean_data(self, data):
+        """
+        The form's row rules, on cleaned ``data``; raise ``ValidationError``.
+        """
+
+    def check_chunk(self, cleaned, problems):
+        """
+        Resolve references and check the chunk's rows together, adding
+        ``{line: (column, message)}`` to ``problems`` for rows to skip.
+        """
+
+    def build(self, data):
+        return self.model(**data)
+
+    def after_create(self, objects):
+        pass
+
+    def resolve_users(self, cleaned, problems, column='therapist'):
+        keys = {data[column] for line, data in cleaned} - set(self.users) - {''}
+        if keys:
+            ids = [int(key) for key in keys if key.isdigit()]
+            for user in User.objects.filter(Q(username__in=keys) | Q(pk__in=ids)):
+                self.users[user.username] = self.users[str(user.pk)] = user
+        for line, data in cleaned:
+            key = data.pop(column)
+            data[column] = self.users.get(key)
+            if key and data[column] is None:
+                problems.setdefault(line, (column, _('מטפל לא נמצא: %(key)s') % {'key': key}))
+
+    def resolve_families(self, cleaned, problems, column='family'):
+        """
+        Families by id or exact name; a name shared by several families is
+        an error.
+        """
+        keys = {data[column] for line, data in cleaned} - set(self.families) - {''}
+        if keys:
+            ids = [int(key) for key in keys if key.isdigit()]
+            names = [key for key in keys if not key.isdigit()]
+            for pk, name in Family.objects.filter(Q(pk__in=ids) | Q(name__in=names)).values_list('pk', 'name'):
+                if str(pk) in keys:
+                    self.families[str(pk)] = pk
+                if name in keys:
+                    # Seen twice: ambiguous
+                    self.families[name] = None if name in self.families else pk
+            for key in keys - set(self.families):
+                self.families[key] = 0
+        for line, data in cleaned:
+            key = data.pop(column)
+            data[f'{column}_id'] = self.families.get(key) if key else None
+            if key and not data[f'{column}_id']:
+                if self.families.get(key) is None:
+                    message = _('יותר ממשפחה אחת בשם %(key)s; יש לציין מזהה') % {'key': key}
+                else:
+                    message = _('משפחה לא נמצאה: %(key)s') % {'key': key}
+                problems.setdefault(line, (column, message))
+
+
+class FamilyImporter(Importer):
+    model = Family
+    fields = {
+        **{name: FamilyForm.base_fields[name] for name in (
+            'name', 'address', 'phone', 'email', 'family_status',
+            'father_name', 'father_phone', 'father_email', 'mother_name', 'mother_phone', 'mother_email', 'notes',
+        )},
+        'parents_type': Family._meta.get_field('parents_type').formfield(),
+        'father_consent_form': _StoredFileField(required=False),
+        'mother_consent_form': _StoredFileField(required=False),
+    }
+    references = ('therapist',)
+    required = ('name', 'address', 'phone', 'family_status')
+
+    def clean_data(self, data):
+        errors = divorced_family_errors(data)
+        if errors:
+            raise ValidationError(errors)
+
+    def check_chunk(self, cleaned, problems):
+        self.resolve_users(cleaned, problems)
+
+    def build(self, data):
+        family = Family(**data)
+        # The parents-type rules of Family.save()
+        family.clean()
+        return family
+
+    def after_create(self, families):
+        pks = [family.pk for family in families]
+        access.sync_families(pks)
+        search.update_index(Family, pks)
+
+
+class ChildImporter(Importer):
+    model = Child
+    fields = {name: ChildForm.base_fields[name] for name in (
+        'name', 'birth_date', 'gender', 'school', 'grade', 'teacher_name', 'teacher_phone',
+        'school_counselor_name', 'school_counselor_phone', 'allergies', 'medications', 'special_needs',
+        'medical_info', 'notes',
+    )}
+    references = ('family', 'therapist')
+    required = ('name', 'birth_date', 'gender', 'family')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profiles = {}
+
+    def check_chunk(self, cleaned, problems):
+        for line, data in cleaned:
+            if not data['family']:
+                problems[line] = ('family', ChildForm.base_fields['family'].error_messages['required'])
+        self.resolve_families(cleaned, problems)
+
+        # Children point at the therapist's profile, not the user
+        keys = {data['therapist'] for line, data in cleaned} - set(self.profiles) - {''}
+        if keys:
+            ids = [int(key) for key in keys if key.isdigit()]
+            profiles = TherapistProfile.objects.filter(Q(user__username__in=keys) | Q(user_id__in=ids))
+            for profile in profiles.select_related('user'):
+                self.profiles[profile.user.username] = self.profiles[str(profile.user_id)] = profile
+        for line, data in cleaned:
+            key = data.pop('therapist')
+            data['therapist'] = self.profiles.get(key)
+            if key and data['therapist'] is None:
+                problems.setdefault(line, ('therapist', _('מטפל לא נמצא: %(key)s') % {'key': key}))
+
+    def after_create(self, children):
+        access.sync_families({child.family_id for child in children})
+        search.update_index(Child, [child.pk for child in children])
+
+
+class TreatmentImporter(Importer):
+    model = Treatment
+    fields = {name: TreatmentForm.base_fields[name] for name in (
+        'type', 'scheduled_date', 'actual_date', 'start_time', 'end_time', 'status', 'summary', 'next_steps',
+    )}
+    references = ('family', 'child', 'therapist')
+    required = ('start_time', 'end_time')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.today = timezone.localdate()
+
+    def clean_data(self, data):
+        clean_treatment_dates(data)
+        if not data['family'] and not data['child']:
+            raise ValidationError({'family': _('יש לבחור משפחה או ילד')})
+
+    def check_chunk(self, cleaned, problems):
+        self.resolve_users(cleaned, problems)
+        self.resolve_children(cleaned, problems)
+        self.resolve_families(cleaned, problems)
+        for line, data in cleaned:
+            if data['family_id'] and data['child_family_id'] and data['family_id'] != data['child_family_id']:
+                problems.setdefault(line, ('child', _('הילד אינו שייך למשפחה זו')))
+
+        # The therapist must not be booked twice, by the database or by
+        # earlier rows of the file
+        candidates = [
+            (line, data) for line, data in cleaned
+            if line not in problems and data['therapist'] and data.get('scheduled_date')
+            and data.get('status') != Treatment.TreatmentStatus.CANCELLED
+        ]
+        slots = [
+            (data['therapist'].pk, data['scheduled_date'], data['start_time'], data['end_time'])
+            for line, data in candidates
+        ]
+        for index in scheduling.batch_conflicts(slots):
+            line, data = candidates[index]
+            problems[line] = ('start_time', _('למטפל כבר נקבע טיפול בשעות אלה ביום %(day)s') % {
+                'day': data['scheduled_date'].strftime('%d/%m/%Y'),
+            })
+
+    def resolve_children(self, cleaned, problems):
+        """
+        Children by id, or by name within the row's family (or across all
+        families if the row has none). The child's family is kept in
+        ``child_family_id`` to check it against the row's.
+        """
+        keys = {data['child'] for line, data in cleaned} - {''}
+        by_pk, by_name = {}, {}
+        if keys:
+            ids = [int(key) for key in keys if key.isdigit()]
+            names = [key for key in keys if not key.isdigit()]
+            rows = Child.objects.filter(Q(pk__in=ids) | Q(name__in=names)).values_list(
+                'pk', 'name', 'family_id', 'family__name'
+            )
+            for pk, name, family_id, family_name in rows:
+                by_pk[str(pk)] = (pk, family_id)
+                by_name.setdefault(name, []).append((pk, family_id, family_name))
+        for line, data in cleaned:
+            key = data.pop('child')
+            data['child_id'], data['child_family_id'] = None, None
+            if not key:
+                continue
+            if key.isdigit() and key in by_pk:
+                data['child_id'], data['child_family_id'] = by_pk[key]
+                continue
+            family = data['family']
+            matches = [
+                (pk, family_id) for pk, family_id, family_name in by_name.get(key, [])
+                if not family or family in (str(family_id), family_name)
+            ]
+            if len(matches) == 1:
+                data['child_id'], data['child_family_id'] = matches[0]
+            elif matches:
+                problems.setdefault(line, ('child', _('יותר מילד אחד בשם %(key)s; יש לציין משפחה או מזהה') % {'key': key}))
+            else:
+                problems.setdefault(line, ('child', _('ילד לא נמצא: %(key)s') % {'key': key}))
+
+    def build(self, data):
+        data = dict(data)
+        data.pop('child_family_id')
+        treatment = Treatment(**data)
+        treatment.derive_status(self.today)
+        return treatment
+
+    def after_create(self, treatments):
+        children = dict(Child.objects.filter(
+            pk__in={t.child_id for t in treatments if t.child_id}
+        ).values_list('pk', 'family_id'))
+        access.sync_families({t.family_id or children.get(t.child_id) for t in treatments})
+        search.update_index(Treatment, [t.pk for t in treatments])
+
+
+IMPORTERS = {
+    'families': FamilyImporter,
+    'children': ChildImporter,
+    'treatments': TreatmentImporter,
+}
+
+
+def import_csv(kind, file, dry_run=False, chunk_size=CHUNK_SIZE):
+    """
+    Import the CSV text stream ``file`` as ``kind`` (families, children or
+    treatments). Returns an ``ImportResult``; raises ``ImportFileError``.
+    """
+    importer = IMPORTERS[kind](dry_run=dry_run, chunk_size=chunk_size)
+    reader = csv.DictReader(file)
+    importer.check_header(reader.fieldnames)
+    return importer.run(reader)
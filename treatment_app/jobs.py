@@ -0,0 +1,226 @@
+"""
+Background jobs run by ``manage.py run_jobs``.
+
+Each job is a function registered with ``@job``, either on a fixed
+interval (``every``) or daily at a local time (``at``). Its schedule and
+lock live in a ``ScheduledJob`` row and every run is recorded as a
+``JobRun`` with its timing and result, so several ``run_jobs`` processes
+(or cron entries) can run side by side: a worker only runs a job after
+claiming it with a conditional UPDATE, which exactly one of them wins.
+"""
+
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta, time as dt_time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import ScheduledJob, JobRun, Treatment
+from .stats import DASHBOARD_CACHE_TIMEOUT, warm_dashboard_counters
+from . import perf, reports, storage, uploads, worklist
+
+logger = logging.getLogger(__name__)
+
+# A run that outlasts its lease is presumed dead and the job may run again
+DEFAULT_LEASE = timedelta(hours=1)
+JOB_HISTORY_DAYS = 90
+
+REGISTRY = {}
+
+
+class Job:
+    def __init__(self, name, func, every=None, at=None, lease=DEFAULT_LEASE):
+        if (every is None) == (at is None):
+            raise ValueError(f'Job {name} needs exactly one of every= or at=')
+        self.name = name
+        self.func = func
+        self.every = every
+        self.at = at
+        self.lease = lease
+
+    def __str__(self):
+        return f'every {self.every}' if self.every else f'daily at {self.at:%H:%M}'
+
+    def next_run(self, after):
+        """
+        First time the job is due after ``after``.
+        """
+        if self.every:
+            return after + self.every
+        local = timezone.localtime(after)
+        due = local.replace(hour=self.at.hour, minute=self.at.minute, second=0, microsecond=0)
+        return due if due > local else due + timedelta(days=1)
+
+
+def job(name, **schedule):
+    """
+    Register the decorated function as a background job.
+    """
+    def register(func):
+        REGISTRY[name] = Job(name, func, **schedule)
+        return func
+    return register
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def sync_jobs(now=None):
+    """
+    Create the rows of newly registered jobs. Returns them by name.
+    """
+    now = now or timezone.now()
+    rows = {row.name: row for row in ScheduledJob.objects.filter(name__in=REGISTRY)}
+    for name, registered in REGISTRY.items():
+        if name not in rows:
+            rows[name], _ = ScheduledJob.objects.get_or_create(
+                name=name, defaults={'next_run_at': registered.next_run(now)}
+            )
+    return rows
+
+
+def _claim(name, worker, now, force):
+    jobs = ScheduledJob.objects.filter(name=name).filter(Q(locked_until__isnull=True) | Q(locked_until__lte=now))
+    if not force:
+        jobs = jobs.filter(enabled=True, next_run_at__lte=now)
+    return jobs.update(locked_by=worker, locked_until=now + REGISTRY[name].lease) == 1
+
+
+def run_job(name, worker=None, force=False):
+    """
+    Run job ``name`` if it is due (any time with ``force``) and no other
+    worker holds it. Returns the ``JobRun``, or None if it did not run.
+    """
+    registered = REGISTRY[name]
+    worker = worker or worker_name()
+    now = timezone.now()
+    if not _claim(name, worker, now, force):
+        return None
+
+    run = JobRun.objects.create(job=ScheduledJob.objects.get(name=name), worker=worker, started_at=now)
+    started = time.monotonic()
+    try:
+        run.result = registered.func()
+        run.status = JobRun.Status.SUCCEEDED
+    except Exception:
+        logger.exception('Job %s failed', name)
+        run.status = JobRun.Status.FAILED
+        run.error = traceback.format_exc()
+    run.finished_at = timezone.now()
+    run.duration_ms = round((time.monotonic() - started) * 1000)
+    run.save()
+
+    ScheduledJob.objects.filter(name=name, locked_by=worker).update(
+        locked_by='',
+        locked_until=None,
+        last_started_at=run.started_at,
+        last_finished_at=run.finished_at,
+        last_status=run.status,
+        next_run_at=registered.next_run(run.finished_at),
+    )
+    logger.info('Job %s %s in %s ms', name, run.status.lower(), run.duration_ms)
+    return run
+
+
+def run_due_jobs(worker=None):
+    """
+    Run every job that is due, oldest first. Returns the runs.
+    """
+    due = ScheduledJob.objects.filter(
+        name__in=REGISTRY, enabled=True, next_run_at__lte=timezone.now()
+    ).order_by('next_run_at').values_list('name', flat=True)
+    runs = (run_job(name, worker) for name in list(due))
+    return [run for run in runs if run is not None]
+
+
+@job('sweep_treatments', at=dt_time(0, 15))
+def sweep_treatments():
+    statuses, flags = worklist.sweep()
+    return {'statuses': statuses, 'flags': flags}
+
+
+@job('warm_dashboard_cache', every=timedelta(seconds=DASHBOARD_CACHE_TIMEOUT))
+def warm_dashboard_cache():
+    # A per-process cache would only warm this process, which no web worker reads
+    if isinstance(caches['default'], LocMemCache):
+        logger.warning('Not warming the dashboard cache: TREATMENT_CACHE_BACKEND=locmem is not shared with the web workers')
+        return {'skipped': 'locmem'}
+    # Only users who logged in recently are likely to open the dashboard soon
+    users = User.objects.filter(is_active=True, last_login__gte=timezone.now() - timedelta(hours=12)).filter(
+        Q(is_superuser=True) | Q(therapistprofile__isnull=False)
+    )
+    count = 0
+    for user in users.iterator():
+        warm_dashboard_counters(user)
+        count += 1
+    return {'users': count}
+
+
+@job('clear_sessions', at=dt_time(3, 0))
+def clear_sessions():
+    import_module(settings.SESSION_ENGINE).SessionStore.clear_expired()
+    # The job history is pruned here as well
+    deleted, _ = JobRun.objects.filter(started_at__lt=timezone.now() - timedelta(days=JOB_HISTORY_DAYS)).delete()
+    return {'job_runs_deleted': deleted}
+
+
+@job('render_reports', every=timedelta(seconds=30), lease=reports.RENDER_LEASE)
+def render_reports():
+    return reports.render_pending()
+
+
+@job('prune_reports', at=dt_time(3, 30))
+def prune_reports():
+    return {'deleted': reports.prune()}
+
+
+@job('prune_media', at=dt_time(3, 45))
+def prune_media():
+    return {'deleted': storage.prune()}
+
+
+@job('prune_uploads', at=dt_time(3, 50))
+def prune_uploads():
+    return {'deleted': uploads.prune()}
+
+
+@job('prune_view_timings', at=dt_time(3, 55))
+def prune_view_timings():
+    return {'deleted': perf.prune()}
+
+
+@job('activity_report', at=dt_time(6, 0))
+def activity_report():
+    """
+    Yesterday's treatments per therapist and the size of their worklists,
+    kept in the run history.
+    """
+    yesterday = timezone.localdate() - timedelta(days=1)
+    rows = Treatment.objects.filter(therapist__isnull=False).values('therapist', 'therapist__username').annotate(
+        completed=Count('pk', filter=Q(scheduled_date=yesterday, status=Treatment.TreatmentStatus.COMPLETED)),
+        missed=Count('pk', filter=Q(scheduled_date=yesterday, status=Treatment.TreatmentStatus.MISSED)),
+        needs_summary=Count('pk', filter=Q(needs_summary=True)),
+    ).order_by('therapist__username')
+    return {
+        'date': yesterday.isoformat(),
+        'therapists': [
+            {
+                'therapist': row['therapist__username'],
+                'completed': row['completed'],
+                'missed': row['missed'],
+                'needs_summary': row['needs_summary'],
+            }
+            for row in rows
+            if row['completed'] or row['missed'] or row['needs_summary']
+        ],
+    }
@@ -0,0 +1,216 @@
+"""
+Logging that stays off the request path.
+
+``QueuedFileHandler`` only puts records on an in-memory queue; a
+``QueueListener`` thread per process formats them and writes them to a
+``SharedRotatingFileHandler``, so a request never waits for the disk or
+for another thread's file lock. Messages are formatted in that thread
+too, from the record's arguments (``logger.info('... %s', value)``),
+unless an argument is a mutable object that could change by then. When
+the queue is full records are dropped and counted rather than block.
+
+``JsonFormatter`` writes one JSON object per line, with any ``extra``
+fields. ``SamplingFilter`` lets through only one in N INFO (and lower)
+records per message of the loggers in ``settings.LOG_SAMPLE_RATES``, for
+lines logged on every request; warnings and errors always pass.
+"""
+
+import copy
+import datetime
+import decimal
+import json
+import logging
+import os
+import queue
+import threading
+import uuid
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+QUEUE_SIZE = 10000
+# Distinct messages a SamplingFilter counts before it starts over
+MAX_SAMPLED_MESSAGES = 10000
+
+# Arguments that cannot change between the call and the listener's formatting
+_IMMUTABLE = (str, int, float, bool, type(None), bytes, datetime.date, datetime.time, decimal.Decimal, uuid.UUID)
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'sample_rate'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                            .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if getattr(record, 'sample_rate', 1) > 1:
+            entry['sampled'] = record.sample_rate
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep the first and then every Nth INFO-or-lower record of each message
+    of a sampled logger (or its children); ``rates`` maps logger names to N.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self._logger_rates = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def rate(self, name):
+        if name not in self._logger_rates:
+            rate, prefix = 1, name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition('.')[0]
+            self._logger_rates[name] = rate
+        return self._logger_rates[name]
+
+    def filter(self, record):
+        # Decided once per record, however many handlers share the filter
+        keep = getattr(record, '_sample_keep', None)
+        if keep is not None:
+            return keep
+        rate = self.rate(record.name) if record.levelno <= logging.INFO else 1
+        if rate > 1:
+            with self._lock:
+                if len(self._counts) >= MAX_SAMPLED_MESSAGES:
+                    self._counts.clear()
+                count = self._counts.get((record.name, record.msg), 0)
+                self._counts[(record.name, record.msg)] = count + 1
+            keep = count % rate == 0
+            record.sample_rate = rate
+        else:
+            keep = True
+        record._sample_keep = keep
+        return keep
+
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """
+    ``RotatingFileHandler`` for a file that several processes write. A
+    process that finds the file rotated by another reopens it instead of
+    writing on into the rotated copy, and only rotates a file that is still
+    the one it has open.
+    """
+
+    def _open(self):
+        stream = super()._open()
+        stat = os.fstat(stream.fileno())
+        self._identity = (stat.st_dev, stat.st_ino)
+        return stream
+
+    def _rotated_elsewhere(self):
+        try:
+            stat = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        return (stat.st_dev, stat.st_ino) != self._identity
+
+    def _reopen(self):
+        self.stream.close()
+        self.stream = self._open()
+
+    def emit(self, record):
+        if self.stream is not None and self._rotated_elsewhere():
+            self._reopen()
+        super().emit(record)
+
+    def doRollover(self):
+        if self.stream is not None and self._rotated_elsewhere():
+            self._reopen()
+            return
+        super().doRollover()
+
+
+class QueuedFileHandler(QueueHandler):
+    """
+    Hands records to a listener thread that writes them to a rotating file.
+    Takes the arguments of ``RotatingFileHandler``; the formatter set on
+    this handler is used by the listener.
+    """
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding='utf-8', queue_size=QUEUE_SIZE):
+        super().__init__(queue.Queue(queue_size))
+        self.queue_size = queue_size
+        self.target = SharedRotatingFileHandler(
+            filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding, delay=True
+        )
+        self.dropped = 0
+        self._closed = False
+        self._start_listener()
+        # gunicorn preloads the app before forking its workers, and threads
+        # do not survive a fork: each worker starts its own listener
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start_listener(self):
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+
+    def _after_fork(self):
+        if self._closed:
+            return
+        self.queue = queue.Queue(self.queue_size)
+        self.target.stream = None
+        self._start_listener()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def setLevel(self, level):
+        super().setLevel(level)
+        self.target.setLevel(level)
+
+    def prepare(self, record):
+        # Unlike QueueHandler.prepare, leave the formatting to the listener
+        record = copy.copy(record)
+        args = record.args.values() if isinstance(record.args, dict) else record.args or ()
+        if not all(isinstance(arg, _IMMUTABLE) for arg in args):
+            record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            warning = logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': '%d log records dropped: the log queue was full', 'args': (dropped,),
+            })
+            try:
+                self.queue.put_nowait(warning)
+            except queue.Full:
+                self.dropped += dropped
+
+    def close(self):
+        # Write out what is still queued before closing the file
+        if not self._closed:
+            self._closed = True
+            self.listener.stop()
+            self.target.close()
+        super().close()
@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from treatment_app.backends.sqlite3.base import DEFAULT_PRAGMAS
+from treatment_app.models import Family, Treatment
+
+# Stock Django: rollback journal, python's 5 second lock timeout, deferred transactions
+STOCK = {'pragmas': {'journal_mode': 'DELETE'}, 'timeout': 5, 'begin': 'BEGIN'}
+TUNED = {'pragmas': DEFAULT_PRAGMAS, 'timeout': 20, 'begin': 'BEGIN IMMEDIATE'}
+
+
+def _worker(path, mode, duration, write_ratio, treatment_ids, results):
+    conn = sqlite3.connect(path, timeout=mode['timeout'], isolation_level=None)
+    for name, value in mode['pragmas'].items():
+        if name != 'journal_mode':  # set once on the copy, see copy_database()
+            conn.execute(f'PRAGMA {name} = {value}')
+
+    treatments, families = Treatment._meta.db_table, Family._meta.db_table
+    read_sql = (
+        f"SELECT t.id, t.scheduled_date, t.status, f.name FROM {treatments} t"
+        f" LEFT JOIN {families} f ON f.id = t.family_id"
+        f" ORDER BY t.scheduled_date DESC LIMIT 10"
+    )
+    reads = writes = errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        try:
+            if random.random() < write_ratio:
+                # Read-then-write, like a form save
+                pk = random.choice(treatment_ids)
+                conn.execute(mode['begin'])
+                conn.execute(f"SELECT status FROM {treatments} WHERE id = ?", [pk]).fetchone()
+                conn.execute(f"UPDATE {treatments} SET updated_at = ? WHERE id = ?", [timezone.now().isoformat(), pk])
+                conn.execute('COMMIT')
+                writes += 1
+            else:
+                conn.execute(read_sql).fetchall()
+                reads += 1
+        except sqlite3.OperationalError:
+            errors += 1
+            try:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+            except sqlite3.OperationalError:
+                pass
+    conn.close()
+    results.put((reads, writes, errors))
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure concurrent read/write throughput on a copy of the SQLite database, '
+        'with stock settings and with the tuned backend'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='concurrent processes')
+        parser.add_argument('--duration', type=float, default=5, help='seconds per run')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='share of operations that write')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark only applies to SQLite')
+        treatment_ids = list(Treatment.objects.values_list('pk', flat=True)[:1000])
+        if not treatment_ids:
+            raise CommandError('The database has no treatments to update')
+
+        source = str(connection.settings_dict['NAME'])
+        connection.close()
+        with tempfile.TemporaryDirectory() as directory:
+            self.stdout.write(f"{'mode':<8} {'reads/s':>9} {'writes/s':>9} {'locked':>7}")
+            for label, mode in (('stock', STOCK), ('tuned', TUNED)):
+                # A fresh copy per run, since journal_mode=WAL persists in the file
+                path = os.path.join(directory, f'{label}.sqlite3')
+                self.copy_database(source, path, mode['pragmas']['journal_mode'])
+                reads, writes, errors, elapsed = self.run(path, mode, treatment_ids, options)
+                self.stdout.write(f'{label:<8} {reads / elapsed:>9.1f} {writes / elapsed:>9.1f} {errors:>7}')
+
+    def copy_database(self, source, path, journal_mode):
+        # The backup API includes pages still sitting in the source's WAL file
+        src, dst = sqlite3.connect(source), sqlite3.connect(path)
+        try:
+            src.backup(dst)
+            dst.execute(f'PRAGMA journal_mode = {journal_mode}')
+        finally:
+            src.close()
+            dst.close()
+
+    def run(self, path, mode, treatment_ids, options):
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=_worker,
+                args=(path, mode, options['duration'], options['write_ratio'], treatment_ids, results)
+            )
+            for _ in range(options['workers'])
+        ]
+        started = time.monotonic()
+        for process in processes:
+            process.start()
+        try:
+            # A lock wait can outlast the run by up to the sqlite timeout
+            totals = [results.get(timeout=options['duration'] + mode['timeout'] + 10) for _ in processes]
+        except queue.Empty:
+            raise CommandError('A benchmark worker did not report back')
+        finally:
+            for process in processes:
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.terminate()
+        elapsed = time.monotonic() - started
+        reads, writes, errors = (sum(column) for column in zip(*totals))
+        return reads, writes, errors, elapsed
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from treatment_app.access import check_access_index, rebuild_access_index
+
+
+class Command(BaseCommand):
+    help = 'Verify that the therapist access index matches the current data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rebuild the index when it is inconsistent')
+        parser.add_argument('--show', type=int, default=10, help='Number of differing rows to print')
+
+    def handle(self, *args, **options):
+        missing, stale = check_access_index()
+        if not missing and not stale:
+            self.stdout.write(self.style.SUCCESS('Access index is consistent'))
+            return
+
+        header = '(user, family, child, treatment)'
+        for label, rows in (('Missing', missing), ('Stale', stale)):
+            if rows:
+                self.stdout.write(f'{label} rows {header}: {len(rows)}')
+                for row in sorted(rows, key=str)[:options['show']]:
+                    self.stdout.write(f'  {row}')
+
+        if options['fix']:
+            count = rebuild_access_index()
+            self.stdout.write(self.style.SUCCESS(f'Access index rebuilt: {count} rows'))
+            return
+
+        raise CommandError('Access index is inconsistent; run with --fix or rebuild_access_index')
@@ -0,0 +1,242 @@
+import re
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.exceptions import PermissionDenied
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from treatment_app.models import Family, Child, Treatment, Document
+
+# (url name, model whose first row supplies the pk, query string)
+VIEWS = [
+    ('treatment_app:dashboard', None, {}),
+    ('treatment_app:family-list', None, {}),
+    ('treatment_app:family-list', None, {'q': 'כהן'}),
+    ('treatment_app:child-list', None, {}),
+    ('treatment_app:treatment-list', None, {}),
+    ('treatment_app:document-list', None, {}),
+    ('treatment_app:therapist-list', None, {}),
+    ('treatment_app:weekly_calendar', None, {}),
+    ('treatment_app:treatment_calendar_data', None, 'calendar'),
+    ('treatment_app:search', None, {'q': 'כהן'}),
+    ('treatment_app:family-detail', Family, {}),
+    ('treatment_app:child-detail', Child, {}),
+    ('treatment_app:treatment-detail', Treatment, {}),
+    ('treatment_app:document-detail', Document, {}),
+    ('api:family-list', None, {}),
+    ('api:child-list', None, {}),
+    ('api:treatment-list', None, {}),
+    ('api:document-list', None, {}),
+]
+
+# SQLite: "SCAN treatment_app_family" (a bare SCAN, no index); PostgreSQL: "Seq Scan on ..."
+FULL_SCAN = {
+    'sqlite': re.compile(r'\bSCAN (?!CONSTANT ROW|subquery)(\w+)(?! USING)(?! VIRTUAL)(?:\s|$)'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+TEMP_SORT = {
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR ORDER BY'),
+    'postgresql': re.compile(r'\bSort\b'),
+}
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_WHERE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+_WHERE_END = re.compile(r'\b(?:GROUP BY|HAVING|ORDER BY|LIMIT|UNION|EXCEPT|INTERSECT)\b', re.IGNORECASE)
+_LIMIT = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+_ORDER_KEY = re.compile(r'\bORDER BY\s+([\w".]+)', re.IGNORECASE)
+
+
+def _levels(sql):
+    """
+    The statement and each of its subqueries, outermost first, every one
+    with its own subqueries (and string literals) blanked out.
+    """
+    stack, levels = [[]], []
+    for char in _STRING.sub("''", sql):
+        if char == '(':
+            stack[-1].append('(')
+            stack.append([])
+        elif char == ')' and len(stack) > 1:
+            levels.append(''.join(stack.pop()))
+            stack[-1].append(')')
+        else:
+            stack[-1].append(char)
+    return [''.join(stack[0]), *levels]
+
+
+def _where(level):
+    match = _WHERE.search(level)
+    if not match:
+        return ''
+    end = _WHERE_END.search(level, match.end())
+    return level[match.end():end.start() if end else None]
+
+
+def _pk_column(table):
+    for model in apps.get_models():
+        if model._meta.db_table == table:
+            return model._meta.pk.column
+    return None
+
+
+def classify_scans(sql, full_scans, temp_sort):
+    """
+    Split the tables a plan scans into real full scans and scans that are
+    fine by construction. A scanned table no ``WHERE`` of the statement
+    filters on is excused when:
+
+    - the statement's own ``ORDER BY`` starts with the table's primary key,
+      the rowid order a bare scan walks in, and its ``LIMIT`` stops the scan
+      after the page, e.g. the API's cursor pages on ``-id``
+    - the statement has neither ``WHERE`` nor ``LIMIT``, so the page lists
+      every row anyway, e.g. the therapist list or a paginator's ``COUNT(*)``
+
+    ``LIMIT`` and ``ORDER BY`` only count in the outer statement, not in a
+    subquery. Returns ``(full_scans, notes)``.
+    """
+    levels = _levels(sql)
+    outer = levels[0]
+    limited = bool(_LIMIT.search(outer))
+    order_key = _ORDER_KEY.search(outer)
+    order_key = order_key.group(1).replace('"', '') if order_key else None
+
+    full, notes = [], []
+    for table in full_scans:
+        name = rf'(?<![\w"])"?{re.escape(table)}"?'
+        column, source = re.compile(name + r'\.'), re.compile(rf'\b(?:FROM|JOIN)\s+{name}(?![\w"])', re.IGNORECASE)
+        # Unqualified columns belong to the table the statement reads
+        filtered = any(
+            column.search(where) or (where and '.' not in where and source.search(level))
+            for level in levels for where in [_where(level)]
+        )
+        pk_column = _pk_column(table) or 'id'
+        if filtered:
+            full.append(table)
+        elif limited and not temp_sort and order_key in (pk_column, f'{table}.{pk_column}'):
+            notes.append(f'ordered scan, stops at LIMIT: {table}')
+        elif not limited and not _where(outer):
+            notes.append(f'reads the whole table, as the page lists every row: {table}')
+        else:
+            full.append(table)
+    return full, notes
+
+
+class Command(BaseCommand):
+    help = (
+        'Run every main view, EXPLAIN each query it executes and flag full table '
+        'scans and sorts that no index covers'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='username to run the views as (default: first superuser)')
+        parser.add_argument('--show-plans', action='store_true', help='print every query plan')
+        parser.add_argument('--fail-on-scan', action='store_true', help='exit with an error if any full scan is found')
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='run ANALYZE first, so the planner chooses with current table statistics'
+        )
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in FULL_SCAN:
+            raise CommandError(f'No query plan support for {vendor}')
+        user = self.get_user(options['user'])
+        if options['analyze']:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        scans = 0
+        for name, model, params in VIEWS:
+            path = self.build_path(name, model)
+            if path is None:
+                self.stdout.write(self.style.WARNING(f'{name}: no rows to build the URL, skipped'))
+                continue
+            if params == 'calendar':
+                today = timezone.localdate()
+                params = {'start': today - timedelta(days=7), 'end': today + timedelta(days=35)}
+
+            try:
+                queries = self.capture(path, params, user)
+            except PermissionDenied:
+                self.stdout.write(self.style.WARNING(f'{name}: not allowed for {user.username}, skipped'))
+                continue
+            label = f"{path}?{urlencode(params)}" if params else path
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{name} ({label}): {len(queries)} queries'))
+            for sql in queries:
+                plan = self.explain(sql)
+                temp_sort = bool(TEMP_SORT[vendor].search(plan))
+                full_scans, notes = classify_scans(sql, sorted(set(FULL_SCAN[vendor].findall(plan))), temp_sort)
+                if full_scans or temp_sort or options['show_plans']:
+                    self.stdout.write(f'  {sql[:200]}')
+                if full_scans:
+                    scans += 1
+                    self.stdout.write(self.style.ERROR(f"    full scan: {', '.join(full_scans)}"))
+                if options['show_plans']:
+                    for note in notes:
+                        self.stdout.write(f'    {note}')
+                if temp_sort:
+                    self.stdout.write(self.style.WARNING('    sort without index'))
+                if options['show_plans']:
+                    for line in plan.splitlines():
+                        self.stdout.write(f'    | {line}')
+
+        summary = f'{scans} queries with full table scans'
+        if scans and options['fail_on_scan']:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary) if not scans else self.style.WARNING(summary))
+
+    def get_user(self, username):
+        users = User.objects.filter(username=username) if username else User.objects.filter(is_superuser=True)
+        user = users.order_by('pk').first()
+        if user is None:
+            raise CommandError('No user to run the views as; pass --user')
+        return user
+
+    def build_path(self, name, model):
+        if model is None:
+            if name.startswith('api:'):
+                return reverse(name, kwargs={'version': 'v1'})
+            return reverse(name)
+        pk = model.objects.order_by('pk').values_list('pk', flat=True).first()
+        return reverse(name, kwargs={'pk': pk}) if pk is not None else None
+
+    def capture(self, path, params, user):
+        """
+        Call the view directly (no middleware, no session writes) and return
+        the distinct SELECT statements it ran.
+        """
+        request = RequestFactory().get(path, params, secure=True)
+        request.user = user
+        request.session = SessionBase()
+        request._messages = FallbackStorage(request)
+        # DRF reads the user from the wrapped Django request
+        request._force_auth_user = user
+
+        match = resolve(path)
+        with CaptureQueriesContext(connection) as captured:
+            response = match.func(request, *match.args, **match.kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+
+        queries = []
+        for query in captured.captured_queries:
+            sql = query['sql']
+            if sql.lstrip().upper().startswith('SELECT') and sql not in queries:
+                queries.append(sql)
+        return queries
+
+    def explain(self, sql):
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            rows = cursor.fetchall()
+        # SQLite rows are (id, parent, notused, detail); PostgreSQL rows are (line,)
+        return '\n'.join(str(row[-1]) for row in rows)
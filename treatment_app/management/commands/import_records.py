@@ -0,0 +1,52 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from treatment_app.importing import CHUNK_SIZE, IMPORTERS, ImportFileError, import_csv
+
+
+class Command(BaseCommand):
+    help = (
+        'Import families, children or treatments from a UTF-8 CSV file with the same '
+        'validation as the forms. Import families first, then children, then treatments.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path', help='CSV file whose header row names the columns')
+        parser.add_argument('--dry-run', action='store_true', help='validate only, write nothing')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows validated and written together')
+        parser.add_argument('--errors', help='write every row error to this CSV file')
+        parser.add_argument('--show-errors', type=int, default=20, help='row errors to print (default 20)')
+        parser.add_argument('--columns', action='store_true', help='list the columns of KIND and exit')
+
+    def handle(self, *args, **options):
+        importer = IMPORTERS[options['kind']]
+        if options['columns']:
+            required = set(importer.required)
+            for column in importer.columns():
+                self.stdout.write(f"{column}{' (required)' if column in required else ''}")
+            return
+
+        started = time.monotonic()
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as f:
+                result = import_csv(options['kind'], f, dry_run=options['dry_run'], chunk_size=options['chunk_size'])
+        except (OSError, UnicodeDecodeError, ImportFileError) as e:
+            raise CommandError(str(e))
+        elapsed = time.monotonic() - started
+
+        for error in result.errors[:options['show_errors']]:
+            self.stdout.write(self.style.WARNING(f'line {error}'))
+        if len(result.errors) > options['show_errors']:
+            self.stdout.write(f"... {len(result.errors) - options['show_errors']} more errors")
+        if options['errors']:
+            with open(options['errors'], 'w', newline='', encoding='utf-8-sig') as f:
+                writer = csv.writer(f)
+                writer.writerow(['line', 'column', 'error'])
+                writer.writerows((error.line, error.column, error.message) for error in result.errors)
+
+        verb = 'would be imported' if options['dry_run'] else 'imported'
+        summary = f'{result.created} of {result.rows} rows {verb}, {result.failed} rejected ({elapsed:.1f}s)'
+        self.stdout.write(self.style.SUCCESS(summary) if not result.failed else self.style.WARNING(summary))
@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from treatment_app import perf
+
+
+class Command(BaseCommand):
+    help = (
+        'Print the slowest views by 95th percentile and the views whose requests '
+        'repeat one query the most (likely N+1), from the timings saved by PerfMiddleware'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help='period to report on (default 24)')
+        parser.add_argument('--limit', type=int, default=15, help='views per table (default 15)')
+        parser.add_argument('--view', help='only this view name, e.g. treatment_app:dashboard')
+        parser.add_argument('--min-repeats', type=int, default=5, help='repeats of one query worth listing (default 5)')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['hours'])
+        views = perf.summarize(since, view=options['view'])
+        if not views:
+            self.stdout.write('No timings recorded in this period')
+            return
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Slowest views, last {options['hours']:g} hours (ms)"))
+        self.stdout.write(
+            f"{'view':<45} {'requests':>8} {'p50':>7} {'p95':>7} {'p99':>7} {'queries':>7} {'db':>7} {'tpl':>7}"
+        )
+        for entry in sorted(views, key=lambda entry: entry['p95'], reverse=True)[:options['limit']]:
+            self.stdout.write(
+                f"{entry['view'][:45]:<45} {entry['requests']:>8} {entry['p50']:>7.0f} {entry['p95']:>7.0f} "
+                f"{entry['p99']:>7.0f} {entry['avg_queries']:>7.1f} {entry['avg_db_ms']:>7.1f} "
+                f"{entry['avg_template_ms']:>7.1f}"
+            )
+
+        repeated = [entry for entry in views if entry['repeated_count'] >= options['min_repeats']]
+        self.stdout.write('')
+        self.stdout.write(self.style.MIGRATE_HEADING('Queries repeated within one request (N+1 suspects)'))
+        if not repeated:
+            self.stdout.write('None')
+        for entry in sorted(repeated, key=lambda entry: entry['repeated_count'], reverse=True)[:options['limit']]:
+            self.stdout.write(
+                f"{entry['view']}: {entry['repeated_count']} times in one request "
+                f"(up to {entry['max_queries']} queries per request)"
+            )
+            self.stdout.write(f"    {entry['repeated_sql'][:300]}")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from treatment_app.access import rebuild_access_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the therapist access index from scratch'
+
+    def handle(self, *args, **options):
+        count = rebuild_access_index()
+        self.stdout.write(self.style.SUCCESS(f'Access index rebuilt: {count} rows'))
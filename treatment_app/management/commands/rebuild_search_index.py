@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from treatment_app.search import rebuild_search_index, search_available
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from scratch'
+
+    def handle(self, *args, **options):
+        if not search_available():
+            raise CommandError('The full-text search index requires SQLite (FTS5)')
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt: {count} rows'))
@@ -0,0 +1,77 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from treatment_app import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the scheduled background jobs (status sweep, cache warmup, session '
+        'cleanup, reports). Several workers may run at once; each job runs on one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='run the jobs that are due and exit (for cron)')
+        parser.add_argument('--job', action='append', dest='names', help='run this job now, due or not (repeatable)')
+        parser.add_argument('--list', action='store_true', help='show the jobs, their schedule and last run')
+        parser.add_argument('--poll', type=float, default=30, help='seconds between checks for due jobs')
+
+    def handle(self, *args, **options):
+        rows = jobs.sync_jobs()
+        if options['list']:
+            return self.list_jobs(rows)
+
+        if options['names']:
+            unknown = set(options['names']) - set(jobs.REGISTRY)
+            if unknown:
+                raise CommandError(f"Unknown jobs: {', '.join(sorted(unknown))}")
+            for name in options['names']:
+                self.report(name, jobs.run_job(name, force=True))
+            return
+
+        if options['once']:
+            for run in jobs.run_due_jobs():
+                self.report(run.job.name, run)
+            return
+
+        self.stopping = False
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.stop)
+        self.stdout.write(f"Running jobs as {jobs.worker_name()}, checking every {options['poll']}s")
+        while not self.stopping:
+            close_old_connections()
+            for run in jobs.run_due_jobs():
+                self.report(run.job.name, run)
+            self.sleep(options['poll'])
+
+    def stop(self, signum, frame):
+        # Finish the current job, then exit
+        self.stopping = True
+
+    def sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self.stopping and time.monotonic() < deadline:
+            time.sleep(min(1, deadline - time.monotonic()))
+
+    def report(self, name, run):
+        if run is None:
+            self.stdout.write(self.style.WARNING(f'{name}: held by another worker, skipped'))
+        elif run.status == run.Status.FAILED:
+            self.stdout.write(self.style.ERROR(f'{name}: failed after {run.duration_ms} ms'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{name}: {run.result} ({run.duration_ms} ms)'))
+
+    def list_jobs(self, rows):
+        self.stdout.write(f"{'job':<22} {'schedule':<22} {'next run':<17} {'last':<10} {'ms':>7}")
+        for name, registered in jobs.REGISTRY.items():
+            row = rows[name]
+            last = row.runs.order_by('-started_at').first()
+            next_run = f'{timezone.localtime(row.next_run_at):%Y-%m-%d %H:%M}' if row.enabled else 'disabled'
+            self.stdout.write(
+                f"{name:<22} {registered!s:<22} {next_run:<17} "
+                f"{row.last_status or '-':<10} {last.duration_ms if last and last.duration_ms is not None else '-':>7}"
+            )
@@ -0,0 +1,40 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from treatment_app import storage
+from treatment_app.caching import bump_cache_version
+
+
+class Command(BaseCommand):
+    help = (
+        'Move files uploaded before content-addressed storage into it, so that '
+        'duplicates are stored once, and point their records to the new names'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-originals', action='store_true', help='delete the files once moved')
+
+    def handle(self, *args, **options):
+        moved = {}
+        for name in sorted(storage.referenced_names()):
+            if storage.digest_of(name):
+                continue
+            if not default_storage.exists(name):
+                self.stdout.write(self.style.WARNING(f'missing: {name}'))
+                continue
+            with default_storage.open(name) as f:
+                moved[name] = default_storage.save(name, f)
+
+        with transaction.atomic():
+            for model, fields in storage.FILE_FIELDS.items():
+                for field in fields:
+                    for old, new in moved.items():
+                        model.objects.filter(**{field: old}).update(**{field: new})
+        for model in storage.FILE_FIELDS:
+            bump_cache_version(model)
+
+        if options['delete_originals']:
+            for name in moved:
+                default_storage.delete(name)
+        self.stdout.write(self.style.SUCCESS(f'{len(moved)} files stored as {len(set(moved.values()))}'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from treatment_app.worklist import sweep
+
+
+class Command(BaseCommand):
+    help = (
+        'Move past SCHEDULED treatments to MISSED/PENDING_SUMMARY and refresh the '
+        'needs-summary flags, in bulk'
+    )
+
+    def handle(self, *args, **options):
+        statuses, flags = sweep()
+        self.stdout.write(self.style.SUCCESS(f'{statuses} statuses and {flags} summary flags updated'))
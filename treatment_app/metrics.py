@@ -0,0 +1,437 @@
+"""
+Prometheus metrics for the web tier, served at ``/metrics`` in the text
+exposition format.
+
+``PerfMiddleware`` feeds the request figures (latency histogram, status
+codes, queries) per view, and the configured cache backends are wrapped
+to count hits and misses per kind of key. A process keeps these in memory
+and every ``METRICS_FLUSH_SECONDS`` writes them to its own file in
+``settings.METRICS_DIR``. A scrape flushes the answering process and adds
+up the files of all processes, so whichever gunicorn worker answers it
+reports for all of them (the others up to one flush behind), and totals
+never go down from one scrape to the next. Files of processes that have exited are folded into a
+shared file, so totals do not drop when a worker is recycled. Without
+``METRICS_DIR`` a process reports only itself.
+
+Worker uptime and memory are reported per live process. Database file
+sizes and the business gauges (past-due treatments and the like) are read
+when scraped.
+"""
+
+import atexit
+import contextvars
+import fcntl
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import JobRun, Treatment, Upload
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Request latency buckets (seconds)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ARCHIVE = 'exited.json'
+
+COUNTERS = {
+    'treatment_http_requests_total': 'Requests served, by view and status code.',
+    'treatment_db_queries_total': 'SQL statements run while serving requests, by view.',
+    'treatment_db_query_seconds_total': 'Time spent in SQL statements while serving requests, by view.',
+    'treatment_cache_requests_total': 'Cache lookups, by kind of key and result (hit or miss).',
+}
+HISTOGRAMS = {
+    'treatment_http_request_duration_seconds': 'Request latency, by view.',
+}
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+_started = time.time()
+_last_flush = time.monotonic()
+
+
+def _reset_after_fork():
+    # A preloaded master forks the workers: each starts counting afresh
+    global _lock, _counters, _histograms, _started, _last_flush
+    _lock = threading.Lock()
+    _counters = defaultdict(float)
+    _histograms = {}
+    _started = time.time()
+    _last_flush = time.monotonic()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _counters[name, tuple(sorted(labels.items()))] += value
+
+
+def observe(name, value, **labels):
+    key = name, tuple(sorted(labels.items()))
+    with _lock:
+        # Per-bucket (not cumulative) counts, then +Inf, then the sum
+        histogram = _histograms.setdefault(key, [0] * (len(BUCKETS) + 1) + [0.0])
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                break
+        else:
+            index = len(BUCKETS)
+        histogram[index] += 1
+        histogram[-1] += value
+
+
+def record_request(view, status, timer):
+    """
+    Count a finished request; ``timer`` is its ``perf.RequestTimer``.
+    """
+    observe('treatment_http_request_duration_seconds', timer.elapsed(), view=view)
+    inc('treatment_http_requests_total', view=view, status=str(status))
+    inc('treatment_db_queries_total', timer.queries, view=view)
+    inc('treatment_db_query_seconds_total', timer.db_time, view=view)
+
+
+def cache_kind(key):
+    """
+    A bounded label for a cache key: the prefix before ``:`` of the app's
+    own keys, or the fragment name of a ``{% cache %}`` tag.
+    """
+    key = str(key)
+    if key.startswith('template.cache.'):
+        return 'fragment:' + key.split('.')[2]
+    prefix, sep, _ = key.partition(':')
+    if sep and prefix.replace('-', '').replace('_', '').isalpha():
+        return prefix
+    return 'other'
+
+
+_MISSING = object()
+_counting = contextvars.ContextVar('metrics_cache_counting', default=False)
+
+
+def _counted_get(get):
+    def wrapper(self, key, default=None, version=None):
+        if _counting.get():
+            return get(self, key, default, version)
+        token = _counting.set(True)
+        try:
+            value = get(self, key, _MISSING, version)
+        finally:
+            _counting.reset(token)
+        inc('treatment_cache_requests_total', kind=cache_kind(key), result='miss' if value is _MISSING else 'hit')
+        return default if value is _MISSING else value
+    wrapper.counted = True
+    return wrapper
+
+
+def _counted_get_many(get_many):
+    def wrapper(self, keys, version=None):
+        if _counting.get():
+            return get_many(self, keys, version)
+        keys = list(keys)
+        token = _counting.set(True)
+        try:
+            found = get_many(self, keys, version)
+        finally:
+            _counting.reset(token)
+        for key in keys:
+            inc('treatment_cache_requests_total', kind=cache_kind(key), result='hit' if key in found else 'miss')
+        return found
+    wrapper.counted = True
+    return wrapper
+
+
+def install_cache_counter():
+    """
+    Count hits and misses of every configured cache backend. Nested calls
+    (``get_many`` built on ``get`` or the other way round) count once.
+    """
+    for alias in settings.CACHES:
+        backend = type(caches[alias])
+        if not getattr(backend.get, 'counted', False):
+            backend.get = _counted_get(backend.get)
+        if not getattr(backend.get_many, 'counted', False):
+            backend.get_many = _counted_get_many(backend.get_many)
+
+
+def resident_memory_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def snapshot():
+    """
+    This process's figures, as written to its file.
+    """
+    with _lock:
+        counters = [[name, labels, value] for (name, labels), value in _counters.items()]
+        histograms = [[name, labels, list(values)] for (name, labels), values in _histograms.items()]
+    return {
+        'pid': os.getpid(),
+        'started': _started,
+        'rss': resident_memory_bytes(),
+        'counters': counters,
+        'histograms': histograms,
+    }
+
+
+def _process_file(directory):
+    return os.path.join(directory, f'{os.getpid()}-{int(_started * 1000)}.json')
+
+
+def _write(path, data):
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.metrics-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp, path)
+
+
+def flush_due():
+    return bool(settings.METRICS_DIR) and time.monotonic() - _last_flush >= settings.METRICS_FLUSH_SECONDS
+
+
+def flush():
+    """
+    Write this process's figures to its file in ``METRICS_DIR``.
+    """
+    global _last_flush
+    _last_flush = time.monotonic()
+    directory = settings.METRICS_DIR
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _write(_process_file(directory), snapshot())
+
+
+@atexit.register
+def _flush_at_exit():
+    # What a recycled worker counted since its last flush
+    if _counters or _histograms:
+        flush()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(into, data):
+    for name, labels, value in data['counters']:
+        into['counters'][name, tuple(map(tuple, labels))] += value
+    for name, labels, values in data['histograms']:
+        key = name, tuple(map(tuple, labels))
+        merged = into['histograms'].setdefault(key, [0] * len(values))
+        into['histograms'][key] = [a + b for a, b in zip(merged, values)]
+
+
+def _dump(merged):
+    return {
+        'counters': [[name, labels, value] for (name, labels), value in merged['counters'].items()],
+        'histograms': [[name, labels, values] for (name, labels), values in merged['histograms'].items()],
+    }
+
+
+def gather():
+    """
+    Counters and histograms of all processes added up, and the snapshots
+    of the live ones.
+
+    With ``METRICS_DIR`` every process, this one included, is read from its
+    file. Adding this process's in-memory figures to the others' flushed
+    ones would report more than the next scrape, answered by another
+    worker, could see.
+    """
+    merged = {'counters': defaultdict(float), 'histograms': {}}
+    directory = settings.METRICS_DIR
+    if not directory:
+        live = [snapshot()]
+    else:
+        flush()
+        live = []
+        with open(os.path.join(directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = os.path.join(directory, ARCHIVE)
+            archive = {'counters': defaultdict(float), 'histograms': {}}
+            archived = _read(archive_path)
+            if archived:
+                _merge(archive, archived)
+            exited = []
+            for entry in os.scandir(directory):
+                if not entry.name.endswith('.json') or entry.name == ARCHIVE:
+                    continue
+                data = _read(entry.path)
+                if data is None:
+                    continue
+                if _alive(data['pid']):
+                    live.append(data)
+                else:
+                    _merge(archive, data)
+                    exited.append(entry.path)
+            if exited:
+                _write(archive_path, _dump(archive))
+                for path in exited:
+                    os.unlink(path)
+        _merge(merged, _dump(archive))
+    for data in live:
+        _merge(merged, data)
+    return merged, live
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _number(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 'NaN'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Exposition:
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help_text, samples):
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        for suffix, labels, value in samples:
+            self.lines.append(f'{name}{suffix}{_labels(labels)} {_number(value)}')
+
+    def gauge(self, name, help_text, samples):
+        self.family(name, 'gauge', help_text, [('', labels, value) for labels, value in samples])
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def _database_sizes():
+    """
+    ``(alias, database bytes, WAL bytes)`` of each SQLite database on disk.
+    """
+    sizes = []
+    for alias in connections:
+        connection = connections[alias]
+        if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+            continue
+        name = str(connection.settings_dict['NAME'])
+        database, wal = (os.path.getsize(path) if os.path.exists(path) else 0 for path in (name, name + '-wal'))
+        sizes.append((alias, database, wal))
+    return sizes
+
+
+def _business_gauges():
+    today = timezone.localdate()
+    treatments = Treatment.objects.all()
+    last_success = (
+        JobRun.objects.filter(status=JobRun.Status.SUCCEEDED)
+        .values('job__name').annotate(last=Max('finished_at')).order_by('job__name')
+    )
+    return {
+        # Past due as on the treatment list: the stored needs-summary flag
+        'past_due': treatments.filter(needs_summary=True).count(),
+        'scheduled_today': treatments.filter(scheduled_date=today).count(),
+        'uploads_in_progress': Upload.objects.count(),
+        'job_last_success': [(row['job__name'], row['last'].timestamp()) for row in last_success if row['last']],
+    }
+
+
+def render():
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    merged, live = gather()
+    out = Exposition()
+
+    for name, help_text in HISTOGRAMS.items():
+        samples = []
+        for (metric, labels), values in sorted(merged['histograms'].items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (math.inf,), values):
+                cumulative += count
+                le = '+Inf' if bound == math.inf else repr(bound)
+                samples.append(('_bucket', labels + (('le', le),), cumulative))
+            samples.append(('_sum', labels, values[-1]))
+            samples.append(('_count', labels, cumulative))
+        out.family(name, 'histogram', help_text, samples)
+
+    for name, help_text in COUNTERS.items():
+        out.family(name, 'counter', help_text, [
+            ('', labels, value) for (metric, labels), value in sorted(merged['counters'].items()) if metric == name
+        ])
+
+    lookups = defaultdict(lambda: {'hit': 0, 'miss': 0})
+    for (metric, labels), value in merged['counters'].items():
+        if metric == 'treatment_cache_requests_total':
+            labels = dict(labels)
+            lookups[labels['kind']][labels['result']] += value
+    out.gauge('treatment_cache_hit_ratio', 'Share of cache lookups that were hits, by kind of key.', [
+        ((('kind', kind),), counts['hit'] / (counts['hit'] + counts['miss']))
+        for kind, counts in sorted(lookups.items())
+    ])
+
+    now = time.time()
+    out.gauge('treatment_worker_uptime_seconds', 'Seconds since the worker process started.', [
+        ((('pid', data['pid']),), now - data['started']) for data in live
+    ])
+    out.gauge('treatment_worker_resident_memory_bytes', 'Resident memory of the worker process.', [
+        ((('pid', data['pid']),), data['rss']) for data in live if data['rss'] is not None
+    ])
+
+    sizes = _database_sizes()
+    out.gauge('treatment_sqlite_database_bytes', 'Size of the SQLite database file.', [
+        ((('database', alias),), database) for alias, database, _ in sizes
+    ])
+    out.gauge('treatment_sqlite_wal_bytes', 'Size of the SQLite write-ahead log.', [
+        ((('database', alias),), wal) for alias, _, wal in sizes
+    ])
+
+    business = _business_gauges()
+    out.gauge('treatment_treatments_past_due', 'Past treatments still waiting for a summary.', [
+        ((), business['past_due'])
+    ])
+    out.gauge('treatment_treatments_scheduled_today', 'Treatments scheduled for today.', [
+        ((), business['scheduled_today'])
+    ])
+    out.gauge('treatment_uploads_in_progress', 'Chunked uploads started and not yet finished.', [
+        ((), business['uploads_in_progress'])
+    ])
+    out.gauge('treatment_job_last_success_timestamp_seconds', 'When each background job last succeeded.', [
+        ((('job', job),), timestamp) for job, timestamp in business['job_last_success']
+    ])
+    return out.text()
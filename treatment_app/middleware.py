@@ -0,0 +1,113 @@
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
+
+from . import health, metrics, perf, routers
+
+REPLICA_PIN_COOKIE = 'primary_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaPinningMiddleware:
+    """
+    Pin unsafe requests, and a client's requests for ``REPLICA_PIN_SECONDS``
+    after it wrote, to the primary database (see ``treatment_app.routers``).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 15)
+
+    def __call__(self, request):
+        pinned = request.method not in SAFE_METHODS or REPLICA_PIN_COOKIE in request.COOKIES
+        token = routers.begin_request(pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.end_request(token)
+
+        if wrote and routers.replica_available():
+            response.set_cookie(
+                REPLICA_PIN_COOKIE, '1',
+                max_age=self.pin_seconds,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite='Lax'
+            )
+        return response
+
+
+class PerfMiddleware:
+    """
+    Time requests, their queries and their templates per view (see
+    ``treatment_app.perf``), and count them for ``/metrics`` (see
+    ``treatment_app.metrics``). Goes right after ``HealthCheckMiddleware``
+    in ``MIDDLEWARE`` so the time covers the other middleware too, while
+    load balancer probes are neither timed nor counted.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PERF_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        perf.install_template_timer()
+        metrics.install_cache_counter()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        perf.set_view(request.resolver_match.view_name)
+
+    def __call__(self, request):
+        timer, token = perf.start()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timer))
+                response = self.get_response(request)
+        finally:
+            perf.stop(token)
+
+        view = timer.view or '<unresolved>'
+        perf.record(view, timer)
+        metrics.record_request(view, response.status_code, timer)
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or (user is not None and user.is_staff):
+            response['Server-Timing'] = timer.server_timing()
+        # Not while a test or debugging session is capturing queries, which
+        # should only see the request's own
+        if perf.flush_due() and not connections['default'].force_debug_cursor:
+            perf.flush()
+        if metrics.flush_due():
+            metrics.flush()
+        return response
+
+
+class HealthCheckMiddleware:
+    """
+    Answer ``/healthz`` (liveness) and ``/readyz`` (readiness, 503 when a
+    check fails) from ``treatment_app.health``. Goes first in
+    ``MIDDLEWARE``, so probes cost no session, auth or database work beyond
+    the cached checks.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path_info == '/healthz':
+            return self.respond({'status': 'ok'}, 200)
+        if request.path_info == '/readyz':
+            results, age = health.readiness()
+            ready = all(result['ok'] for result in results.values())
+            return self.respond(
+                {'status': 'ok' if ready else 'unavailable', 'age': round(age, 2), 'checks': results},
+                200 if ready else 503,
+            )
+        return self.get_response(request)
+
+    def respond(self, data, status):
+        response = JsonResponse(data, status=status)
+        response['Cache-Control'] = 'no-store'
+        return response
@@ -0,0 +1,79 @@
+# Generated by Django 4.2.9 on 2026-10-18 02:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_access_index(apps, schema_editor):
+    # The visibility rules as they were when this migration was written;
+    # treatment_app.access may change, this migration must not
+    Family = apps.get_model('treatment_app', 'Family')
+    Child = apps.get_model('treatment_app', 'Child')
+    Treatment = apps.get_model('treatment_app', 'Treatment')
+    TherapistAccess = apps.get_model('treatment_app', 'TherapistAccess')
+
+    rows = set()
+    family_therapist = dict(Family.objects.values_list('pk', 'therapist_id'))
+    for pk, user_id in family_therapist.items():
+        if user_id is not None:
+            rows.add((user_id, pk, None, None))
+    for child_id, family_id, child_user_id in Child.objects.values_list('pk', 'family_id', 'therapist__user_id'):
+        for user_id in {child_user_id, family_therapist.get(family_id)} - {None}:
+            rows.add((user_id, family_id, child_id, None))
+        if child_user_id is not None:
+            rows.add((child_user_id, family_id, None, None))
+    treatments = Treatment.objects.values_list(
+        'pk', 'family_id', 'child_id', 'child__family_id', 'therapist_id',
+        'child__therapist__user_id', 'family__therapist_id', 'child__family__therapist_id'
+    )
+    for (treatment_id, family_id, child_id, child_family_id, therapist_id,
+         child_user_id, family_user_id, child_family_user_id) in treatments:
+        for user_id in {therapist_id, child_user_id, family_user_id, child_family_user_id} - {None}:
+            rows.add((user_id, family_id or child_family_id, child_id, treatment_id))
+
+    TherapistAccess.objects.bulk_create(
+        [
+            TherapistAccess(user_id=user_id, family_id=family_id, child_id=child_id, treatment_id=treatment_id)
+            for user_id, family_id, child_id, treatment_id in rows
+        ],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('treatment_app', '0014_alter_family_father_consent_form_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TherapistAccess',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('child', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='access_entries', to='treatment_app.child', verbose_name='ילד')),
+                ('family', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access_entries', to='treatment_app.family', verbose_name='משפחה')),
+                ('treatment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='access_entries', to='treatment_app.treatment', verbose_name='טיפול')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access_entries', to=settings.AUTH_USER_MODEL, verbose_name='משתמש')),
+            ],
+            options={
+                'verbose_name': 'הרשאת גישה',
+                'verbose_name_plural': 'הרשאות גישה',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='therapistaccess',
+            constraint=models.UniqueConstraint(condition=models.Q(('child__isnull', True), ('treatment__isnull', True)), fields=('user', 'family'), name='unique_family_access'),
+        ),
+        migrations.AddConstraint(
+            model_name='therapistaccess',
+            constraint=models.UniqueConstraint(condition=models.Q(('child__isnull', False), ('treatment__isnull', True)), fields=('user', 'child'), name='unique_child_access'),
+        ),
+        migrations.AddConstraint(
+            model_name='therapistaccess',
+            constraint=models.UniqueConstraint(condition=models.Q(('treatment__isnull', False)), fields=('user', 'treatment'), name='unique_treatment_access'),
+        ),
+        migrations.RunPython(build_access_index, migrations.RunPython.noop),
+    ]
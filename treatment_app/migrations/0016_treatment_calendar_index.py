@@ -0,0 +1,17 @@
+# Generated by Django 4.2.9 on 2026-10-18 02:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treatment_app', '0015_therapistaccess'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='treatment',
+            index=models.Index(fields=['scheduled_date', 'therapist', 'status'], name='treatment_calendar_idx'),
+        ),
+    ]
@@ -0,0 +1,117 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+# The table and the text normalization as they were when this migration was
+# written; treatment_app.search may change, this migration must not
+CREATE_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS treatment_app_searchindex USING fts5("
+    "kind UNINDEXED, object_id UNINDEXED, family_id UNINDEXED, "
+    "title, body, digits, variants, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+DROP_TABLE_SQL = "DROP TABLE IF EXISTS treatment_app_searchindex"
+INSERT_SQL = (
+    "INSERT INTO treatment_app_searchindex (rowid, kind, object_id, family_id, title, body, digits, variants)"
+    " VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+)
+
+KIND_CODES = {'family': 0, 'child': 1, 'treatment': 2, 'document': 3}
+HEBREW_PREFIXES = 'ובהלמשכ'
+_QUOTES_IN_WORD = re.compile(r'(?<=\w)[\'"׳״](?=\w)')
+_HEBREW_WORD = re.compile(r'[א-ת]{4,}')
+
+
+def normalize_text(value):
+    if not value:
+        return ''
+    value = ''.join(ch for ch in value if unicodedata.category(ch) != 'Mn')
+    return _QUOTES_IN_WORD.sub('', value)
+
+
+def normalize_phone(value):
+    digits = re.sub(r'\D', '', value or '')
+    if not digits:
+        return []
+    forms = [digits]
+    if digits.startswith('972') and len(digits) > 9:
+        forms.append('0' + digits[3:])
+    return forms
+
+
+def hebrew_variants(text):
+    variants = []
+    for word in _HEBREW_WORD.findall(text):
+        stripped = word
+        for _ in range(2):
+            if stripped[0] not in HEBREW_PREFIXES or len(stripped) <= 3:
+                break
+            stripped = stripped[1:]
+            variants.append(stripped)
+    return variants
+
+
+def index_row(kind, object_id, family_id, title, body_parts, phones):
+    title = normalize_text(title)
+    body = normalize_text(' '.join(part for part in body_parts if part))
+    digits = ' '.join(form for phone in phones for form in normalize_phone(phone))
+    variants = ' '.join(hebrew_variants(f'{title} {body}'))
+    rowid = object_id * len(KIND_CODES) + KIND_CODES[kind]
+    return (rowid, kind, object_id, family_id, title, body, digits, variants)
+
+
+def index_rows(apps):
+    Family = apps.get_model('treatment_app', 'Family')
+    Child = apps.get_model('treatment_app', 'Child')
+    Treatment = apps.get_model('treatment_app', 'Treatment')
+    Document = apps.get_model('treatment_app', 'Document')
+
+    families = Family.objects.values_list(
+        'pk', 'name', 'address', 'email', 'father_name', 'mother_name', 'social_worker_name',
+        'therapist__first_name', 'therapist__last_name', 'notes',
+        'phone', 'father_phone', 'mother_phone', 'social_worker_phone',
+    )
+    for pk, name, *text, phone, father_phone, mother_phone, social_worker_phone in families:
+        yield index_row('family', pk, pk, name, text, [phone, father_phone, mother_phone, social_worker_phone])
+
+    children = Child.objects.values_list(
+        'pk', 'family_id', 'name', 'school', 'teacher_name', 'school_counselor_name',
+        'teacher_phone', 'school_counselor_phone',
+    )
+    for pk, family_id, name, school, teacher, counselor, teacher_phone, counselor_phone in children:
+        yield index_row('child', pk, family_id, name, [school, teacher, counselor], [teacher_phone, counselor_phone])
+
+    treatments = Treatment.objects.values_list('pk', 'family_id', 'child__family_id', 'summary', 'next_steps')
+    for pk, family_id, child_family_id, summary, next_steps in treatments:
+        if summary or next_steps:
+            yield index_row('treatment', pk, family_id or child_family_id, '', [summary, next_steps], [])
+
+    for pk, family_id, name, notes in Document.objects.values_list('pk', 'family_id', 'name', 'notes'):
+        yield index_row('document', pk, family_id, name, [notes], [])
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_TABLE_SQL)
+    rows = list(index_rows(apps))
+    with schema_editor.connection.cursor() as cursor:
+        for start in range(0, len(rows), 500):
+            cursor.executemany(INSERT_SQL, rows[start:start + 500])
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(DROP_TABLE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treatment_app', '0016_treatment_calendar_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.9 on 2026-10-18 02:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treatment_app', '0017_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='child',
+            index=models.Index(fields=['family', 'name'], name='child_family_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['-created_at'], name='document_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['family', '-created_at'], name='document_family_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['child', '-created_at'], name='document_child_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='family',
+            index=models.Index(fields=['name'], name='family_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='family',
+            index=models.Index(fields=['-created_at'], name='family_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='treatment',
+            index=models.Index(fields=['-scheduled_date', 'start_time'], name='treatment_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='treatment',
+            index=models.Index(condition=models.Q(('status', 'SCHEDULED')), fields=['scheduled_date'], name='treatment_scheduled_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='treatment',
+            index=models.Index(fields=['family', '-scheduled_date'], name='treatment_family_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='treatment',
+            index=models.Index(fields=['child', '-scheduled_date'], name='treatment_child_date_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.9 on 2026-10-18 03:00
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def set_needs_summary(apps, schema_editor):
+    Treatment = apps.get_model('treatment_app', 'Treatment')
+    Treatment.objects.filter(
+        models.Q(summary__isnull=True) | models.Q(summary=''),
+        scheduled_date__lt=timezone.localdate(),
+    ).update(needs_summary=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treatment_app', '0018_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='treatment',
+            name='needs_summary',
+            field=models.BooleanField(default=False, editable=False, verbose_name='נדרש סיכום'),
+        ),
+        migrations.AddIndex(
+            model_name='treatment',
+            index=models.Index(condition=models.Q(('needs_summary', True)), fields=['therapist', 'scheduled_date', 'start_time'], name='treatment_worklist_idx'),
+        ),
+        migrations.RunPython(set_needs_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.9 on 2026-10-18 03:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treatment_app', '0019_treatment_needs_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='שם')),
+                ('enabled', models.BooleanField(default=True, verbose_name='פעיל')),
+                ('next_run_at', models.DateTimeField(verbose_name='ריצה הבאה')),
+                ('locked_by', models.CharField(blank=True, max_length=255, verbose_name='נעול על ידי')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='נעול עד')),
+                ('last_started_at', models.DateTimeField(blank=True, null=True, verbose_name='התחלה אחרונה')),
+                ('last_finished_at', models.DateTimeField(blank=True, null=True, verbose_name='סיום אחרון')),
+                ('last_status', models.CharField(blank=True, max_length=20, verbose_name='סטטוס אחרון')),
+            ],
+            options={
+                'verbose_name': 'משימה מתוזמנת',
+                'verbose_name_plural': 'משימות מתוזמנות',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='JobRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('worker', models.CharField(max_length=255, verbose_name='תהליך')),
+                ('status', models.CharField(choices=[('RUNNING', 'רץ'), ('SUCCEEDED', 'הצליח'), ('FAILED', 'נכשל')], default='RUNNING', max_length=20, verbose_name='סטטוס')),
+                ('started_at', models.DateTimeField(verbose_name='התחלה')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='סיום')),
+                ('duration_ms', models.PositiveIntegerField(blank=True, null=True, verbose_name='משך (מ"ש)')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='תוצאה')),
+                ('error', models.TextField(blank=True, verbose_name='שגיאה')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='treatment_app.scheduledjob', verbose_name='משימה')),
+            ],
+            options={
+                'verbose_name': 'ריצת משימה',
+                'verbose_name_plural': 'ריצות משימות',
+                'ordering': ['-started_at'],
+                'indexes': [models.Index(fields=['job', '-started_at'], name='jobrun_job_started_idx')],
+            },
+        ),
+    ]
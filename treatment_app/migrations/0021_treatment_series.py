@@ -0,0 +1,54 @@
+# Generated by Django 4.2.9 on 2026-10-18 03:05
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('treatment_app', '0020_scheduled_jobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='treatment',
+            name='status',
+            field=models.CharField(choices=[('SCHEDULED', 'מתוכנן'), ('COMPLETED', 'הושלם'), ('MISSED', 'לא התקיים'), ('PENDING_SUMMARY', 'ממתין לסיכום'), ('CANCELLED', 'בוטל')], default='SCHEDULED', max_length=20, verbose_name='סטטוס'),
+        ),
+        migrations.CreateModel(
+            name='TreatmentSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('INDIVIDUAL', 'טיפול פרטני'), ('GROUP', 'טיפול קבוצתי'), ('FAMILY', 'טיפול משפחתי'), ('CONSULTATION', 'התייעצות')], default='INDIVIDUAL', max_length=20, verbose_name='סוג טיפול')),
+                ('frequency', models.CharField(choices=[('WEEKLY', 'שבועי'), ('BIWEEKLY', 'דו-שבועי')], default='WEEKLY', max_length=10, verbose_name='תדירות')),
+                ('start_date', models.DateField(verbose_name='תאריך התחלה')),
+                ('end_date', models.DateField(verbose_name='תאריך סיום')),
+                ('start_time', models.TimeField(default=datetime.time(8, 0), verbose_name='שעת התחלה')),
+                ('end_time', models.TimeField(default=datetime.time(9, 0), verbose_name='שעת סיום')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='נוצר ב')),
+                ('cancelled_at', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='בוטל ב')),
+                ('child', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='treatment_series', to='treatment_app.child', verbose_name='ילד')),
+                ('created_by', models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='נוצר על ידי')),
+                ('family', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='treatment_series', to='treatment_app.family', verbose_name='משפחה')),
+                ('therapist', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='treatment_series', to=settings.AUTH_USER_MODEL, verbose_name='מטפל')),
+            ],
+            options={
+                'verbose_name': 'סדרת טיפולים',
+                'verbose_name_plural': 'סדרות טיפולים',
+                'ordering': ['-start_date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='treatment',
+            name='series',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='treatments', to='treatment_app.treatmentseries', verbose_name='סדרת טיפולים'),
+        ),
+        migrations.AddConstraint(
+            model_name='treatmentseries',
+            constraint=models.CheckConstraint(check=models.Q(('family__isnull', False), ('child__isnull', False), _connector='OR'), name='series_require_family_or_child'),
+        ),
+    ]
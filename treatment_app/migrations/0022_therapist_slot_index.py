@@ -0,0 +1,17 @@
+# Generated by Django 4.2.9 on 2026-10-18 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treatment_app', '0021_treatment_series'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='treatment',
+            index=models.Index(fields=['therapist', 'scheduled_date', 'start_time'], name='treatment_therapist_slot_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.9 on 2026-10-18 03:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('treatment_app', '0022_therapist_slot_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Report',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('child_history', 'היסטוריית טיפולים של ילד'), ('family_summary', 'סיכום משפחה'), ('therapist_month', 'פעילות חודשית של מטפל')], max_length=20, verbose_name='סוג דוח')),
+                ('subject_id', models.PositiveIntegerField(verbose_name='מזהה נושא')),
+                ('period', models.DateField(blank=True, null=True, verbose_name='חודש')),
+                ('content_key', models.CharField(max_length=64, unique=True, verbose_name='מפתח תוכן')),
+                ('status', models.CharField(choices=[('PENDING', 'ממתין'), ('RUNNING', 'בהפקה'), ('READY', 'מוכן'), ('FAILED', 'נכשל')], default='PENDING', max_length=20, verbose_name='סטטוס')),
+                ('requested_at', models.DateTimeField(auto_now_add=True, verbose_name='התבקש ב')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='התחלה')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='סיום')),
+                ('size', models.PositiveIntegerField(blank=True, null=True, verbose_name='גודל (בתים)')),
+                ('error', models.TextField(blank=True, verbose_name='שגיאה')),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='התבקש על ידי')),
+            ],
+            options={
+                'verbose_name': 'דוח',
+                'verbose_name_plural': 'דוחות',
+                'ordering': ['-requested_at'],
+                'indexes': [models.Index(fields=['status', 'requested_at'], name='report_queue_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.9 on 2026-10-18 03:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('treatment_app', '0023_reports'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255, verbose_name='שם קובץ')),
+                ('size', models.PositiveBigIntegerField(verbose_name='גודל (בתים)')),
+                ('sha256', models.CharField(max_length=64, verbose_name='SHA-256')),
+                ('offset', models.PositiveBigIntegerField(default=0, verbose_name='התקבלו (בתים)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='נוצר בתאריך')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='עודכן בתאריך')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='משתמש')),
+            ],
+            options={
+                'verbose_name': 'העלאה',
+                'verbose_name_plural': 'העלאות',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.9 on 2026-10-18 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treatment_app', '0024_uploads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewTiming',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view', models.CharField(max_length=200, verbose_name='תצוגה')),
+                ('recorded_at', models.DateTimeField(verbose_name='נרשם ב')),
+                ('requests', models.PositiveIntegerField(verbose_name='בקשות')),
+                ('total_ms', models.FloatField(verbose_name='זמן כולל (מ"ש)')),
+                ('db_queries', models.PositiveIntegerField(verbose_name='שאילתות')),
+                ('db_ms', models.FloatField(verbose_name='זמן שאילתות (מ"ש)')),
+                ('template_ms', models.FloatField(verbose_name='זמן תבניות (מ"ש)')),
+                ('max_queries', models.PositiveIntegerField(verbose_name='מרב שאילתות בבקשה')),
+                ('histogram', models.JSONField(verbose_name='התפלגות')),
+                ('repeated_sql', models.TextField(blank=True, verbose_name='שאילתה חוזרת')),
+                ('repeated_count', models.PositiveIntegerField(default=0, verbose_name='חזרות')),
+            ],
+            options={
+                'verbose_name': 'זמני תצוגה',
+                'verbose_name_plural': 'זמני תצוגות',
+                'ordering': ['-recorded_at'],
+                'indexes': [models.Index(fields=['recorded_at'], name='viewtiming_recorded_idx')],
+            },
+        ),
+    ]
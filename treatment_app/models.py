@@ -15,6 +15,8 @@ The models use Django's built-in translation and validation features to
 provide a robust and localized data management system.
 """
 
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.urls import reverse
@@ -244,6 +246,12 @@ class Family(models.Model):
         verbose_name = _('משפחה')
         verbose_name_plural = _('משפחות')
         ordering = ['name']
+        indexes = [
+            # Family list order and search results
+            models.Index(fields=['name'], name='family_name_idx'),
+            # Dashboard: recent families and new families this month
+            models.Index(fields=['-created_at'], name='family_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -317,6 +325,10 @@ class Child(models.Model):
         verbose_name = _('ילד')
         verbose_name_plural = _('ילדים')
         ordering = ['family', 'name']
+        indexes = [
+            # Children of a family in name order (child list, family page)
+            models.Index(fields=['family', 'name'], name='child_family_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.family.name}"
@@ -342,11 +354,13 @@ class Treatment(models.Model):
         COMPLETED = 'COMPLETED', _('הושלם')
         MISSED = 'MISSED', _('לא התקיים')
         PENDING_SUMMARY = 'PENDING_SUMMARY', _('ממתין לסיכום')
+        CANCELLED = 'CANCELLED', _('בוטל')
 
     # Relationships
     family = models.ForeignKey('Family', on_delete=models.CASCADE, related_name='treatments', null=True, blank=True, verbose_name=_('משפחה'))
     child = models.ForeignKey('Child', on_delete=models.CASCADE, related_name='treatments', null=True, blank=True, verbose_name=_('ילד'))
     therapist = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='treatments', verbose_name=_('מטפל'))
+    series = models.ForeignKey('TreatmentSeries', on_delete=models.SET_NULL, related_name='treatments', null=True, blank=True, editable=False, verbose_name=_('סדרת טיפולים'))
 
     # Treatment Details
     type = models.CharField(max_length=20, choices=TreatmentType.choices, default=TreatmentType.INDIVIDUAL, verbose_name=_('סוג טיפול'))
@@ -361,6 +375,9 @@ class Treatment(models.Model):
     # Treatment Summary
     summary = models.TextField(null=True, blank=True, verbose_name=_('סיכום טיפול'))
     next_steps = models.TextField(null=True, blank=True, verbose_name=_('המשך טיפול'))
+    # Past its date with no summary; set by save() and kept current by the
+    # daily sweep in treatment_app.worklist as dates pass
+    needs_summary = models.BooleanField(default=False, editable=False, verbose_name=_('נדרש סיכום'))
 
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('נוצר ב'))
@@ -370,6 +387,29 @@ class Treatment(models.Model):
         verbose_name = _('טיפול')
         verbose_name_plural = _('טיפולים')
         ordering = ['-scheduled_date', 'start_time']
+        indexes = [
+            # Calendar feed: date window, optionally narrowed by therapist and status
+            models.Index(fields=['scheduled_date', 'therapist', 'status'], name='treatment_calendar_idx'),
+            # Default ordering of the treatment list
+            models.Index(fields=['-scheduled_date', 'start_time'], name='treatment_order_idx'),
+            # Past-due and upcoming treatments only ever look at scheduled ones
+            models.Index(
+                fields=['scheduled_date'],
+                condition=models.Q(status='SCHEDULED'),
+                name='treatment_scheduled_idx'
+            ),
+            # Treatments of a family or child, newest first (detail pages)
+            models.Index(fields=['family', '-scheduled_date'], name='treatment_family_date_idx'),
+            models.Index(fields=['child', '-scheduled_date'], name='treatment_child_date_idx'),
+            # Double-booking checks: one therapist's sessions on one day, by time
+            models.Index(fields=['therapist', 'scheduled_date', 'start_time'], name='treatment_therapist_slot_idx'),
+            # Per-therapist worklist of treatments waiting for a summary
+            models.Index(
+                fields=['therapist', 'scheduled_date', 'start_time'],
+                condition=models.Q(needs_summary=True),
+                name='treatment_worklist_idx'
+            ),
+        ]
         constraints = [
             models.CheckConstraint(
                 check=models.Q(family__isnull=False) | models.Q(child__isnull=False),
@@ -392,56 +432,101 @@ class Treatment(models.Model):
         return reverse('treatment_app:treatment-detail', kwargs={'pk': self.pk})
 
     def save(self, *args, **kwargs):
-        # If no actual date and no scheduled date, set status to PENDING
-        if not self.actual_date and not self.scheduled_date:
-            self.status = self.TreatmentStatus.PENDING_SUMMARY
+        self.derive_status()
+        update_fields = kwargs.get('update_fields')
+        if update_fields:
+            # Both are derived from the fields being saved
+            kwargs['update_fields'] = {*update_fields, 'status', 'needs_summary'}
+
+        super().save(*args, **kwargs)
 
-        # If actual date is provided, set status to COMPLETED
-        if self.actual_date:
-            self.status = self.TreatmentStatus.COMPLETED
+    def derive_status(self, today=None):
+        """
+        Set ``status`` and ``needs_summary`` from the dates and summary, as
+        ``save()`` does. Callers of ``bulk_create()`` call it themselves.
+        """
+        today = today or timezone.localdate()
+        cancelled = self.status == self.TreatmentStatus.CANCELLED
 
-        # If scheduled date is in the past and no actual date, mark as MISSED
-        if self.scheduled_date and not self.actual_date and self.scheduled_date < timezone.now().date():
-            self.status = self.TreatmentStatus.MISSED
+        # A cancelled session keeps its status
+        if not cancelled:
+            # If no actual date and no scheduled date, set status to PENDING
+            if not self.actual_date and not self.scheduled_date:
+                self.status = self.TreatmentStatus.PENDING_SUMMARY
 
-        super().save(*args, **kwargs)
+            # If actual date is provided, set status to COMPLETED
+            if self.actual_date:
+                self.status = self.TreatmentStatus.COMPLETED
+
+            # If scheduled date is in the past and no actual date, mark as MISSED
+            if self.scheduled_date and not self.actual_date and self.scheduled_date < today:
+                self.status = self.TreatmentStatus.MISSED
+
+        self.needs_summary = bool(
+            not cancelled and self.scheduled_date and self.scheduled_date < today and not self.summary
+        )
 
     def is_past_due(self):
         """
         Check if the treatment is past due.
         """
-        return (self.scheduled_date and self.scheduled_date < timezone.now().date() and 
+        return (self.scheduled_date and self.scheduled_date < timezone.localdate() and
                 self.status == self.TreatmentStatus.SCHEDULED)
 
-    def needs_summary(self):
-        """
-        Check if the treatment requires a summary.
-        Returns True if:
-        1. Treatment is past due
-        2. No summary has been written
-        """
-        from django.utils import timezone
-        
-        # Check if treatment is past due
-        if not self.scheduled_date:
-            return False
-        
-        is_past_due = self.scheduled_date < timezone.now().date()
-        
-        # Check if summary is missing
-        summary_missing = not self.summary
-        
-        return is_past_due and summary_missing
-
     def get_status_display_with_summary_warning(self):
         """
         Returns the status with an additional warning if summary is needed.
         """
         status = self.get_status_display()
-        if self.needs_summary():
+        if self.needs_summary:
             status += " (נדרש סיכום!)"
         return status
 
+class TreatmentSeries(models.Model):
+    """
+    A recurring weekly or biweekly appointment.
+
+    The sessions are generated up front as ordinary treatments linked to the
+    series (see ``treatment_app.series``), so the calendar, lists and
+    worklist need no recurrence logic, and the remaining sessions can be
+    changed or cancelled together with one UPDATE.
+    """
+    class Frequency(models.TextChoices):
+        WEEKLY = 'WEEKLY', _('שבועי')
+        BIWEEKLY = 'BIWEEKLY', _('דו-שבועי')
+
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='treatment_series', null=True, blank=True, verbose_name=_('משפחה'))
+    child = models.ForeignKey(Child, on_delete=models.CASCADE, related_name='treatment_series', null=True, blank=True, verbose_name=_('ילד'))
+    therapist = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='treatment_series', verbose_name=_('מטפל'))
+    type = models.CharField(max_length=20, choices=Treatment.TreatmentType.choices, default=Treatment.TreatmentType.INDIVIDUAL, verbose_name=_('סוג טיפול'))
+    frequency = models.CharField(max_length=10, choices=Frequency.choices, default=Frequency.WEEKLY, verbose_name=_('תדירות'))
+    start_date = models.DateField(verbose_name=_('תאריך התחלה'))
+    end_date = models.DateField(verbose_name=_('תאריך סיום'))
+    start_time = models.TimeField(default=time(8, 0), verbose_name=_('שעת התחלה'))
+    end_time = models.TimeField(default=time(9, 0), verbose_name=_('שעת סיום'))
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', editable=False, verbose_name=_('נוצר על ידי'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('נוצר ב'))
+    cancelled_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name=_('בוטל ב'))
+
+    class Meta:
+        verbose_name = _('סדרת טיפולים')
+        verbose_name_plural = _('סדרות טיפולים')
+        ordering = ['-start_date']
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(family__isnull=False) | models.Q(child__isnull=False),
+                name='series_require_family_or_child'
+            )
+        ]
+
+    def __str__(self):
+        client_name = self.child.name if self.child else self.family.name if self.family else _('לקוח לא מזוהה')
+        return f"{client_name} - {self.get_frequency_display()} ({self.start_date} - {self.end_date})"
+
+    def clean(self):
+        from .series import validate_series
+        validate_series(self)
+
 class TherapistProfile(models.Model):
     """
     Extended profile for therapists in the treatment center.
@@ -506,6 +591,12 @@ class Document(models.Model):
         verbose_name = _('מסמך')
         verbose_name_plural = _('מסמכים')
         ordering = ['-created_at']
+        indexes = [
+            # Document list order, overall and per family or child
+            models.Index(fields=['-created_at'], name='document_created_idx'),
+            models.Index(fields=['family', '-created_at'], name='document_family_created_idx'),
+            models.Index(fields=['child', '-created_at'], name='document_child_created_idx'),
+        ]
 
     def __str__(self):
         if self.child:
@@ -523,3 +614,204 @@ class Document(models.Model):
     def save(self, *args, **kwargs):
         self.clean()
         super().save(*args, **kwargs)
+
+class TherapistAccess(models.Model):
+    """
+    Denormalized visibility index: which user may see which family, child
+    and treatment.
+
+    Each row grants one user access to exactly one object:
+    - family row:    child and treatment are empty
+    - child row:     treatment is empty
+    - treatment row: treatment is set (family/child hold its owners)
+
+    The rows are maintained by the signals in ``treatment_app.signals`` and
+    can be rebuilt with ``manage.py rebuild_access_index``.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='access_entries', verbose_name=_('משתמש'))
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='access_entries', verbose_name=_('משפחה'))
+    child = models.ForeignKey(Child, on_delete=models.CASCADE, related_name='access_entries', null=True, blank=True, verbose_name=_('ילד'))
+    treatment = models.ForeignKey(Treatment, on_delete=models.CASCADE, related_name='access_entries', null=True, blank=True, verbose_name=_('טיפול'))
+
+    class Meta:
+        verbose_name = _('הרשאת גישה')
+        verbose_name_plural = _('הרשאות גישה')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'family'],
+                condition=models.Q(child__isnull=True, treatment__isnull=True),
+                name='unique_family_access'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'child'],
+                condition=models.Q(child__isnull=False, treatment__isnull=True),
+                name='unique_child_access'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'treatment'],
+                condition=models.Q(treatment__isnull=False),
+                name='unique_treatment_access'
+            ),
+        ]
+
+    def __str__(self):
+        target = self.treatment or self.child or self.family
+        return f"{self.user} - {target}"
+
+class ScheduledJob(models.Model):
+    """
+    One background job of ``manage.py run_jobs`` and its schedule.
+
+    Rows are created from the registry in ``treatment_app.jobs``. A worker
+    takes a due job by setting ``locked_by``/``locked_until`` with a
+    conditional UPDATE, so only one worker runs it; a lease that runs out
+    (crashed worker) frees the job again.
+    """
+    name = models.CharField(max_length=100, unique=True, verbose_name=_('שם'))
+    enabled = models.BooleanField(default=True, verbose_name=_('פעיל'))
+    next_run_at = models.DateTimeField(verbose_name=_('ריצה הבאה'))
+    locked_by = models.CharField(max_length=255, blank=True, verbose_name=_('נעול על ידי'))
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name=_('נעול עד'))
+    last_started_at = models.DateTimeField(null=True, blank=True, verbose_name=_('התחלה אחרונה'))
+    last_finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_('סיום אחרון'))
+    last_status = models.CharField(max_length=20, blank=True, verbose_name=_('סטטוס אחרון'))
+
+    class Meta:
+        verbose_name = _('משימה מתוזמנת')
+        verbose_name_plural = _('משימות מתוזמנות')
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+class JobRun(models.Model):
+    """
+    History of one run of a scheduled job.
+    """
+    class Status(models.TextChoices):
+        RUNNING = 'RUNNING', _('רץ')
+        SUCCEEDED = 'SUCCEEDED', _('הצליח')
+        FAILED = 'FAILED', _('נכשל')
+
+    job = models.ForeignKey(ScheduledJob, on_delete=models.CASCADE, related_name='runs', verbose_name=_('משימה'))
+    worker = models.CharField(max_length=255, verbose_name=_('תהליך'))
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.RUNNING, verbose_name=_('סטטוס'))
+    started_at = models.DateTimeField(verbose_name=_('התחלה'))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_('סיום'))
+    duration_ms = models.PositiveIntegerField(null=True, blank=True, verbose_name=_('משך (מ"ש)'))
+    result = models.JSONField(null=True, blank=True, verbose_name=_('תוצאה'))
+    error = models.TextField(blank=True, verbose_name=_('שגיאה'))
+
+    class Meta:
+        verbose_name = _('ריצת משימה')
+        verbose_name_plural = _('ריצות משימות')
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['job', '-started_at'], name='jobrun_job_started_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.job} - {self.started_at:%Y-%m-%d %H:%M} ({self.get_status_display()})"
+
+class Report(models.Model):
+    """
+    A PDF report, rendered by the ``render_reports`` background job.
+
+    ``content_key`` hashes the report's kind, subject and period with the
+    latest ``updated_at`` and the number of the rows it shows, so a report is
+    rendered once and its file (``settings.REPORTS_ROOT/<content_key>.pdf``)
+    is served until the data changes and the key with it.
+    """
+    class Kind(models.TextChoices):
+        CHILD_HISTORY = 'child_history', _('היסטוריית טיפולים של ילד')
+        FAMILY_SUMMARY = 'family_summary', _('סיכום משפחה')
+        THERAPIST_MONTH = 'therapist_month', _('פעילות חודשית של מטפל')
+
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', _('ממתין')
+        RUNNING = 'RUNNING', _('בהפקה')
+        READY = 'READY', _('מוכן')
+        FAILED = 'FAILED', _('נכשל')
+
+    kind = models.CharField(max_length=20, choices=Kind.choices, verbose_name=_('סוג דוח'))
+    subject_id = models.PositiveIntegerField(verbose_name=_('מזהה נושא'))
+    period = models.DateField(null=True, blank=True, verbose_name=_('חודש'))
+    content_key = models.CharField(max_length=64, unique=True, verbose_name=_('מפתח תוכן'))
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING, verbose_name=_('סטטוס'))
+    requested_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name=_('התבקש על ידי')
+    )
+    requested_at = models.DateTimeField(auto_now_add=True, verbose_name=_('התבקש ב'))
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name=_('התחלה'))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_('סיום'))
+    size = models.PositiveIntegerField(null=True, blank=True, verbose_name=_('גודל (בתים)'))
+    error = models.TextField(blank=True, verbose_name=_('שגיאה'))
+
+    class Meta:
+        verbose_name = _('דוח')
+        verbose_name_plural = _('דוחות')
+        ordering = ['-requested_at']
+        indexes = [
+            models.Index(fields=['status', 'requested_at'], name='report_queue_idx'),
+        ]
+
+    def __str__(self):
+        period = f" {self.period:%m/%Y}" if self.period else ''
+        return f"{self.get_kind_display()} #{self.subject_id}{period} ({self.get_status_display()})"
+
+class Upload(models.Model):
+    """
+    A document being uploaded in chunks through the API (see ``uploads``).
+
+    The bytes received so far are in ``uploads.partial_path(upload)`` and
+    ``offset`` counts them. The id is random since it is all a client needs
+    to resume; the row is deleted once the upload is finished or abandoned.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', verbose_name=_('משתמש'))
+    filename = models.CharField(max_length=255, verbose_name=_('שם קובץ'))
+    size = models.PositiveBigIntegerField(verbose_name=_('גודל (בתים)'))
+    sha256 = models.CharField(max_length=64, verbose_name=_('SHA-256'))
+    offset = models.PositiveBigIntegerField(default=0, verbose_name=_('התקבלו (בתים)'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('נוצר בתאריך'))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_('עודכן בתאריך'))
+
+    class Meta:
+        verbose_name = _('העלאה')
+        verbose_name_plural = _('העלאות')
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+class ViewTiming(models.Model):
+    """
+    Request timings of one view, collected by one process between two
+    flushes (see ``perf``). ``perf_report`` adds them up over a period.
+
+    ``histogram`` counts requests per wall-time bucket, from which the
+    percentiles are read; ``repeated_sql`` is the statement a single request
+    ran most often, ``repeated_count`` times, which is how N+1 queries show.
+    """
+    view = models.CharField(max_length=200, verbose_name=_('תצוגה'))
+    recorded_at = models.DateTimeField(verbose_name=_('נרשם ב'))
+    requests = models.PositiveIntegerField(verbose_name=_('בקשות'))
+    total_ms = models.FloatField(verbose_name=_('זמן כולל (מ"ש)'))
+    db_queries = models.PositiveIntegerField(verbose_name=_('שאילתות'))
+    db_ms = models.FloatField(verbose_name=_('זמן שאילתות (מ"ש)'))
+    template_ms = models.FloatField(verbose_name=_('זמן תבניות (מ"ש)'))
+    max_queries = models.PositiveIntegerField(verbose_name=_('מרב שאילתות בבקשה'))
+    histogram = models.JSONField(verbose_name=_('התפלגות'))
+    repeated_sql = models.TextField(blank=True, verbose_name=_('שאילתה חוזרת'))
+    repeated_count = models.PositiveIntegerField(default=0, verbose_name=_('חזרות'))
+
+    class Meta:
+        verbose_name = _('זמני תצוגה')
+        verbose_name_plural = _('זמני תצוגות')
+        ordering = ['-recorded_at']
+        indexes = [
+            models.Index(fields=['recorded_at'], name='viewtiming_recorded_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.view} {self.recorded_at:%Y-%m-%d %H:%M} ({self.requests})"
@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Cursor pagination on the primary key, newest first.
+
+    Deep pages cost an indexed seek on the primary key instead of an
+    OFFSET scan, and rows inserted while paging are never skipped.
+    """
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
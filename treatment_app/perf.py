@@ -0,0 +1,328 @@
+"""
+Per-request performance instrumentation.
+
+``PerfMiddleware`` (see ``middleware``) times each request and, through
+``connection.execute_wrapper``, the number and duration of its queries;
+template rendering is timed by wrapping the Django template backend. The
+figures go out in a ``Server-Timing`` header (for staff) and are added up
+per view in memory. Every ``PERF_FLUSH_SECONDS`` a process writes what it
+has collected as ``ViewTiming`` rows, which all processes share and
+``manage.py perf_report`` reads.
+
+Wall times are kept as histograms with buckets ``BUCKET_RATIO`` apart, so
+percentiles are exact to within that ratio whatever the number of
+requests. For streaming responses the time is to the first byte.
+
+Database time includes fetching the rows (see ``watch_fetches``): on SQLite
+``execute()`` only runs a query up to its first row.
+"""
+
+import contextvars
+import logging
+import math
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.template.backends.django import Template
+from django.utils import timezone
+
+from .models import ViewTiming
+
+logger = logging.getLogger(__name__)
+
+BUCKET_RATIO = 1.1
+RETENTION_DAYS = 14
+# Longest SQL kept for the N+1 report
+SQL_MAX_LENGTH = 2000
+
+_current = contextvars.ContextVar('perf_timer', default=None)
+
+
+def bucket(ms):
+    return max(0, int(math.log(max(ms, 1), BUCKET_RATIO)))
+
+
+def bucket_upper(index):
+    return BUCKET_RATIO ** (index + 1)
+
+
+def percentile(histogram, q):
+    """
+    Upper bound (ms) of the bucket holding the ``q`` quantile of a
+    ``{bucket: count}`` histogram.
+    """
+    counts = sorted((int(index), count) for index, count in histogram.items())
+    total = sum(count for _, count in counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in counts:
+        seen += count
+        if seen >= rank:
+            return bucket_upper(index)
+    return bucket_upper(counts[-1][0])
+
+
+class RequestTimer:
+    """
+    The cost of one request so far.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.statements = Counter()
+        self.rendering = False
+        self.view = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+            if not many:
+                watch_fetches(context['cursor'], self, self.fetched)
+
+    def fetched(self, seconds):
+        self.db_time += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        return ', '.join([
+            f'total;dur={self.elapsed() * 1000:.1f}',
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+        ])
+
+
+_FETCHES = ('fetchone', 'fetchmany', 'fetchall')
+
+
+def watch_fetches(cursor, key, fetched, finished=None):
+    """
+    Time the fetches of the statement ``cursor`` (a Django ``CursorWrapper``)
+    has just executed, for execute wrappers, which only see ``execute()``.
+    On SQLite that call steps to the first row and the rest of a scan runs
+    in ``fetchmany()``.
+
+    ``fetched(seconds)`` is called after every fetch, and ``finished()``
+    once: when the rows run out, or the cursor is closed or executes again.
+    ``key`` identifies the caller, whose watcher on the cursor's previous
+    statement is finished and replaced. Rows read by iterating the cursor
+    (only ``Manager.raw()`` does) are not timed.
+    """
+    watchers = cursor.__dict__.get('_fetch_watchers')
+    if watchers is None:
+        watchers = cursor._fetch_watchers = {}
+        for name in _FETCHES:
+            setattr(cursor, name, _timed_fetch(cursor, name, getattr(cursor, name)))
+        close = cursor.close
+
+        def timed_close():
+            _finish_fetches(cursor)
+            return close()
+        cursor.close = timed_close
+    previous = watchers.pop(key, None)
+    if previous is not None and previous[1] is not None:
+        previous[1]()
+    watchers[key] = (fetched, finished)
+
+
+def _timed_fetch(cursor, name, fetch):
+    def timed(*args):
+        started = time.perf_counter()
+        rows = None
+        try:
+            rows = fetch(*args)
+            return rows
+        finally:
+            elapsed = time.perf_counter() - started
+            for fetched, _ in list(cursor._fetch_watchers.values()):
+                fetched(elapsed)
+            size = args[0] if args else cursor.arraysize
+            if name == 'fetchall' or not rows or (name == 'fetchmany' and len(rows) < size):
+                _finish_fetches(cursor)
+    return timed
+
+
+def _finish_fetches(cursor):
+    watchers = cursor._fetch_watchers
+    while watchers:
+        _, (_, finished) = watchers.popitem()
+        if finished is not None:
+            finished()
+
+
+def start():
+    timer = RequestTimer()
+    return timer, _current.set(timer)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def set_view(name):
+    timer = _current.get()
+    if timer is not None:
+        timer.view = name
+
+
+def current_view():
+    """
+    Name of the view the current request resolved to, if any.
+    """
+    timer = _current.get()
+    return timer.view if timer is not None else None
+
+
+_render = Template.render
+
+
+def _timed_render(self, context=None, request=None):
+    timer = _current.get()
+    # Templates rendered inside a template (crispy forms, includes rendered
+    # by tags) are part of the outer render's time
+    if timer is None or timer.rendering:
+        return _render(self, context, request)
+    timer.rendering = True
+    started = time.perf_counter()
+    try:
+        return _render(self, context, request)
+    finally:
+        timer.template_time += time.perf_counter() - started
+        timer.rendering = False
+
+
+def install_template_timer():
+    Template.render = _timed_render
+
+
+class _ViewStats:
+    def __init__(self):
+        self.requests = 0
+        self.total = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.max_queries = 0
+        self.histogram = Counter()
+        self.repeated_sql = ''
+        self.repeated_count = 0
+
+    def add(self, timer, elapsed):
+        self.requests += 1
+        self.total += elapsed
+        self.queries += timer.queries
+        self.db_time += timer.db_time
+        self.template_time += timer.template_time
+        self.max_queries = max(self.max_queries, timer.queries)
+        self.histogram[bucket(elapsed * 1000)] += 1
+        if timer.statements:
+            sql, count = timer.statements.most_common(1)[0]
+            if count > self.repeated_count:
+                self.repeated_sql, self.repeated_count = sql[:SQL_MAX_LENGTH], count
+
+
+_lock = threading.Lock()
+_stats = {}
+_last_flush = time.monotonic()
+
+
+def record(view, timer):
+    """
+    Add a finished request of ``view`` to this process's figures.
+    """
+    elapsed = timer.elapsed()
+    with _lock:
+        _stats.setdefault(view, _ViewStats()).add(timer, elapsed)
+
+
+def flush_due():
+    return time.monotonic() - _last_flush >= settings.PERF_FLUSH_SECONDS
+
+
+def flush():
+    """
+    Write the figures collected since the last flush as ``ViewTiming``
+    rows. Returns the number of rows written.
+    """
+    global _stats, _last_flush
+    with _lock:
+        stats, _stats = _stats, {}
+        _last_flush = time.monotonic()
+    if not stats:
+        return 0
+    now = timezone.now()
+    rows = [
+        ViewTiming(
+            view=view, recorded_at=now, requests=entry.requests, total_ms=entry.total * 1000,
+            db_queries=entry.queries, db_ms=entry.db_time * 1000, template_ms=entry.template_time * 1000,
+            max_queries=entry.max_queries, histogram={str(index): count for index, count in entry.histogram.items()},
+            repeated_sql=entry.repeated_sql, repeated_count=entry.repeated_count,
+        )
+        for view, entry in stats.items()
+    ]
+    try:
+        ViewTiming.objects.bulk_create(rows)
+    except DatabaseError:
+        # Timings are not worth failing (or retrying) a request for
+        logger.warning('Could not save %d view timings', len(rows), exc_info=True)
+        return 0
+    return len(rows)
+
+
+def summarize(since, view=None):
+    """
+    Figures per view since ``since``, merged from all processes: a list of
+    dicts with the request count, percentiles, averages and the worst
+    repeated statement.
+    """
+    rows = ViewTiming.objects.filter(recorded_at__gte=since)
+    if view:
+        rows = rows.filter(view=view)
+    merged = {}
+    for row in rows.iterator():
+        entry = merged.setdefault(row.view, {
+            'view': row.view, 'requests': 0, 'total_ms': 0.0, 'db_queries': 0, 'db_ms': 0.0,
+            'template_ms': 0.0, 'max_queries': 0, 'histogram': Counter(), 'repeated_sql': '', 'repeated_count': 0,
+        })
+        entry['requests'] += row.requests
+        for field in ('total_ms', 'db_queries', 'db_ms', 'template_ms'):
+            entry[field] += getattr(row, field)
+        entry['max_queries'] = max(entry['max_queries'], row.max_queries)
+        entry['histogram'].update(row.histogram)
+        if row.repeated_count > entry['repeated_count']:
+            entry['repeated_sql'], entry['repeated_count'] = row.repeated_sql, row.repeated_count
+
+    for entry in merged.values():
+        requests = entry['requests']
+        for q in (50, 95, 99):
+            entry[f'p{q}'] = percentile(entry['histogram'], q / 100)
+        entry['avg_ms'] = entry['total_ms'] / requests
+        entry['avg_queries'] = entry['db_queries'] / requests
+        entry['avg_db_ms'] = entry['db_ms'] / requests
+        entry['avg_template_ms'] = entry['template_ms'] / requests
+    return list(merged.values())
+
+
+def prune(now=None):
+    """
+    Delete timings older than ``RETENTION_DAYS``. Returns the number deleted.
+    """
+    cutoff = (now or timezone.now()) - timedelta(days=RETENTION_DAYS)
+    deleted, _ = ViewTiming.objects.filter(recorded_at__lt=cutoff).delete()
+    return deleted
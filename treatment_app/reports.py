@@ -0,0 +1,412 @@
+"""
+PDF reports: a child's treatment history, a family summary and a
+therapist's monthly activity.
+
+Requesting a report only computes its content key (two aggregate queries)
+and records it; the PDF is rendered by the ``render_reports`` background
+job with reportlab and written to ``settings.REPORTS_ROOT/<key>.pdf``. The
+key hashes the latest ``updated_at`` and the number of the rows the report
+shows, so a report is rendered once and served from disk until something
+in it changes. Request workers never render.
+
+reportlab draws text left to right and has no bidirectional layout, so
+Hebrew lines are reordered here (``visual``) and tables are laid out with
+their first column on the right. Set ``settings.REPORT_FONT`` to a
+TrueType font with Hebrew glyphs; reportlab's built-in fonts have none.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import traceback
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from .models import Child, Family, Report, Treatment
+
+logger = logging.getLogger(__name__)
+
+# Part of every content key: bump it when the layout changes so that
+# reports on disk are rendered again
+REPORT_VERSION = 1
+# A report RUNNING for longer than this is presumed dead and rendered again
+RENDER_LEASE = timedelta(minutes=10)
+# A FAILED report is queued again when requested this long after it failed
+FAILED_RETRY = timedelta(minutes=5)
+RETENTION = timedelta(days=30)
+
+SUBJECT_MODELS = {
+    Report.Kind.CHILD_HISTORY: Child,
+    Report.Kind.FAMILY_SUMMARY: Family,
+    Report.Kind.THERAPIST_MONTH: User,
+}
+
+# Fonts with Hebrew glyphs tried when REPORT_FONT is not set
+FONT_CANDIDATES = (
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/truetype/freefont/FreeSans.ttf',
+    '/usr/share/fonts/truetype/noto/NotoSansHebrew-Regular.ttf',
+)
+
+PAGE_WIDTH = A4[0] - 30 * mm
+
+
+def next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def treatments(kind, subject_id, period=None):
+    """
+    The treatments a report shows.
+    """
+    if kind == Report.Kind.CHILD_HISTORY:
+        return Treatment.objects.filter(child_id=subject_id)
+    if kind == Report.Kind.FAMILY_SUMMARY:
+        return Treatment.objects.filter(Q(family_id=subject_id) | Q(child__family_id=subject_id))
+    return Treatment.objects.filter(
+        therapist_id=subject_id, scheduled_date__gte=period, scheduled_date__lt=next_month(period)
+    )
+
+
+def content_key(kind, subject_id, period=None):
+    """
+    Hash identifying the current content of a report.
+    """
+    rows = treatments(kind, subject_id, period).aggregate(updated=Max('updated_at'), count=Count('pk'))
+    parts = [REPORT_VERSION, kind, subject_id, period, rows['updated'], rows['count']]
+    if kind == Report.Kind.CHILD_HISTORY:
+        subject = Child.objects.filter(pk=subject_id).aggregate(
+            updated=Max('updated_at'), family_updated=Max('family__updated_at')
+        )
+        parts += subject.values()
+    elif kind == Report.Kind.FAMILY_SUMMARY:
+        subject = Family.objects.filter(pk=subject_id).aggregate(
+            updated=Max('updated_at'), children_updated=Max('children__updated_at'), children_count=Count('children')
+        )
+        parts += subject.values()
+    return hashlib.sha256('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def report_path(report):
+    return Path(settings.REPORTS_ROOT) / f'{report.content_key}.pdf'
+
+
+def filename(report):
+    period = f'-{report.period:%Y-%m}' if report.period else ''
+    return f'{report.kind.replace("_", "-")}-{report.subject_id}{period}.pdf'
+
+
+def request_report(kind, subject_id, period=None, user=None):
+    """
+    The report for the current content, queued for rendering if there is
+    none yet, its file is gone or it failed more than ``FAILED_RETRY`` ago.
+    """
+    report, created = Report.objects.get_or_create(
+        content_key=content_key(kind, subject_id, period),
+        defaults={'kind': kind, 'subject_id': subject_id, 'period': period, 'requested_by': user},
+    )
+    requeue = (
+        report.status == Report.Status.READY and not report_path(report).exists()
+        or report.status == Report.Status.FAILED and report.finished_at < timezone.now() - FAILED_RETRY
+    )
+    if not created and requeue:
+        Report.objects.filter(pk=report.pk).update(status=Report.Status.PENDING, started_at=None, finished_at=None)
+        report.status = Report.Status.PENDING
+    return report
+
+
+def _claimable(now):
+    return Q(status=Report.Status.PENDING) | Q(status=Report.Status.RUNNING, started_at__lt=now - RENDER_LEASE)
+
+
+def _claim_next():
+    # Several workers may render at once; the conditional UPDATE gives
+    # each queued report to one of them
+    now = timezone.now()
+    queued = Report.objects.filter(_claimable(now)).order_by('requested_at').values_list('pk', flat=True)[:10]
+    for pk in queued:
+        if Report.objects.filter(_claimable(now), pk=pk).update(status=Report.Status.RUNNING, started_at=now):
+            return Report.objects.get(pk=pk)
+    return None
+
+
+def render_pending(limit=None):
+    """
+    Render queued reports, oldest first, until none is left (or ``limit``
+    were rendered). Returns the counts.
+    """
+    counts = Counter()
+    while limit is None or sum(counts.values()) < limit:
+        report = _claim_next()
+        if report is None:
+            break
+        counts[render(report)] += 1
+    return {'rendered': counts[Report.Status.READY], 'failed': counts[Report.Status.FAILED]}
+
+
+def render(report):
+    """
+    Write the PDF of ``report`` and record the outcome. Returns its status.
+    """
+    path = report_path(report)
+    partial = path.with_name(f'.{path.name}.{os.getpid()}')
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        BUILDERS[report.kind](report, partial)
+        # Readers never see a half-written file
+        os.replace(partial, path)
+        report.status, report.size, report.error = Report.Status.READY, path.stat().st_size, ''
+    except Exception:
+        logger.exception('Rendering report %s failed', report.pk)
+        report.status, report.error = Report.Status.FAILED, traceback.format_exc()
+    finally:
+        partial.unlink(missing_ok=True)
+    report.finished_at = timezone.now()
+    report.save(update_fields=['status', 'size', 'error', 'finished_at'])
+    return report.status
+
+
+def prune(now=None):
+    """
+    Delete reports requested more than ``RETENTION`` ago and their files.
+    Returns the number deleted.
+    """
+    old = Report.objects.filter(requested_at__lt=(now or timezone.now()) - RETENTION)
+    for report in old.only('content_key'):
+        report_path(report).unlink(missing_ok=True)
+    deleted, _ = old.delete()
+    return deleted
+
+
+# Layout
+
+_HEBREW = re.compile('[\u0590-\u05ff]')
+# Numbers, dates, times and Latin words keep their order inside a Hebrew line
+_LTR_WORD = r'[A-Za-z0-9](?:[A-Za-z0-9.,:/@_+\-]*[A-Za-z0-9])?'
+_LTR_RUN = re.compile(f'{_LTR_WORD}(?: +{_LTR_WORD})*')
+_MIRRORED = str.maketrans('()[]{}<>', ')(][}{><')
+
+_font_name = None
+
+
+def visual(text):
+    """
+    Reorder a logical Hebrew line for left-to-right drawing: reverse it,
+    except for runs of Latin letters and digits. Lines without Hebrew are
+    returned as they are.
+    """
+    if not _HEBREW.search(text):
+        return text
+    reversed_text = text[::-1].translate(_MIRRORED)
+    return _LTR_RUN.sub(lambda match: match.group(0)[::-1], reversed_text)
+
+
+def font():
+    global _font_name
+    if _font_name is None:
+        configured = getattr(settings, 'REPORT_FONT', '')
+        for candidate in ([configured] if configured else []) + list(FONT_CANDIDATES):
+            if os.path.exists(candidate):
+                pdfmetrics.registerFont(TTFont('ReportFont', candidate))
+                _font_name = 'ReportFont'
+                break
+        else:
+            logger.warning('No font with Hebrew glyphs found for PDF reports; set REPORT_FONT')
+            _font_name = 'Helvetica'
+    return _font_name
+
+
+def _styles():
+    name = font()
+    return {
+        'title': ParagraphStyle('title', fontName=name, fontSize=16, leading=22, alignment=TA_CENTER, spaceAfter=4 * mm),
+        'heading': ParagraphStyle('heading', fontName=name, fontSize=12, leading=16, alignment=TA_RIGHT,
+                                  spaceBefore=4 * mm, spaceAfter=2 * mm),
+        'text': ParagraphStyle('text', fontName=name, fontSize=10, leading=14, alignment=TA_RIGHT),
+        'cell': ParagraphStyle('cell', fontName=name, fontSize=8, leading=10, alignment=TA_RIGHT),
+    }
+
+
+def _paragraph(text, style, width=PAGE_WIDTH):
+    # Wrap in logical order first, then reorder each line
+    lines = simpleSplit(str(text or ''), style.fontName, style.fontSize, width - 2 * mm) or ['']
+    return Paragraph('<br/>'.join(escape(visual(line)) for line in lines), style)
+
+
+def _table(headers, rows, widths, styles):
+    """
+    A table with its first column on the right. Values are strings; the
+    last column wraps.
+    """
+    data = [[visual(header) for header in headers][::-1]]
+    for row in rows:
+        cells = [visual(str(value)) for value in row[:-1]] + [_paragraph(row[-1], styles['cell'], widths[-1])]
+        data.append(cells[::-1])
+    table = Table(data, colWidths=list(widths)[::-1], repeatRows=1, hAlign='RIGHT')
+    table.setStyle(TableStyle([
+        ('FONT', (0, 0), (-1, -1), font(), 8),
+        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e9ecef')),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+    ]))
+    return table
+
+
+def _info(pairs, styles):
+    return [_paragraph(f'{label}: {value or "-"}', styles['text']) for label, value in pairs]
+
+
+def _counts(counter, choices, styles):
+    rows = [(str(label), str(counter[value])) for value, label in choices if counter[value]]
+    return _table(('', 'מספר'), rows or [('-', '0')], (60 * mm, 20 * mm), styles)
+
+
+def _day(value):
+    return f'{value:%d/%m/%Y}' if value else ''
+
+
+def _hour(treatment):
+    if not treatment.start_time:
+        return ''
+    end = f'-{treatment.end_time:%H:%M}' if treatment.end_time else ''
+    return f'{treatment.start_time:%H:%M}{end}'
+
+
+def _person(user):
+    return (user.get_full_name() or user.username) if user else ''
+
+
+def _build(path, title, story):
+    styles = _styles()
+    generated = timezone.localtime()
+
+    def footer(canvas, doc):
+        canvas.saveState()
+        canvas.setFont(font(), 8)
+        canvas.drawRightString(A4[0] - 15 * mm, 10 * mm, visual(f'הופק ב-{generated:%d/%m/%Y %H:%M}'))
+        canvas.drawString(15 * mm, 10 * mm, str(doc.page))
+        canvas.restoreState()
+
+    doc = SimpleDocTemplate(
+        str(path), pagesize=A4, title=title,
+        leftMargin=15 * mm, rightMargin=15 * mm, topMargin=15 * mm, bottomMargin=18 * mm,
+    )
+    doc.build([_paragraph(title, styles['title'])] + story, onFirstPage=footer, onLaterPages=footer)
+
+
+def _ordered(queryset):
+    return queryset.select_related('therapist').order_by('scheduled_date', 'start_time', 'pk')
+
+
+def build_child_history(report, path):
+    styles = _styles()
+    child = Child.objects.select_related('family', 'therapist__user').get(pk=report.subject_id)
+    rows = []
+    for t in _ordered(treatments(report.kind, report.subject_id)).iterator():
+        rows.append((
+            _day(t.actual_date or t.scheduled_date), _hour(t), t.get_type_display(), t.get_status_display(),
+            _person(t.therapist), t.summary or '',
+        ))
+    story = _info([
+        ('משפחה', child.family.name),
+        ('תאריך לידה', _day(child.birth_date)),
+        ('בית ספר', ' '.join(filter(None, [child.school, child.grade]))),
+        ('מטפל', _person(child.therapist.user) if child.therapist else ''),
+        ('מספר טיפולים', len(rows)),
+    ], styles)
+    story += [
+        Spacer(0, 4 * mm),
+        _table(('תאריך', 'שעה', 'סוג', 'סטטוס', 'מטפל', 'סיכום'), rows,
+               (22 * mm, 22 * mm, 26 * mm, 24 * mm, 28 * mm, 58 * mm), styles),
+    ]
+    _build(path, f'היסטוריית טיפולים - {child.name}', story)
+
+
+def build_family_summary(report, path):
+    styles = _styles()
+    family = Family.objects.select_related('therapist').get(pk=report.subject_id)
+    children = family.children.order_by('birth_date')
+    statuses = Counter()
+    rows = []
+    queryset = _ordered(treatments(report.kind, report.subject_id)).select_related('child')
+    for t in queryset.iterator():
+        statuses[t.status] += 1
+        rows.append((
+            _day(t.actual_date or t.scheduled_date), t.child.name if t.child else 'משפחה',
+            t.get_type_display(), t.get_status_display(), _person(t.therapist),
+        ))
+    story = _info([
+        ('כתובת', family.address),
+        ('טלפון', family.phone),
+        ('מצב משפחתי', family.get_family_status_display()),
+        ('מטפל', _person(family.therapist)),
+    ], styles)
+    story += [
+        _paragraph('ילדים', styles['heading']),
+        _table(('שם', 'תאריך לידה', 'בית ספר', 'כיתה'),
+               [(c.name, _day(c.birth_date), c.school, c.grade) for c in children] or [('-', '', '', '')],
+               (45 * mm, 30 * mm, 60 * mm, 45 * mm), styles),
+        _paragraph(f'טיפולים ({len(rows)})', styles['heading']),
+        _counts(statuses, Treatment.TreatmentStatus.choices, styles),
+        Spacer(0, 4 * mm),
+        _table(('תאריך', 'ילד', 'סוג', 'סטטוס', 'מטפל'), rows or [('-', '', '', '', '')],
+               (25 * mm, 40 * mm, 35 * mm, 35 * mm, 45 * mm), styles),
+    ]
+    _build(path, f'סיכום משפחה - {family.name}', story)
+
+
+def build_therapist_month(report, path):
+    styles = _styles()
+    therapist = User.objects.get(pk=report.subject_id)
+    statuses, types = Counter(), Counter()
+    rows = []
+    queryset = _ordered(treatments(report.kind, report.subject_id, report.period)).select_related(
+        'family', 'child__family'
+    )
+    for t in queryset.iterator():
+        statuses[t.status] += 1
+        types[t.type] += 1
+        family = t.family or (t.child.family if t.child else None)
+        client = ' - '.join(filter(None, [family.name if family else '', t.child.name if t.child else '']))
+        rows.append((
+            _day(t.scheduled_date), _hour(t), client, t.get_type_display(), t.get_status_display(),
+            'כן' if t.summary else 'לא',
+        ))
+    story = _info([('מספר טיפולים', len(rows))], styles)
+    story += [
+        _paragraph('לפי סטטוס', styles['heading']),
+        _counts(statuses, Treatment.TreatmentStatus.choices, styles),
+        _paragraph('לפי סוג טיפול', styles['heading']),
+        _counts(types, Treatment.TreatmentType.choices, styles),
+        _paragraph('טיפולים', styles['heading']),
+        _table(('תאריך', 'שעה', 'משפחה / ילד', 'סוג', 'סטטוס', 'סיכום'), rows or [('-', '', '', '', '', '')],
+               (22 * mm, 24 * mm, 56 * mm, 30 * mm, 30 * mm, 18 * mm), styles),
+    ]
+    _build(path, f'פעילות חודשית - {_person(therapist)} {report.period:%m/%Y}', story)
+
+
+BUILDERS = {
+    Report.Kind.CHILD_HISTORY: build_child_history,
+    Report.Kind.FAMILY_SUMMARY: build_family_summary,
+    Report.Kind.THERAPIST_MONTH: build_therapist_month,
+}
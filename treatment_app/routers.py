@@ -0,0 +1,135 @@
+"""
+Primary/replica database routing.
+
+Reads go to the ``replica`` alias only inside views marked read-only with
+``replica_reads`` / ``ReplicaReadMixin`` (lists, calendar feed, dashboard,
+REST API), and only when the request is not pinned to the primary. A
+request is pinned when:
+- it is not a GET/HEAD/OPTIONS request,
+- it has written anything (the router saw ``db_for_write``),
+- it is inside a transaction on the primary, or
+- the client wrote within the last ``REPLICA_PIN_SECONDS`` (see
+  ``ReplicaPinningMiddleware``), so a redirect after a save does not read
+  stale rows from a lagging replica.
+
+Writes, migrations, sessions, users and everything outside marked views
+use ``default``, as does anything outside a request handled by
+``ReplicaPinningMiddleware``. Without a ``replica`` entry in ``DATABASES``
+the router is a no-op.
+"""
+
+from contextvars import ContextVar
+from functools import wraps
+
+from django.db import connections
+
+PRIMARY_ALIAS = 'default'
+REPLICA_ALIAS = 'replica'
+
+# Sessions and users are read on every request right after login writes
+# them; a lagging replica would log the user out
+PRIMARY_ONLY_APPS = {'sessions', 'auth'}
+
+_replica_reads = ContextVar('replica_reads', default=False)
+# Per-request routing state, set by ReplicaPinningMiddleware; outside a
+# request (management commands, shell) everything uses the primary
+_request_state = ContextVar('replica_request_state', default=None)
+
+
+class _RequestState:
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def replica_available():
+    return REPLICA_ALIAS in connections.settings
+
+
+def pin_to_primary():
+    """
+    Send the rest of the current request to the primary.
+    """
+    state = _request_state.get()
+    if state is not None:
+        state.pinned = True
+
+
+def begin_request(pinned):
+    """
+    Start routing a request. Returns the token to pass to ``end_request()``.
+    """
+    return _request_state.set(_RequestState(bool(pinned)))
+
+
+def end_request(token):
+    """
+    Stop routing a request. Returns True if it wrote to the primary.
+    """
+    wrote = _request_state.get().wrote
+    _request_state.reset(token)
+    return wrote
+
+
+def replica_reads(view):
+    """
+    Decorator for read-only function views: let their queries use the replica.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = _replica_reads.set(True)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _replica_reads.reset(token)
+    return wrapper
+
+
+class ReplicaReadMixin:
+    """
+    Class-based view counterpart of ``replica_reads``.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        token = _replica_reads.set(True)
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+            # Template responses evaluate their querysets when rendered,
+            # which would otherwise happen after the replica context ends
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            return response
+        finally:
+            _replica_reads.reset(token)
+
+
+def _use_replica():
+    state = _request_state.get()
+    if state is None or state.pinned or not _replica_reads.get() or not replica_available():
+        return False
+    if connections[PRIMARY_ALIAS].in_atomic_block:
+        # Reads inside a transaction must see its own writes
+        return False
+    return True
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_ONLY_APPS:
+            return PRIMARY_ALIAS
+        return REPLICA_ALIAS if _use_replica() else PRIMARY_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return PRIMARY_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary
+        return db == PRIMARY_ALIAS
@@ -0,0 +1,164 @@
+"""
+Therapist scheduling: double-booking checks and free time.
+
+Two sessions conflict when they have the same therapist and date and their
+times overlap (``start < other_end and other_start < end``); cancelled
+sessions never conflict. Each lookup is a range query on the
+``treatment_therapist_slot_idx`` index (therapist, scheduled_date,
+start_time), which narrows it to one therapist's day.
+
+Batch checks (recurring series, imports) and the free-slot search load the
+bookings of every therapist and date involved with one query and compare
+the intervals in memory.
+"""
+
+from collections import defaultdict
+from datetime import time, timedelta
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .models import Treatment
+
+# Opening hours, as enforced by the treatment form validators
+DAY_START = time(8, 0)
+DAY_END = time(20, 0)
+# Sunday to Thursday, as date.weekday() numbers
+WORK_DAYS = (6, 0, 1, 2, 3)
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _time(minutes):
+    return time(minutes // 60, minutes % 60)
+
+
+def bookings():
+    """
+    Sessions that occupy their therapist's time.
+    """
+    return Treatment.objects.exclude(status=Treatment.TreatmentStatus.CANCELLED).filter(
+        start_time__isnull=False, end_time__isnull=False
+    )
+
+
+def find_conflicts(therapist, day, start, end, exclude=()):
+    """
+    Sessions of ``therapist`` on ``day`` overlapping ``start``-``end``,
+    except the treatments whose pks are in ``exclude``.
+    """
+    return bookings().filter(
+        therapist=therapist, scheduled_date=day, start_time__lt=end, end_time__gt=start
+    ).exclude(pk__in=exclude).order_by('start_time')
+
+
+def batch_conflicts(slots, exclude=()):
+    """
+    Check many proposed sessions at once.
+
+    ``slots`` is a sequence of ``(therapist_id, date, start_time, end_time)``.
+    Returns ``{slot index: [conflicts]}`` for the slots that overlap an
+    existing session (its pk) or an earlier slot of the same batch
+    (``('batch', index)``) that did not conflict itself. One query, whatever
+    the batch size.
+    """
+    slots = list(slots)
+    therapist_ids = {slot[0] for slot in slots if slot[0] is not None}
+    dates = {slot[1] for slot in slots}
+    existing = defaultdict(list)
+    if therapist_ids and dates:
+        rows = bookings().filter(therapist__in=therapist_ids, scheduled_date__in=dates).exclude(
+            pk__in=exclude
+        ).values_list('pk', 'therapist_id', 'scheduled_date', 'start_time', 'end_time')
+        for pk, therapist_id, day, start, end in rows:
+            existing[therapist_id, day].append((_minutes(start), _minutes(end), pk))
+
+    conflicts = {}
+    for index, (therapist_id, day, start, end) in enumerate(slots):
+        if therapist_id is None:
+            continue
+        start, end = _minutes(start), _minutes(end)
+        found = [ref for other_start, other_end, ref in existing[therapist_id, day]
+                 if other_start < end and start < other_end]
+        if found:
+            conflicts[index] = found
+        else:
+            # Later slots of the batch are checked against this one too; a
+            # slot that conflicts will not be booked, so it blocks nothing
+            existing[therapist_id, day].append((start, end, ('batch', index)))
+    return conflicts
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def free_intervals(busy, day_start=DAY_START, day_end=DAY_END, min_minutes=0):
+    """
+    Gaps between the ``(start, end)`` minute intervals in ``busy`` within the
+    opening hours, as ``(start, end)`` minute pairs at least ``min_minutes``
+    long.
+    """
+    free = []
+    cursor, close = _minutes(day_start), _minutes(day_end)
+    for start, end in _merge(busy):
+        if start > cursor:
+            free.append((cursor, min(start, close)))
+        cursor = max(cursor, end)
+    if cursor < close:
+        free.append((cursor, close))
+    return [(start, end) for start, end in free if end - start >= max(min_minutes, 1)]
+
+
+def week_days(day):
+    """
+    The working days (Sunday to Thursday) of the week containing ``day``.
+    """
+    sunday = day - timedelta(days=(day.weekday() + 1) % 7)
+    days = (sunday + timedelta(days=offset) for offset in range(7))
+    return [day for day in days if day.weekday() in WORK_DAYS]
+
+
+def active_therapists():
+    return User.objects.filter(is_active=True, therapistprofile__is_active=True)
+
+
+def free_slots(week, therapists, min_minutes=60, now=None):
+    """
+    Free time of ``therapists`` (a User queryset) in the week containing
+    ``week``, in one query for all of them.
+
+    Returns ``[{'therapist': user, 'days': [(date, [(start, end), ...])]}]``
+    with ``datetime.time`` bounds. Past days have no free time and today
+    starts at the current time.
+    """
+    now = timezone.localtime(now)
+    days = [day for day in week_days(week) if day >= now.date()]
+    therapists = list(therapists)
+    busy = defaultdict(list)
+    if days and therapists:
+        rows = bookings().filter(
+            therapist__in=therapists, scheduled_date__in=days
+        ).values_list('therapist_id', 'scheduled_date', 'start_time', 'end_time')
+        for therapist_id, day, start, end in rows:
+            busy[therapist_id, day].append((_minutes(start), _minutes(end)))
+
+    result = []
+    for therapist in therapists:
+        schedule = []
+        for day in days:
+            day_start = DAY_START
+            if day == now.date():
+                day_start = max(DAY_START, min(DAY_END, now.time().replace(second=0, microsecond=0)))
+            gaps = free_intervals(busy[therapist.pk, day], day_start, DAY_END, min_minutes)
+            schedule.append((day, [(_time(start), _time(end)) for start, end in gaps]))
+        result.append({'therapist': therapist, 'days': schedule})
+    return result
@@ -0,0 +1,448 @@
+"""
+Full-text search.
+
+Families, children, treatment summaries and documents are indexed in an
+SQLite FTS5 virtual table, so a search is one indexed MATCH ranked with
+bm25 instead of a LIKE scan over every row of several joined tables.
+
+Each indexed object is one row:
+- ``title``: the object's name (empty for treatments)
+- ``body``: the remaining free text (addresses, notes, summaries)
+- ``digits``: phone numbers reduced to digits, so "050-123 4567",
+  "0501234567" and "+972-50-1234567" all find the same family
+- ``variants``: Hebrew words with their prefix letters (ו, ה, ב, ל, מ, ש, כ)
+  removed, so "ילד" also finds "והילד"
+
+Niqqud and geresh/gershayim are stripped from indexed text and from queries
+alike. Signals keep the index current for regular saves; code that bypasses
+signals (``QuerySet.update()``, ``bulk_create()``) must call
+``update_index()`` itself.
+
+Other database backends have no FTS5 table; ``search_available()`` is False
+there and callers fall back to ``icontains`` lookups.
+"""
+
+import re
+import unicodedata
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.urls import reverse
+
+from .models import Family, Child, Treatment, Document, TherapistAccess
+
+TABLE = 'treatment_app_searchindex'
+
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+    "kind UNINDEXED, object_id UNINDEXED, family_id UNINDEXED, "
+    "title, body, digits, variants, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+DROP_TABLE_SQL = f"DROP TABLE IF EXISTS {TABLE}"
+
+# bm25 weights, one per column in table order (unindexed columns are ignored)
+RANK_WEIGHTS = (0, 0, 0, 10.0, 1.0, 5.0, 0.5)
+BODY_COLUMN = 4
+
+KINDS = {
+    'family': Family,
+    'child': Child,
+    'treatment': Treatment,
+    'document': Document,
+}
+
+# rowid = pk * len(KINDS) + kind code, so re-indexing an object deletes by
+# rowid instead of scanning the unindexed kind/object_id columns
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+MIN_QUERY_LENGTH = 2
+
+HEBREW_PREFIXES = 'ובהלמשכ'
+_QUOTES_IN_WORD = re.compile(r'(?<=\w)[\'"׳״](?=\w)')
+_HEBREW_WORD = re.compile(r'[א-ת]{4,}')
+_WORD = re.compile(r'\w+')
+_PHONE = re.compile(r'\+?[\d\-\s().]+')
+
+
+def search_available():
+    """
+    True when the database has the FTS5 index (SQLite only).
+    """
+    return connection.vendor == 'sqlite'
+
+
+def normalize_text(value):
+    """
+    Strip niqqud and cantillation marks and join words split by geresh or
+    gershayim (עו״ס -> עוס), which the tokenizer would otherwise break apart.
+    """
+    if not value:
+        return ''
+    value = ''.join(ch for ch in value if unicodedata.category(ch) != 'Mn')
+    return _QUOTES_IN_WORD.sub('', value)
+
+
+def normalize_phone(value):
+    """
+    Return the digits of a phone number, plus the local form of an Israeli
+    international number (+972-50-... -> 050...).
+    """
+    digits = re.sub(r'\D', '', value or '')
+    if not digits:
+        return []
+    forms = [digits]
+    if digits.startswith('972') and len(digits) > 9:
+        forms.append('0' + digits[3:])
+    return forms
+
+
+def hebrew_variants(text):
+    """
+    Hebrew words of ``text`` with up to two prefix letters removed.
+    """
+    variants = []
+    for word in _HEBREW_WORD.findall(text):
+        stripped = word
+        for _ in range(2):
+            if stripped[0] not in HEBREW_PREFIXES or len(stripped) <= 3:
+                break
+            stripped = stripped[1:]
+            variants.append(stripped)
+    return variants
+
+
+def _rowid(kind, object_id):
+    return object_id * len(KINDS) + KIND_CODES[kind]
+
+
+def _document(kind, object_id, family_id, title, body_parts, phones):
+    title = normalize_text(title)
+    body = normalize_text(' '.join(part for part in body_parts if part))
+    digits = ' '.join(form for phone in phones for form in normalize_phone(phone))
+    variants = ' '.join(hebrew_variants(f'{title} {body}'))
+    return (_rowid(kind, object_id), kind, object_id, family_id, title, body, digits, variants)
+
+
+def _family_rows(families):
+    rows = families.values_list(
+        'pk', 'name', 'address', 'email', 'father_name', 'mother_name', 'social_worker_name',
+        'therapist__first_name', 'therapist__last_name', 'notes',
+        'phone', 'father_phone', 'mother_phone', 'social_worker_phone',
+    )
+    for pk, name, *text, phone, father_phone, mother_phone, social_worker_phone in rows:
+        yield _document('family', pk, pk, name, text, [phone, father_phone, mother_phone, social_worker_phone])
+
+
+def _child_rows(children):
+    rows = children.values_list(
+        'pk', 'family_id', 'name', 'school', 'teacher_name', 'school_counselor_name',
+        'teacher_phone', 'school_counselor_phone',
+    )
+    for pk, family_id, name, school, teacher, counselor, teacher_phone, counselor_phone in rows:
+        yield _document('child', pk, family_id, name, [school, teacher, counselor], [teacher_phone, counselor_phone])
+
+
+def _treatment_rows(treatments):
+    rows = treatments.values_list('pk', 'family_id', 'child__family_id', 'summary', 'next_steps')
+    for pk, family_id, child_family_id, summary, next_steps in rows:
+        if summary or next_steps:
+            yield _document('treatment', pk, family_id or child_family_id, '', [summary, next_steps], [])
+
+
+def _document_rows(documents):
+    for pk, family_id, name, notes in documents.values_list('pk', 'family_id', 'name', 'notes'):
+        yield _document('document', pk, family_id, name, [notes], [])
+
+
+ROW_BUILDERS = {
+    'family': _family_rows,
+    'child': _child_rows,
+    'treatment': _treatment_rows,
+    'document': _document_rows,
+}
+
+
+def _kind_of(model):
+    for kind, kind_model in KINDS.items():
+        if model._meta.label_lower == kind_model._meta.label_lower:
+            return kind
+    raise ValueError(f"No search index for {model.__name__}")
+
+
+def iter_index_rows(models=None):
+    """
+    Yield an index row for every searchable object.
+
+    ``models`` maps kind to model class, letting data migrations pass
+    historical models.
+    """
+    models = models or KINDS
+    for kind, build in ROW_BUILDERS.items():
+        yield from build(models[kind].objects.all())
+
+
+def _insert_rows(cursor, rows, batch_size=500):
+    rows = iter(rows)
+    sql = (
+        f"INSERT INTO {TABLE} (rowid, kind, object_id, family_id, title, body, digits, variants)"
+        " VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+    )
+    count = 0
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            return count
+        cursor.executemany(sql, batch)
+        count += len(batch)
+
+
+def _delete_rows(cursor, kind, pks):
+    rowids = [_rowid(kind, pk) for pk in pks]
+    for start in range(0, len(rowids), 500):
+        chunk = rowids[start:start + 500]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(f"DELETE FROM {TABLE} WHERE rowid IN ({placeholders})", chunk)
+
+
+def update_index(model, pks):
+    """
+    Re-index the given objects of ``model``; missing objects are removed.
+    """
+    pks = {pk for pk in pks if pk is not None}
+    if not pks or not search_available():
+        return
+    kind = _kind_of(model)
+    with transaction.atomic(), connection.cursor() as cursor:
+        _delete_rows(cursor, kind, pks)
+        _insert_rows(cursor, ROW_BUILDERS[kind](KINDS[kind].objects.filter(pk__in=pks)))
+
+
+def remove_from_index(model, pks):
+    """
+    Drop the given objects of ``model`` from the index.
+    """
+    pks = {pk for pk in pks if pk is not None}
+    if not pks or not search_available():
+        return
+    with connection.cursor() as cursor:
+        _delete_rows(cursor, _kind_of(model), pks)
+
+
+def fill_index(models=None):
+    """
+    Write every searchable object into an empty index. Returns the row count.
+    """
+    with connection.cursor() as cursor:
+        return _insert_rows(cursor, iter_index_rows(models))
+
+
+def rebuild_search_index():
+    """
+    Drop and rebuild the whole index. Returns the number of rows written.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(DROP_TABLE_SQL)
+        cursor.execute(CREATE_TABLE_SQL)
+        return _insert_rows(cursor, iter_index_rows())
+
+
+def _is_phone(value):
+    return bool(_PHONE.fullmatch(value)) and len(re.sub(r'\D', '', value)) >= 3
+
+
+def query_terms(query):
+    """
+    Split a search query into normalized terms.
+
+    Phone-like chunks ("050-1234567", "+972 50 123 4567") become a single
+    digits-only term in local form, which is indexed for every number.
+    """
+    query = normalize_text(query).strip()
+    if _is_phone(query):
+        return normalize_phone(query)[-1:]
+    terms = []
+    for chunk in query.split():
+        if _is_phone(chunk):
+            terms.extend(normalize_phone(chunk)[-1:])
+        else:
+            terms.extend(_WORD.findall(chunk))
+    return terms
+
+
+def match_expression(query, columns=('title', 'body', 'digits', 'variants')):
+    """
+    Build an FTS5 MATCH expression requiring every term as a prefix.
+
+    Terms are quoted, so FTS5 operators typed by the user are searched as
+    plain text. Returns None when the query has no searchable terms.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return None
+    column_filter = '{' + ' '.join(columns) + '}'
+    return ' AND '.join(f'{column_filter} : "{term}"*' for term in terms)
+
+
+def _visibility_sql(user):
+    """
+    SQL condition and params restricting index rows to what ``user`` may see,
+    following the same rules as ``access.scope_queryset``.
+    """
+    if user.is_superuser:
+        return '', []
+    access = TherapistAccess._meta.db_table
+    sql = (
+        f" AND EXISTS (SELECT 1 FROM {access} a WHERE a.user_id = %s AND ("
+        f"(s.kind = 'treatment' AND a.treatment_id = s.object_id)"
+        f" OR (s.kind = 'child' AND a.treatment_id IS NULL AND a.child_id = s.object_id)"
+        f" OR (s.kind IN ('family', 'document') AND a.treatment_id IS NULL AND a.child_id IS NULL"
+        f" AND a.family_id = s.family_id)))"
+    )
+    return sql, [user.pk]
+
+
+def _ranked_hits(user, expression, kinds, limit):
+    weights = ', '.join(str(weight) for weight in RANK_WEIGHTS)
+    visibility, visibility_params = _visibility_sql(user)
+    kind_placeholders = ', '.join(['%s'] * len(kinds))
+    sql = (
+        f"SELECT s.kind, s.object_id, snippet({TABLE}, {BODY_COLUMN}, '', '', '…', 12), bm25({TABLE}, {weights}) AS score"
+        f" FROM {TABLE} s WHERE {TABLE} MATCH %s AND s.kind IN ({kind_placeholders}){visibility}"
+        f" ORDER BY score LIMIT %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [expression, *kinds, *visibility_params, limit])
+        return cursor.fetchall()
+
+
+def _labels(hits):
+    """
+    Display labels for the hits, loaded with one query per kind.
+    """
+    ids = {}
+    for kind, object_id, _, _ in hits:
+        ids.setdefault(kind, set()).add(object_id)
+
+    labels = {}
+    if 'family' in ids:
+        for pk, name in Family.objects.filter(pk__in=ids['family']).values_list('pk', 'name'):
+            labels['family', pk] = name
+    if 'child' in ids:
+        for pk, name, family_name in Child.objects.filter(pk__in=ids['child']).values_list('pk', 'name', 'family__name'):
+            labels['child', pk] = f'{name} ({family_name})'
+    if 'treatment' in ids:
+        rows = Treatment.objects.filter(pk__in=ids['treatment']).values_list(
+            'pk', 'child__name', 'family__name', 'scheduled_date'
+        )
+        for pk, child_name, family_name, scheduled_date in rows:
+            labels['treatment', pk] = f'{child_name or family_name or ""} - {scheduled_date:%d/%m/%Y}'
+    if 'document' in ids:
+        for pk, name in Document.objects.filter(pk__in=ids['document']).values_list('pk', 'name'):
+            labels['document', pk] = name
+    return labels
+
+
+def search(user, query, kinds=None, limit=DEFAULT_LIMIT):
+    """
+    Ranked search across everything ``user`` may see.
+
+    Returns a list of ``{'kind', 'id', 'label', 'snippet', 'url', 'score'}``
+    dicts, best match first.
+    """
+    kinds = [kind for kind in (kinds or KINDS) if kind in KINDS]
+    limit = max(1, min(limit, MAX_LIMIT))
+    if len(query.strip()) < MIN_QUERY_LENGTH or not kinds:
+        return []
+
+    if search_available():
+        expression = match_expression(query)
+        if expression is None:
+            return []
+        hits = _ranked_hits(user, expression, kinds, limit)
+    else:
+        hits = _fallback_hits(user, query, kinds, limit)
+
+    labels = _labels(hits)
+    results = []
+    for kind, object_id, snippet, score in hits:
+        if (kind, object_id) not in labels:
+            continue  # deleted since it was indexed
+        results.append({
+            'kind': kind,
+            'id': object_id,
+            'label': labels[kind, object_id],
+            'snippet': snippet,
+            'url': reverse(f'treatment_app:{kind}-detail', kwargs={'pk': object_id}),
+            'score': round(-score, 4),
+        })
+    return results
+
+
+def _fallback_hits(user, query, kinds, limit):
+    """
+    Unranked ``icontains`` search for databases without FTS5.
+    """
+    from .access import scope_queryset
+
+    lookups = {
+        'family': ('name', 'phone', 'address'),
+        'child': ('name',),
+        'treatment': ('summary', 'next_steps'),
+        'document': ('name', 'notes'),
+    }
+    hits = []
+    for kind in kinds:
+        condition = None
+        for field in lookups[kind]:
+            q = Q(**{f'{field}__icontains': query.strip()})
+            condition = q if condition is None else condition | q
+        queryset = scope_queryset(KINDS[kind].objects.all(), user).filter(condition)
+        hits.extend((kind, pk, '', 0) for pk in queryset.values_list('pk', flat=True)[:limit - len(hits)])
+        if len(hits) >= limit:
+            break
+    return hits
+
+
+def matching_family_ids(query):
+    """
+    Ids of families whose own fields or whose children's names match ``query``.
+
+    Used by the family list, which is scoped separately.
+    """
+    family_expression = match_expression(query)
+    if family_expression is None:
+        return []
+    child_expression = match_expression(query, columns=('title',))
+    sql = (
+        f"SELECT family_id FROM {TABLE} WHERE {TABLE} MATCH %s AND kind = 'family'"
+        f" UNION SELECT family_id FROM {TABLE} WHERE {TABLE} MATCH %s AND kind = 'child'"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [family_expression, child_expression])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def filter_families(queryset, query):
+    """
+    Narrow a family queryset to the families matching ``query``: name,
+    phone, address, therapist or a child's name. Shared by the family list
+    and the family export.
+    """
+    query = (query or '').strip()
+    if not query:
+        return queryset
+    if search_available():
+        # Family fields and child names are matched through the full-text index
+        return queryset.filter(pk__in=matching_family_ids(query))
+    # Child names are matched through a subquery, so no join/DISTINCT is needed
+    return queryset.filter(
+        Q(name__icontains=query) |  # Family name
+        Q(phone__icontains=query) |  # Phone number
+        Q(address__icontains=query) |  # Address
+        Q(therapist__first_name__icontains=query) |  # Therapist first name
+        Q(therapist__last_name__icontains=query) |  # Therapist last name
+        Q(pk__in=Child.objects.filter(name__icontains=query).values('family_id'))  # Child name
+    )
@@ -0,0 +1,197 @@
+"""
+Serializers for the REST API: read-only ones for the records and the two
+used by document uploads.
+
+Every serializer accepts ``?fields=a,b,c`` to return only the listed
+fields. ``related_fields`` maps a serializer field to the relation it
+reads, so the viewset can ``select_related``/``prefetch_related`` only what
+the requested fields actually need.
+"""
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+
+from .access import scope_queryset
+from .models import Family, Child, Treatment, Document, Upload
+
+
+def requested_fields(request):
+    """
+    Return the set of field names in ``?fields=``, or None for all fields.
+    """
+    if request is None:
+        return None
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsetSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer that drops the fields not named in ``?fields=``.
+    """
+    # field name -> ('select' | 'prefetch', lookup)
+    related_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        wanted = requested_fields(self.context.get('request'))
+        if wanted:
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+    @classmethod
+    def optimize_queryset(cls, queryset, request):
+        """
+        Apply select_related/prefetch_related for the requested fields only.
+        """
+        wanted = requested_fields(request)
+        selects, prefetches = set(), set()
+        for name, (kind, lookup) in cls.related_fields.items():
+            if wanted is not None and name not in wanted:
+                continue
+            (selects if kind == 'select' else prefetches).add(lookup)
+        if selects:
+            queryset = queryset.select_related(*sorted(selects))
+        if prefetches:
+            queryset = queryset.prefetch_related(*sorted(prefetches))
+        return queryset
+
+
+def user_display_name(user):
+    if user is None:
+        return None
+    return user.get_full_name() or user.username
+
+
+class FamilySerializer(SparseFieldsetSerializer):
+    therapist_name = serializers.SerializerMethodField()
+    children = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+
+    related_fields = {
+        'therapist_name': ('select', 'therapist'),
+        'children': ('prefetch', 'children'),
+    }
+
+    class Meta:
+        model = Family
+        fields = [
+            'id', 'name', 'address', 'phone', 'email', 'parents_type', 'family_status',
+            'father_name', 'father_phone', 'father_email',
+            'mother_name', 'mother_phone', 'mother_email',
+            'primary_contact_type', 'therapist', 'therapist_name', 'social_worker',
+            'children', 'notes', 'created_at', 'updated_at',
+        ]
+
+    def get_therapist_name(self, obj):
+        return user_display_name(obj.therapist)
+
+
+class ChildSerializer(SparseFieldsetSerializer):
+    family_name = serializers.CharField(source='family.name', read_only=True)
+    therapist_name = serializers.SerializerMethodField()
+
+    related_fields = {
+        'family_name': ('select', 'family'),
+        'therapist_name': ('select', 'therapist__user'),
+    }
+
+    class Meta:
+        model = Child
+        fields = [
+            'id', 'family', 'family_name', 'name', 'birth_date', 'gender',
+            'school', 'grade', 'teacher_name', 'teacher_phone',
+            'school_counselor_name', 'school_counselor_phone',
+            'allergies', 'medications', 'special_needs', 'medical_info', 'notes',
+            'therapist', 'therapist_name', 'created_at', 'updated_at',
+        ]
+
+    def get_therapist_name(self, obj):
+        return user_display_name(obj.therapist.user) if obj.therapist else None
+
+
+class TreatmentSerializer(SparseFieldsetSerializer):
+    family_name = serializers.SerializerMethodField()
+    child_name = serializers.SerializerMethodField()
+    therapist_name = serializers.SerializerMethodField()
+    type_display = serializers.CharField(source='get_type_display', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+
+    related_fields = {
+        'family_name': ('select', 'family'),
+        'child_name': ('select', 'child'),
+        'therapist_name': ('select', 'therapist'),
+    }
+
+    class Meta:
+        model = Treatment
+        fields = [
+            'id', 'family', 'family_name', 'child', 'child_name', 'therapist', 'therapist_name',
+            'type', 'type_display', 'status', 'status_display',
+            'scheduled_date', 'actual_date', 'start_time', 'end_time',
+            'summary', 'next_steps', 'needs_summary', 'created_at', 'updated_at',
+        ]
+
+    def get_family_name(self, obj):
+        return obj.family.name if obj.family else None
+
+    def get_child_name(self, obj):
+        return obj.child.name if obj.child else None
+
+    def get_therapist_name(self, obj):
+        return user_display_name(obj.therapist)
+
+
+class DocumentSerializer(SparseFieldsetSerializer):
+    family_name = serializers.SerializerMethodField()
+    child_name = serializers.SerializerMethodField()
+
+    related_fields = {
+        'family_name': ('select', 'family'),
+        'child_name': ('select', 'child'),
+    }
+
+    class Meta:
+        model = Document
+        fields = [
+            'id', 'family', 'family_name', 'child', 'child_name', 'name',
+            'document_type', 'file', 'notes', 'created_at', 'updated_at',
+        ]
+
+    def get_family_name(self, obj):
+        return obj.family.name if obj.family else None
+
+    def get_child_name(self, obj):
+        return obj.child.name if obj.child else None
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Upload
+        fields = ['id', 'filename', 'size', 'sha256', 'offset', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'offset', 'created_at', 'updated_at']
+
+
+class DocumentUploadSerializer(serializers.ModelSerializer):
+    """
+    The document a finished upload becomes, attached to a family or child
+    the user may see.
+    """
+
+    class Meta:
+        model = Document
+        fields = ['name', 'document_type', 'notes', 'family', 'child']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        user = self.context['request'].user
+        self.fields['family'].queryset = scope_queryset(Family.objects.all(), user)
+        self.fields['child'].queryset = scope_queryset(Child.objects.all(), user)
+
+    def validate(self, attrs):
+        try:
+            Document(**attrs).clean()
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages)
+        return attrs
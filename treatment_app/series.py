@@ -0,0 +1,194 @@
+"""
+Recurring treatment series.
+
+A series is expanded into its sessions when it is created: every
+occurrence is validated, then all of them are written with one
+``bulk_create`` inside the transaction that saves the series. Later
+changes to the time, type or therapist, and cancellation, apply to the
+remaining scheduled sessions with a single UPDATE.
+
+``bulk_create`` and ``update`` skip ``Treatment.save()`` and the model
+signals, so the functions here keep the access index and caches in step
+themselves. New sessions have no summary, so the search index is unaffected.
+"""
+
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from . import access, scheduling
+from .caching import bump_cache_version
+from .forms import validate_weekday, validate_treatment_start_time, validate_treatment_end_time
+from .models import Treatment, TreatmentSeries
+
+MAX_SERIES_LENGTH = timedelta(days=365)
+STEPS = {
+    TreatmentSeries.Frequency.WEEKLY: timedelta(weeks=1),
+    TreatmentSeries.Frequency.BIWEEKLY: timedelta(weeks=2),
+}
+
+# Fields of the series that can be changed on all remaining sessions at once
+EDITABLE_FIELDS = ('therapist', 'type', 'start_time', 'end_time')
+
+
+def validate_series(series, today=None):
+    """
+    Raise ``ValidationError`` (keyed by field) unless every session of
+    ``series`` falls on Sunday–Thursday between 08:00 and 20:00, the
+    series starts today or later and spans at most a year, its child
+    belongs to its family, and the therapist is free at all of its times.
+    """
+    today = today or timezone.localdate()
+    errors = {}
+
+    def check(field, validator, value):
+        if value is not None:
+            try:
+                validator(value)
+            except ValidationError as e:
+                errors.setdefault(field, []).extend(e.messages)
+
+    # Sessions repeat on the weekday of the first one
+    check('start_date', validate_weekday, series.start_date)
+    check('start_time', validate_treatment_start_time, series.start_time)
+    check('end_time', validate_treatment_end_time, series.end_time)
+
+    if series.start_time and series.end_time and series.start_time >= series.end_time:
+        errors.setdefault('end_time', []).append(_('שעת סיום חייבת להיות לאחר שעת ההתחלה'))
+    if series.start_date and series._state.adding and series.start_date < today:
+        errors.setdefault('start_date', []).append(_('סדרה חדשה אינה יכולה להתחיל בעבר'))
+    if series.start_date and series.end_date:
+        if series.end_date < series.start_date:
+            errors.setdefault('end_date', []).append(_('תאריך הסיום חייב להיות אחרי תאריך ההתחלה'))
+        elif series.end_date - series.start_date > MAX_SERIES_LENGTH:
+            errors.setdefault('end_date', []).append(_('סדרת טיפולים יכולה להימשך עד שנה'))
+    if not series.family_id and not series.child_id:
+        errors.setdefault('family', []).append(_('יש לבחור משפחה או ילד'))
+    elif series.family_id and series.child_id and series.child.family_id != series.family_id:
+        # The sessions are indexed and shown under series.family
+        errors.setdefault('child', []).append(_('הילד אינו שייך למשפחה זו'))
+
+    if errors:
+        raise ValidationError(errors)
+    check_conflicts(series)
+
+
+def check_conflicts(series):
+    """
+    Raise ``ValidationError`` if the therapist of ``series`` is already booked
+    at the time of any of its (remaining) sessions. One query for the whole
+    series.
+    """
+    if not series.therapist_id:
+        return
+    if series._state.adding:
+        dates, exclude = occurrence_dates(series), []
+    else:
+        remaining = list(remaining_sessions(series).values_list('pk', 'scheduled_date'))
+        dates, exclude = [day for _, day in remaining], [pk for pk, _ in remaining]
+    slots = [(series.therapist_id, day, series.start_time, series.end_time) for day in dates]
+    conflicts = scheduling.batch_conflicts(slots, exclude=exclude)
+    if conflicts:
+        clashes = ', '.join(dates[index].strftime('%d/%m/%Y') for index in sorted(conflicts)[:5])
+        if len(conflicts) > 5:
+            clashes += ' ...'
+        raise ValidationError(
+            _('למטפל כבר נקבעו טיפולים באותן שעות (%(count)d מועדים): %(dates)s'),
+            params={'count': len(conflicts), 'dates': clashes},
+        )
+
+
+def occurrence_dates(series):
+    """
+    Dates of the sessions of ``series``, first to last.
+    """
+    step = STEPS[series.frequency]
+    day = series.start_date
+    dates = []
+    while day <= series.end_date:
+        dates.append(day)
+        day += step
+    return dates
+
+
+def _family_ids(series):
+    return {series.family_id or (series.child.family_id if series.child_id else None)}
+
+
+def create_series(series, created_by=None):
+    """
+    Validate and save ``series`` and generate its sessions. Returns the
+    created treatments.
+    """
+    series.created_by = created_by or series.created_by
+    series.full_clean()
+    with transaction.atomic():
+        series.save()
+        treatments = Treatment.objects.bulk_create(
+            [
+                Treatment(
+                    series=series,
+                    family_id=series.family_id,
+                    child_id=series.child_id,
+                    therapist_id=series.therapist_id,
+                    type=series.type,
+                    scheduled_date=day,
+                    start_time=series.start_time,
+                    end_time=series.end_time,
+                    status=Treatment.TreatmentStatus.SCHEDULED,
+                )
+                for day in occurrence_dates(series)
+            ],
+            batch_size=500,
+        )
+        access.sync_families(_family_ids(series))
+    bump_cache_version(Treatment)
+    return treatments
+
+
+def remaining_sessions(series, from_date=None):
+    """
+    Sessions of ``series`` still scheduled on or after ``from_date`` (today).
+    """
+    return series.treatments.filter(
+        status=Treatment.TreatmentStatus.SCHEDULED,
+        scheduled_date__gte=from_date or timezone.localdate(),
+    )
+
+
+def update_series(series, fields, from_date=None):
+    """
+    Save ``fields`` of ``series`` and copy them onto its remaining sessions
+    with one UPDATE. Returns the number of sessions changed.
+    """
+    fields = [name for name in fields if name in EDITABLE_FIELDS]
+    if not fields:
+        return 0
+    with transaction.atomic():
+        series.save(update_fields=fields)
+        changed = remaining_sessions(series, from_date).update(
+            updated_at=timezone.now(), **{name: getattr(series, name) for name in fields}
+        )
+        if 'therapist' in fields:
+            access.sync_families(_family_ids(series))
+    bump_cache_version(Treatment)
+    return changed
+
+
+def cancel_series(series, from_date=None):
+    """
+    Cancel the remaining sessions of ``series`` with one UPDATE. Sessions
+    that already took place keep their status. Returns the number cancelled.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        cancelled = remaining_sessions(series, from_date).update(
+            status=Treatment.TreatmentStatus.CANCELLED, updated_at=now
+        )
+        series.cancelled_at = now
+        series.save(update_fields=['cancelled_at'])
+    bump_cache_version(Treatment)
+    return cancelled
@@ -1,7 +1,11 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import TherapistProfile
+from .models import TherapistProfile, Family, Child, Treatment, Document
+from . import access, search, slowlog
+from .caching import bump_cache_version
 
 @receiver(post_save, sender=User)
 def create_or_update_therapist_profile(sender, instance, created, **kwargs):
@@ -21,3 +25,105 @@ def create_or_update_therapist_profile(sender, instance, created, **kwargs):
             user=instance, 
             is_active=True  # Default to active
         )
+
+@receiver(post_save, sender=Family)
+def sync_family_access(sender, instance, raw=False, **kwargs):
+    """
+    Keep the access index in line with the family's therapist
+    """
+    if not raw:
+        access.sync_families({instance.pk})
+
+@receiver(post_save, sender=Child)
+def sync_child_access(sender, instance, raw=False, **kwargs):
+    """
+    Keep the access index in line with the child's therapist and family
+    """
+    if not raw:
+        access.sync_child(instance)
+
+@receiver(post_delete, sender=Child)
+def sync_deleted_child_access(sender, instance, **kwargs):
+    """
+    A removed child no longer grants its therapist access to the family.
+    Runs after commit so a cascading family delete has finished first.
+    """
+    family_id = instance.family_id
+    transaction.on_commit(lambda: access.sync_families({family_id}))
+
+@receiver(post_save, sender=Treatment)
+def sync_treatment_access(sender, instance, raw=False, **kwargs):
+    """
+    Keep the access index in line with the treatment's therapist and client
+    """
+    if not raw:
+        access.sync_treatment(instance)
+
+@receiver(post_save, sender=TherapistProfile)
+def sync_therapist_profile_access(sender, instance, raw=False, **kwargs):
+    """
+    Children point at the profile, so re-sync the families of its children
+    """
+    if not raw:
+        access.sync_families(set(Child.objects.filter(therapist=instance).values_list('family_id', flat=True)))
+
+@receiver(pre_delete, sender=TherapistProfile)
+def sync_deleted_therapist_profile_access(sender, instance, **kwargs):
+    """
+    Deleting a profile detaches its children with a bulk SET NULL, which
+    sends no child signals, so re-sync their families after commit.
+    """
+    family_ids = set(Child.objects.filter(therapist=instance).values_list('family_id', flat=True))
+    if family_ids:
+        transaction.on_commit(lambda: access.sync_families(family_ids))
+
+@receiver(post_save, sender=Family)
+@receiver(post_save, sender=Child)
+@receiver(post_save, sender=Treatment)
+@receiver(post_save, sender=Document)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    """
+    Re-index the saved object for full-text search
+    """
+    if not raw:
+        search.update_index(sender, [instance.pk])
+
+@receiver(post_delete, sender=Family)
+@receiver(post_delete, sender=Child)
+@receiver(post_delete, sender=Treatment)
+@receiver(post_delete, sender=Document)
+def remove_from_search_index(sender, instance, **kwargs):
+    """
+    Drop the deleted object from the full-text index
+    """
+    search.remove_from_index(sender, [instance.pk])
+
+@receiver(post_save, sender=User)
+def update_therapist_search_index(sender, instance, raw=False, created=False, update_fields=None, **kwargs):
+    """
+    Family rows include the therapist's name, so re-index them on rename.
+    Logins only touch last_login and are skipped.
+    """
+    if not raw and not created and update_fields != frozenset({'last_login'}):
+        search.update_index(Family, instance.families.values_list('pk', flat=True))
+
+@receiver(post_save, sender=Family)
+@receiver(post_delete, sender=Family)
+@receiver(post_save, sender=Child)
+@receiver(post_delete, sender=Child)
+@receiver(post_save, sender=Treatment)
+@receiver(post_delete, sender=Treatment)
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+@receiver(post_save, sender=TherapistProfile)
+@receiver(post_delete, sender=TherapistProfile)
+def bump_model_cache_version(sender, **kwargs):
+    """
+    Invalidate cached fragments, feeds and dashboard counters built from this model
+    """
+    bump_cache_version(sender)
+
+
+@receiver(connection_created)
+def log_slow_queries(sender, connection, **kwargs):
+    slowlog.install(connection)
@@ -0,0 +1,197 @@
+"""
+Slow-query log.
+
+Every database connection gets an execute wrapper (installed on
+``connection_created``, so jobs and commands are covered as well as
+requests) that records each statement taking ``SLOW_QUERY_MS`` or longer,
+fetching its rows included (see ``perf.watch_fetches``): its SQL and parameters, its query plan, the view being served and the
+``treatment_app`` frame (view, form, admin or job function) or template
+line that ran it. Entries are kept in a
+bounded in-process ring buffer and written as JSON lines to the
+``treatment_app.slow_queries`` logger, whose rotating file
+(``settings.SLOW_QUERY_LOG``) all processes share. The staff page
+``slow-queries/`` groups them by ``fingerprint``.
+
+Parameters are logged as they are, so the log may hold personal data:
+keep the file as private as the database.
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter, deque
+from hashlib import sha1
+
+import django.template.base
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from . import perf
+
+logger = logging.getLogger('treatment_app.slow_queries')
+
+BUFFER_SIZE = 500
+PARAMS_MAX_LENGTH = 500
+
+buffer = deque(maxlen=BUFFER_SIZE)
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# The instrumentation's own frames are not call sites
+_SKIP_FILES = {os.path.join(_APP_DIR, name) for name in ('slowlog.py', 'perf.py', 'middleware.py', 'routers.py')}
+_SKIP_DIRS = (os.path.join(_APP_DIR, 'backends') + os.sep,)
+_TEMPLATE_BASE = os.path.abspath(django.template.base.__file__)
+
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACE = re.compile(r'\s+')
+
+
+def normalize(sql):
+    """
+    The shape of a statement: literals and the length of ``IN`` lists taken
+    out, so that the same query from the same code groups together.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    return sha1(normalize(sql).encode()).hexdigest()[:12]
+
+
+def call_site():
+    """
+    Where a statement came from: ``path:line function`` of the innermost
+    ``treatment_app`` frame on the stack, or ``template:line`` when a
+    template ran it (lazy querysets are mostly evaluated there). None when
+    neither is on the stack, e.g. in the admin.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.abspath(code.co_filename)
+        if code.co_name == 'render_annotated' and filename == _TEMPLATE_BASE:
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            if origin is not None:
+                return f'{origin.template_name}:{node.token.lineno}'
+        elif (filename.startswith(_APP_DIR + os.sep) and filename not in _SKIP_FILES
+                and not filename.startswith(_SKIP_DIRS)):
+            return f'{os.path.relpath(filename, os.path.dirname(_APP_DIR))}:{frame.f_lineno} {code.co_qualname}'
+        frame = frame.f_back
+    return None
+
+
+def explain(connection, sql, params):
+    """
+    The plan of a SELECT, one line per step; None for other statements.
+    Run on a bare cursor so that it bypasses the execute wrappers.
+    """
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    try:
+        cursor = connection.create_cursor()
+        try:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+        finally:
+            cursor.close()
+    except (DatabaseError, connection.Database.Error) as e:
+        return f'(no plan: {e})'
+
+
+def record(connection, sql, params, elapsed):
+    entry = {
+        'time': timezone.now().isoformat(),
+        'ms': round(elapsed * 1000, 1),
+        'alias': connection.alias,
+        'view': perf.current_view(),
+        'fingerprint': fingerprint(sql),
+        'sql': sql,
+        'params': repr(params)[:PARAMS_MAX_LENGTH],
+        'call_site': call_site(),
+        'plan': explain(connection, sql, params),
+    }
+    buffer.append(entry)
+    logger.info(json.dumps(entry, ensure_ascii=False))
+    return entry
+
+
+class _Statement:
+    """
+    A statement being timed, from ``execute()`` to its last fetch.
+    """
+
+    def __init__(self, connection, sql, params, elapsed):
+        self.connection = connection
+        self.sql = sql
+        self.params = params
+        self.elapsed = elapsed
+
+    def fetched(self, seconds):
+        self.elapsed += seconds
+
+    def finished(self):
+        if self.elapsed * 1000 >= settings.SLOW_QUERY_MS:
+            record(self.connection, self.sql, self.params, self.elapsed)
+
+
+def slow_query_wrapper(execute, sql, params, many, context):
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    if not many:
+        statement = _Statement(context['connection'], sql, params, time.perf_counter() - started)
+        perf.watch_fetches(context['cursor'], slow_query_wrapper, statement.fetched, statement.finished)
+    return result
+
+
+def install(connection):
+    if settings.SLOW_QUERY_MS > 0 and slow_query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(slow_query_wrapper)
+
+
+def recent_entries(limit=BUFFER_SIZE):
+    """
+    The latest entries of all processes from the log file, or of this
+    process from its buffer when there is no log file.
+    """
+    path = settings.SLOW_QUERY_LOG
+    if not path or not os.path.exists(path):
+        return list(buffer)
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in deque(f, maxlen=limit):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
+
+
+def group(entries):
+    """
+    Entries grouped by fingerprint, costliest (total time) first.
+    """
+    groups = {}
+    for entry in entries:
+        item = groups.setdefault(entry['fingerprint'], {
+            'fingerprint': entry['fingerprint'], 'sql': normalize(entry['sql']), 'count': 0,
+            'total_ms': 0.0, 'max_ms': 0.0, 'call_sites': Counter(), 'last': entry,
+        })
+        item['count'] += 1
+        item['total_ms'] += entry['ms']
+        item['max_ms'] = max(item['max_ms'], entry['ms'])
+        item['call_sites'][entry['call_site'] or '-'] += 1
+        if entry['time'] >= item['last']['time']:
+            item['last'] = entry
+    for item in groups.values():
+        item['avg_ms'] = item['total_ms'] / item['count']
+        item['call_sites'] = item['call_sites'].most_common(3)
+    return sorted(groups.values(), key=lambda item: item['total_ms'], reverse=True)
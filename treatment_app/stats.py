@@ -0,0 +1,76 @@
+"""
+Dashboard statistics.
+
+All dashboard counters are computed with one conditional-aggregate query
+per model and cached per user. The cache key embeds the versions of the
+counted models (see ``treatment_app.caching``), so any change to a family,
+child, treatment or therapist profile makes every cached entry stale at once.
+"""
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Family, Child, Treatment, TherapistProfile
+from .access import scope_queryset
+from .caching import cache_version
+
+DASHBOARD_CACHE_TIMEOUT = 300
+DASHBOARD_MODELS = (Family, Child, Treatment, TherapistProfile)
+
+
+def compute_dashboard_counters(user):
+    """
+    Compute the dashboard counters for ``user`` straight from the database.
+    """
+    today = timezone.localdate()
+    month_start = timezone.localtime().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    treatments = scope_queryset(Treatment.objects.all(), user).aggregate(
+        total=Count('pk'),
+        upcoming=Count('pk', filter=Q(
+            status=Treatment.TreatmentStatus.SCHEDULED,
+            scheduled_date__gte=today
+        )),
+    )
+    families = scope_queryset(Family.objects.all(), user).aggregate(
+        total=Count('pk'),
+        new_this_month=Count('pk', filter=Q(created_at__gte=month_start)),
+    )
+    children = scope_queryset(Child.objects.all(), user).aggregate(total=Count('pk'))
+
+    return {
+        'total_treatments': treatments['total'],
+        'upcoming_treatments': treatments['upcoming'],
+        'total_families': families['total'],
+        'new_families_this_month': families['new_this_month'],
+        'total_children': children['total'],
+        'active_children': children['total'],
+    }
+
+
+def dashboard_cache_key(user):
+    """
+    The key includes today's date because "upcoming" and "new this month"
+    move with the calendar even when no data changes.
+    """
+    return f'dashboard-stats:{cache_version(*DASHBOARD_MODELS)}:{user.pk}:{timezone.localdate().isoformat()}'
+
+
+def dashboard_counters(user):
+    """
+    Return the dashboard counters for ``user``, computing them on a cache miss.
+    """
+    key = dashboard_cache_key(user)
+    counters = cache.get(key)
+    if counters is None:
+        counters = compute_dashboard_counters(user)
+        cache.set(key, counters, DASHBOARD_CACHE_TIMEOUT)
+    return counters
+
+
+def warm_dashboard_counters(user):
+    """
+    Recompute and cache the counters of ``user`` ahead of the next visit.
+    """
+    cache.set(dashboard_cache_key(user), compute_dashboard_counters(user), DASHBOARD_CACHE_TIMEOUT)
@@ -0,0 +1,195 @@
+"""
+Content-addressed storage for uploaded files.
+
+``ContentAddressedStorage`` (the default storage, see ``STORAGES``) names
+every file it saves after the SHA-256 of its content:
+``blobs/ab/ab12...ef.pdf``. The same consent form uploaded for many
+families is stored once, a stored file never changes, and a name is a
+strong ETag that browsers may cache for good.
+
+Files are not served from ``MEDIA_URL`` by the web server: ``url()``
+points to the ``media`` view, which checks that the user may see a record
+that references the file (``FILE_FIELDS``) and then sends it, through the
+web server when ``settings.SENDFILE`` is set (see ``downloads``).
+
+Since a file may be shared by several records, deleting a record never
+deletes its file; the ``prune_media`` job removes files no record
+references any more.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import time
+from datetime import timedelta
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db.models import Q
+from django.urls import reverse
+
+from .access import scope_queryset
+from .models import Document, Family
+
+BLOB_DIR = 'blobs'
+# Files younger than this are kept even if unreferenced: the form that
+# uploaded them may not have saved its record yet
+PRUNE_GRACE = timedelta(days=1)
+
+# The file fields of each model, by which the media view finds the records
+# a file belongs to
+FILE_FIELDS = {
+    Family: ('consent_form', 'confidentiality_waiver', 'father_consent_form', 'mother_consent_form'),
+    Document: ('file',),
+}
+
+_BLOB_NAME = re.compile(rf'^{BLOB_DIR}/[0-9a-f]{{2}}/([0-9a-f]{{64}})(\.[a-z0-9]{{1,10}})?$')
+_EXTENSION = re.compile(r'^\.[a-z0-9]{1,10}$')
+
+
+def blob_name(digest, extension=''):
+    """
+    Storage name of the content with SHA-256 ``digest``. The extension of
+    the uploaded file is kept so the content type can be told from the name.
+    """
+    extension = extension.lower()
+    if not _EXTENSION.match(extension):
+        extension = ''
+    return f'{BLOB_DIR}/{digest[:2]}/{digest}{extension}'
+
+
+def digest_of(name):
+    """
+    The SHA-256 in a content-addressed name; None for files stored before
+    (or outside) ``ContentAddressedStorage``.
+    """
+    match = _BLOB_NAME.match(name)
+    return match.group(1) if match else None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names files by their content. Saving content
+    that is already stored only returns the existing name.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # _save picks the name from the content, so there is nothing to avoid
+        return name
+
+    def _save(self, name, content):
+        blob_root = os.path.join(self.location, BLOB_DIR)
+        os.makedirs(blob_root, exist_ok=True)
+        # One pass: hash while writing to a temporary file, then move it
+        # into place (or drop it when the content is already stored)
+        fd, tmp_path = tempfile.mkstemp(dir=blob_root, prefix='.upload-')
+        try:
+            sha = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    sha.update(chunk)
+                    f.write(chunk)
+            name = blob_name(sha.hexdigest(), os.path.splitext(name)[1])
+            path = self.path(name)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+                return name
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            # Two uploads of the same content race harmlessly here
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return name
+
+    def adopt(self, path, digest, extension=''):
+        """
+        Move the local file at ``path``, whose SHA-256 is ``digest``, into
+        the store without copying it. ``path`` must be on the same file
+        system as the store. Returns the file's name.
+        """
+        name = blob_name(digest, extension)
+        target = self.path(name)
+        if os.path.exists(target):
+            os.unlink(path)
+            return name
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+        os.replace(path, target)
+        return name
+
+    def url(self, name):
+        return reverse('treatment_app:media', args=[name])
+
+
+def _references(model, name):
+    query = Q()
+    for field in FILE_FIELDS[model]:
+        query |= Q(**{field: name})
+    return model.objects.filter(query)
+
+
+def find_visible(user, name):
+    """
+    A ``(record, field name)`` referencing the file ``name`` that ``user``
+    may see, or None.
+    """
+    for model, fields in FILE_FIELDS.items():
+        record = scope_queryset(_references(model, name), user).first()
+        if record is not None:
+            return record, next(field for field in fields if getattr(record, field).name == name)
+    return None
+
+
+def download_name(record, field, name):
+    """
+    File name to offer for a download: content-addressed names say nothing
+    about the file.
+    """
+    extension = os.path.splitext(name)[1]
+    if not digest_of(name):
+        return os.path.basename(name)
+    if isinstance(record, Document):
+        return f'{record.name}{extension}'
+    return f'{record._meta.get_field(field).verbose_name} - {record}{extension}'
+
+
+def referenced_names():
+    """
+    Names of all the files records reference.
+    """
+    names = set()
+    for model, fields in FILE_FIELDS.items():
+        for field in fields:
+            names.update(model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                         .values_list(field, flat=True).distinct())
+    return names
+
+
+def prune(storage=None, now=None):
+    """
+    Delete stored files no record references that are older than
+    ``PRUNE_GRACE``, and temporary files left by interrupted uploads.
+    Returns the number deleted.
+    """
+    storage = storage or default_storage
+    blob_root = os.path.join(storage.location, BLOB_DIR)
+    if not os.path.isdir(blob_root):
+        return 0
+    cutoff = (now or time.time()) - PRUNE_GRACE.total_seconds()
+    referenced = referenced_names()
+    deleted = 0
+    for directory, _, files in os.walk(blob_root):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+            if name in referenced or os.path.getmtime(path) > cutoff:
+                continue
+            if digest_of(name) or filename.startswith('.upload-'):
+                os.unlink(path)
+                deleted += 1
+    return deleted
@@ -0,0 +1,124 @@
+"""
+Test helpers.
+
+``QueryBudgetMixin`` lets view tests pin down how many queries a page may
+run, and check that the number does not grow with the amount of data, which
+is how N+1 patterns in templates show up.
+
+``TherapistMixin`` and the ``create_*`` functions build the therapist,
+family and child most tests start from.
+"""
+
+import tempfile
+from contextlib import contextmanager
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .models import Family, Child
+
+PASSWORD = 'secret'
+
+
+def create_user(username, **fields):
+    return User.objects.create_user(username, password=PASSWORD, **fields)
+
+
+def create_family(therapist=None, name='כהן', **fields):
+    fields = {'address': 'רחוב', 'phone': '050', **fields}
+    return Family.objects.create(name=name, therapist=therapist, **fields)
+
+
+def create_child(family, name='דני', **fields):
+    fields = {'birth_date': date(2015, 1, 1), 'gender': 'male', **fields}
+    return Child.objects.create(family=family, name=name, **fields)
+
+
+class TherapistMixin:
+    """
+    TestCase mixin that creates ``self.therapist`` with one family,
+    ``self.family``, and logs the therapist in to the test client.
+
+    ``therapist_fields`` are passed on to ``create_user``; set ``log_in`` to
+    False for tests that do not go through views.
+    """
+
+    therapist_fields = {}
+    log_in = True
+
+    def setUp(self):
+        super().setUp()
+        self.therapist = create_user('therapist', **self.therapist_fields)
+        self.family = create_family(self.therapist)
+        if self.log_in:
+            self.client.force_login(self.therapist)
+
+    def use_temporary_directory(self, setting):
+        """
+        Point ``setting`` at a directory removed after the test and return its path.
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(**{setting: directory.name})
+        override.enable()
+        self.addCleanup(override.disable)
+        return directory.name
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin with query-budget assertions for views.
+
+    The cache is cleared before every measured request so the budget covers
+    the uncached cost of the page.
+    """
+
+    @contextmanager
+    def assertMaxQueries(self, budget, using='default'):
+        """
+        Fail if the block runs more than ``budget`` queries.
+        """
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(
+                f'{i}. {query["sql"]}' for i, query in enumerate(context.captured_queries, start=1)
+            )
+            self.fail(f'{executed} queries executed, budget is {budget}:\n{queries}')
+
+    def count_page_queries(self, url, **extra):
+        """
+        Request ``url`` with an empty cache and return the number of queries run.
+        """
+        cache.clear()
+        with CaptureQueriesContext(connections['default']) as context:
+            response = self.client.get(url, secure=True, **extra)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def assertPageQueryBudget(self, url, budget, **extra):
+        """
+        Fail if rendering ``url`` runs more than ``budget`` queries.
+        """
+        cache.clear()
+        with self.assertMaxQueries(budget):
+            response = self.client.get(url, secure=True, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assertConstantQueries(self, url, add_rows, **extra):
+        """
+        Fail if the query count of ``url`` changes after ``add_rows()`` adds data.
+        """
+        before = self.count_page_queries(url, **extra)
+        add_rows()
+        after = self.count_page_queries(url, **extra)
+        self.assertEqual(
+            before, after,
+            f'{url} ran {before} queries before and {after} after adding rows'
+        )
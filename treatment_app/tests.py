@@ -1,3 +1,1456 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import runpy
+import shutil
+import sqlite3
+import tempfile
+import time
+import zipfile
+from collections import defaultdict
+from contextlib import ExitStack
+from datetime import date, timedelta, time as datetime_time
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.db import connection, connections
+from django.db.models import Func
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Family, Child, Document, Treatment, TreatmentSeries, ScheduledJob, JobRun, Report, TherapistAccess, TherapistProfile, Upload, ViewTiming
+from .testing import QueryBudgetMixin, TherapistMixin, create_child, create_family, create_user
+from .access import check_access_index, scope_queryset
+from .caching import bump_cache_version
+from .stats import dashboard_counters
+from . import health, importing, jobs, log, metrics, perf, reports, routers, scheduling, search, series, slowlog, storage, uploads, worklist
+from .middleware import REPLICA_PIN_COOKIE, ReplicaPinningMiddleware
+
+
+class AccessIndexTests(TestCase):
+    """
+    Who sees which family, child and treatment, and the signals keeping it current.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='secret')
+        self.child_therapist = User.objects.create_user('child_therapist', password='secret')
+        self.other = User.objects.create_user('other', password='secret')
+        self.family = Family.objects.create(name='כהן', address='רחוב', phone='050', therapist=self.owner)
+        self.child = Child.objects.create(
+            family=self.family, name='דני', birth_date=date(2015, 1, 1), gender='male',
+            therapist=self.child_therapist.therapistprofile,
+        )
+        self.treatment = Treatment.objects.create(
+            family=self.family, child=self.child, therapist=self.other, scheduled_date=date.today()
+        )
+
+    def visible(self, user):
+        return {
+            model.__name__: set(scope_queryset(model.objects.all(), user).values_list('pk', flat=True))
+            for model in (Family, Child, Treatment)
+        }
+
+    def test_each_user_sees_only_what_the_rules_grant(self):
+        everything = {'Family': {self.family.pk}, 'Child': {self.child.pk}, 'Treatment': {self.treatment.pk}}
+        self.assertEqual(self.visible(self.owner), everything)
+        # A child's therapist also sees the family
+        self.assertEqual(self.visible(self.child_therapist), everything)
+        # The treating therapist sees only the treatment
+        self.assertEqual(self.visible(self.other), {'Family': set(), 'Child': set(), 'Treatment': {self.treatment.pk}})
+        stranger = User.objects.create_user('stranger', password='secret')
+        self.assertEqual(self.visible(stranger), {'Family': set(), 'Child': set(), 'Treatment': set()})
+        superuser = User.objects.create_superuser('admin', password='secret')
+        self.assertEqual(self.visible(superuser), everything)
+
+    def test_signals_follow_reassignment_and_deletes(self):
+        self.family.therapist = self.other
+        self.family.save()
+        self.assertEqual(self.visible(self.owner)['Family'], set())
+        self.assertEqual(self.visible(self.other)['Family'], {self.family.pk})
+
+        self.treatment.therapist = self.owner
+        self.treatment.save()
+        self.assertEqual(self.visible(self.owner)['Treatment'], {self.treatment.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.child.delete()
+        self.assertEqual(self.visible(self.child_therapist), {'Family': set(), 'Child': set(), 'Treatment': set()})
+        self.assertEqual(check_access_index(), (set(), set()))
+
+    def test_drift_is_detected_and_fixed(self):
+        # update() sends no signals
+        Family.objects.filter(pk=self.family.pk).update(therapist=self.other)
+        missing, stale = check_access_index()
+        self.assertIn((self.other.pk, self.family.pk, None, None), missing)
+        self.assertIn((self.owner.pk, self.family.pk, None, None), stale)
+        with self.assertRaises(CommandError):
+            call_command('check_access_index', stdout=io.StringIO())
+
+        call_command('check_access_index', '--fix', stdout=io.StringIO())
+        self.assertEqual(check_access_index(), (set(), set()))
+        self.assertEqual(self.visible(self.owner)['Family'], set())
+
+
+class DashboardCounterTests(TherapistMixin, TestCase):
+    """
+    Dashboard counters come from the cache until a counted model changes.
+    """
+
+    log_in = False
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_counters_are_cached_until_a_counted_model_changes(self):
+        self.assertEqual(dashboard_counters(self.therapist)['total_families'], 1)
+        with self.assertNumQueries(0):
+            dashboard_counters(self.therapist)
+
+        Family.objects.create(name='לוי', address='רחוב', phone='050', therapist=self.therapist)
+        self.assertEqual(dashboard_counters(self.therapist)['total_families'], 2)
+        child = Child.objects.create(family=self.family, name='דני', birth_date=date(2015, 1, 1), gender='male')
+        self.assertEqual(dashboard_counters(self.therapist)['total_children'], 1)
+        treatment = Treatment.objects.create(
+            family=self.family, therapist=self.therapist, scheduled_date=date.today() + timedelta(days=1)
+        )
+        self.assertEqual(dashboard_counters(self.therapist)['upcoming_treatments'], 1)
+        treatment.delete()
+        child.delete()
+        counters = dashboard_counters(self.therapist)
+        self.assertEqual((counters['upcoming_treatments'], counters['total_children']), (0, 0))
+
+
+class FragmentCacheTests(TherapistMixin, TestCase):
+    """
+    Cached list rows are kept per user and dropped by a version bump.
+    """
+
+    log_in = False
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.other = create_user('other')
+        create_family(self.other, name='לוי')
+        self.url = reverse('treatment_app:family-list')
+
+    def page(self, user):
+        self.client.force_login(user)
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_rows_are_cached_per_user_and_busted_by_a_version_bump(self):
+        self.assertIn('כהן', self.page(self.therapist))
+        other_page = self.page(self.other)
+        self.assertIn('לוי', other_page)
+        self.assertNotIn('כהן', other_page)
+
+        # update() sends no signal, so the cached rows still show the old name
+        Family.objects.filter(pk=self.family.pk).update(name='כהנא')
+        self.assertNotIn('כהנא', self.page(self.therapist))
+        bump_cache_version(Family)
+        self.assertIn('כהנא', self.page(self.therapist))
+
+    def test_an_evicted_version_does_not_revive_old_entries(self):
+        key = f'cache-version:{Family._meta.label_lower}'
+        cache.delete(key)
+        self.assertIn('כהן', self.page(self.therapist))
+        Family.objects.filter(pk=self.family.pk).update(name='כהנא')
+        # The version key is culled while the fragments cached under it are not
+        cache.delete(key)
+        self.assertIn('כהנא', self.page(self.therapist))
+
+    def test_gunicorn_shares_the_cache_between_workers(self):
+        config = os.path.join(settings.BASE_DIR, 'gunicorn_config.py')
+        with mock.patch.dict(os.environ, {'GUNICORN_WORKERS': '3'}):
+            os.environ.pop('TREATMENT_CACHE_BACKEND', None)
+            runpy.run_path(config)
+            self.assertEqual(os.environ['TREATMENT_CACHE_BACKEND'], 'file')
+            os.environ['TREATMENT_CACHE_BACKEND'] = 'locmem'
+            with self.assertRaises(RuntimeError):
+                runpy.run_path(config)
+            os.environ['GUNICORN_WORKERS'] = '1'
+            runpy.run_path(config)
+
+
+class CalendarFeedTests(TherapistMixin, TestCase):
+    """
+    The calendar feed's ETag, since cursor and window headers.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.treatments = [self.add(days) for days in (1, 2, 3)]
+        self.url = reverse('treatment_app:treatment_calendar_data')
+        self.window = {
+            'start': date.today().isoformat(), 'end': (date.today() + timedelta(days=7)).isoformat(),
+        }
+
+    def add(self, days):
+        return Treatment.objects.create(
+            family=self.family, therapist=self.therapist, scheduled_date=date.today() + timedelta(days=days)
+        )
+
+    def get(self, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(self.url, {**self.window, **params}, secure=True, **headers)
+
+    def test_unchanged_window_is_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+        self.assertEqual(response['X-Calendar-Total'], '3')
+        etag = response['ETag']
+        with self.assertNumQueries(3):  # session, user and the window summary
+            response = self.get(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_deletes_and_re_adds_change_the_etag(self):
+        first = self.get()['ETag']
+        # Deleting the most recently updated row lowers the count...
+        self.treatments.pop().delete()
+        response = self.get(first)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Calendar-Total'], '2')
+        # ...and a row added in its place moves the latest updated_at
+        self.add(3)
+        response = self.get(response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first)
+        self.assertEqual(response['X-Calendar-Total'], '3')
+
+    def test_since_returns_only_later_updates(self):
+        cursor = self.get()['X-Calendar-Cursor']
+        changed = self.treatments[0]
+        changed.summary = 'עודכן'
+        changed.save()
+        response = self.get(since=cursor)
+        self.assertEqual([event['id'] for event in response.json()], [changed.pk])
+        self.assertEqual(response['X-Calendar-Total'], '3')
+        self.assertGreater(response['X-Calendar-Cursor'], cursor)
+        self.assertEqual(self.get(since='yesterday').status_code, 400)
+
+    def test_renaming_the_family_changes_the_titles(self):
+        response = self.get()
+        etag, cursor = response['ETag'], response['X-Calendar-Cursor']
+        self.family.name = 'כהנא'
+        self.family.save()
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all(event['title'].startswith('כהנא') for event in response.json()))
+        # The renamed events are sent again to clients keeping a cursor
+        events = self.get(since=cursor).json()
+        self.assertEqual(sorted(event['id'] for event in events), sorted(t.pk for t in self.treatments))
+
+
+class ApiTests(QueryBudgetMixin, TestCase):
+    """
+    The read-only API: scoping, cursor pages, sparse fieldsets and query counts.
+    """
+
+    def setUp(self):
+        self.therapist = User.objects.create_user('therapist', password='secret')
+        self.other = User.objects.create_user('other', password='secret')
+        self.client.force_login(self.therapist)
+        self.own = self.add(self.therapist)
+        self.foreign = self.add(self.other)
+
+    def add(self, therapist):
+        family = Family.objects.create(name='כהן', address='רחוב', phone='050', therapist=therapist)
+        child = Child.objects.create(
+            family=family, name='דני', birth_date=date(2015, 1, 1), gender='male',
+            therapist=therapist.therapistprofile,
+        )
+        treatment = Treatment.objects.create(
+            family=family, child=child, therapist=therapist, scheduled_date=date.today()
+        )
+        document = Document.objects.create(
+            family=family, name='אבחון', document_type='medical', file='documents/a.pdf'
+        )
+        return {'families': family, 'children': child, 'treatments': treatment, 'documents': document}
+
+    def url(self, name):
+        return f'/api/v1/{name}/'
+
+    def get(self, url, **params):
+        response = self.client.get(url, params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_every_list_is_scoped_to_the_user(self):
+        for name, record in self.own.items():
+            with self.subTest(name):
+                ids = [row['id'] for row in self.get(self.url(name))['results']]
+                self.assertEqual(ids, [record.pk])
+                response = self.client.get(f'{self.url(name)}{self.foreign[name].pk}/', secure=True)
+                self.assertEqual(response.status_code, 404)
+
+    def test_cursor_pages_do_not_skip_or_repeat_rows_across_inserts(self):
+        for _ in range(4):
+            self.add(self.therapist)
+        first = self.get(self.url('treatments'), page_size=2)
+        # Newer rows land before the cursor, so the next page is unaffected
+        self.add(self.therapist)
+        second = self.get(first['next'])
+        seen = [row['id'] for row in first['results'] + second['results']]
+        expected = list(
+            Treatment.objects.filter(therapist=self.therapist).order_by('-id').values_list('pk', flat=True)
+        )
+        self.assertEqual(seen, expected[1:5])
+
+    def test_fields_trims_the_output(self):
+        row, = self.get(self.url('treatments'), fields='id,child_name')['results']
+        self.assertEqual(row, {'id': self.own['treatments'].pk, 'child_name': 'דני'})
+
+    def test_queries_do_not_grow_with_rows(self):
+        for name in self.own:
+            with self.subTest(name):
+                self.assertConstantQueries(self.url(name), lambda: [self.add(self.therapist) for _ in range(3)])
+
+
+class ListViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    List pages must run a fixed number of queries, whatever the page holds.
+    """
+
+    def setUp(self):
+        self.therapist = User.objects.create_user('therapist', password='secret')
+        self.client.force_login(self.therapist)
+        self.add_families(3)
+
+    def add_families(self, count):
+        for i in range(count):
+            family = Family.objects.create(
+                name=f'משפחה {Family.objects.count()}',
+                address='רחוב הרצל 1',
+                phone='050-0000000',
+                therapist=self.therapist
+            )
+            child = Child.objects.create(family=family, name='ילד', birth_date=date(2015, 1, 1), gender='male')
+            Treatment.objects.create(
+                family=family,
+                child=child,
+                therapist=self.therapist,
+                scheduled_date=date.today() + timedelta(days=i + 1)
+            )
+
+    def test_family_list_within_budget(self):
+        self.assertPageQueryBudget(reverse('treatment_app:family-list'), 5)
+
+    def test_family_list_queries_do_not_grow_with_rows(self):
+        self.assertConstantQueries(reverse('treatment_app:family-list'), lambda: self.add_families(6))
+
+    def test_family_list_search_within_budget(self):
+        self.assertPageQueryBudget(reverse('treatment_app:family-list'), 5, data={'q': 'ילד'})
+
+    def test_family_list_counts_children(self):
+        response = self.assertPageQueryBudget(reverse('treatment_app:family-list'), 5)
+        self.assertEqual([family.child_count for family in response.context['families']], [1, 1, 1])
+
+    def test_treatment_list_queries_do_not_grow_with_rows(self):
+        self.assertConstantQueries(reverse('treatment_app:treatment-list'), lambda: self.add_families(6))
+
+
+class ExplainQueriesTests(TestCase):
+    """
+    ``explain_queries`` runs every view and reports scans it cannot excuse.
+    """
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', password='secret')
+        self.therapist = User.objects.create_user('therapist', password='secret')
+        family = Family.objects.create(name='משפחה', address='רחוב הרצל 1', phone='050-0000000', therapist=self.therapist)
+        child = Child.objects.create(family=family, name='ילד', birth_date=date(2015, 1, 1), gender='male')
+        Treatment.objects.create(family=family, child=child, therapist=self.therapist, scheduled_date=date.today())
+
+    def explain(self, *args):
+        out = io.StringIO()
+        call_command('explain_queries', '--analyze', *args, stdout=out)
+        return out.getvalue()
+
+    def test_runs_every_view(self):
+        output = self.explain()
+        for name in ['treatment_app:family-list', 'treatment_app:therapist-list', 'api:document-list']:
+            self.assertIn(f'{name} (', output)
+        # With a row per table the planner is free to scan them, so only the
+        # report is checked here, not the plans
+        self.assertRegex(output, r'\n\d+ queries with full table scans\n$')
+
+    def test_skips_views_the_user_may_not_open(self):
+        output = self.explain('--user', 'therapist')
+        self.assertIn('treatment_app:therapist-list: not allowed for therapist, skipped', output)
+        self.assertIn('queries with full table scans', output)
+
+    def test_classify_scans(self):
+        from .management.commands.explain_queries import classify_scans
+
+        # An ordered scan stops at the page's LIMIT
+        sql = 'SELECT * FROM "treatment_app_treatment" ORDER BY "id" DESC LIMIT 51'
+        self.assertEqual(classify_scans(sql, ['treatment_app_treatment'], False)[0], [])
+        # ...but not when the rows are sorted first, which reads them all
+        self.assertEqual(classify_scans(sql, ['treatment_app_treatment'], True)[0], ['treatment_app_treatment'])
+        # A page listing every row reads the whole table
+        sql = 'SELECT * FROM "treatment_app_therapistprofile"'
+        self.assertEqual(classify_scans(sql, ['treatment_app_therapistprofile'], False)[0], [])
+        # A filter that no index serves is a full scan
+        sql = 'SELECT * FROM "treatment_app_family" WHERE "notes" LIKE \'%x%\''
+        self.assertEqual(classify_scans(sql, ['treatment_app_family'], False)[0], ['treatment_app_family'])
+        # ...and so is a selective filter on the scanned table, even under a LIMIT
+        sql = ('SELECT * FROM "treatment_app_treatment" WHERE "treatment_app_treatment"."status" = \'missed\' '
+               'ORDER BY "treatment_app_treatment"."id" DESC LIMIT 51')
+        self.assertEqual(classify_scans(sql, ['treatment_app_treatment'], False)[0], ['treatment_app_treatment'])
+        sql = 'SELECT * FROM "treatment_app_family" WHERE "name" = \'x\' ORDER BY "id" LIMIT 51'
+        self.assertEqual(classify_scans(sql, ['treatment_app_family'], False)[0], ['treatment_app_family'])
+        # A LIMIT in a subquery does not stop the outer scan
+        sql = ('SELECT * FROM "treatment_app_family" INNER JOIN "treatment_app_child" '
+               'ON ("treatment_app_family"."id" = "treatment_app_child"."family_id") '
+               'WHERE "treatment_app_child"."id" IN (SELECT U0."id" FROM "treatment_app_child" U0 LIMIT 5) '
+               'ORDER BY "treatment_app_family"."id"')
+        self.assertEqual(classify_scans(sql, ['treatment_app_family'], False)[0], ['treatment_app_family'])
+        # Sorting by another key reads every row before the LIMIT applies
+        sql = 'SELECT * FROM "treatment_app_family" ORDER BY "treatment_app_family"."email" LIMIT 51'
+        self.assertEqual(classify_scans(sql, ['treatment_app_family'], False)[0], ['treatment_app_family'])
+
+
+class SearchTests(QueryBudgetMixin, TestCase):
+    """
+    Full-text search: normalization, ranking and scoping.
+    """
+
+    def setUp(self):
+        self.therapist = User.objects.create_user('therapist', password='secret')
+        self.other = User.objects.create_user('other', password='secret')
+        self.family = Family.objects.create(
+            name='משפחת לֵוִי', address='רחוב הרצל 12', phone='+972-50-765-4321', therapist=self.therapist
+        )
+        self.child = Child.objects.create(family=self.family, name='יוסי', birth_date=date(2015, 1, 1), gender='male')
+        self.treatment = Treatment.objects.create(
+            child=self.child, therapist=self.therapist, scheduled_date=date.today(),
+            summary='הילד דיבר על החברים בכיתה'
+        )
+
+    def kinds(self, user, query):
+        return [(result['kind'], result['id']) for result in search.search(user, query)]
+
+    def test_phone_matches_in_any_format(self):
+        for query in ('0507654321', '050-765-4321', '050 765 4321', '+972 50 765 4321', '050765'):
+            self.assertEqual(self.kinds(self.therapist, query), [('family', self.family.pk)], query)
+
+    def test_niqqud_and_hebrew_prefixes_are_ignored(self):
+        self.assertEqual(self.kinds(self.therapist, 'לוי'), [('family', self.family.pk)])
+        self.assertEqual(self.kinds(self.therapist, 'ילד'), [('treatment', self.treatment.pk)])
+
+    def test_results_are_scoped_and_follow_changes(self):
+        self.assertEqual(self.kinds(self.other, 'יוסי'), [])
+        self.child.name = 'דני'
+        self.child.save()
+        self.assertEqual(self.kinds(self.therapist, 'יוסי'), [])
+        self.child.delete()
+        self.assertEqual(self.kinds(self.therapist, 'דני'), [])
+
+    def test_operators_are_searched_as_text(self):
+        self.assertEqual(self.kinds(self.therapist, '"לוי" OR NEAR('), [])
+
+    def test_endpoint_queries_do_not_grow_with_results(self):
+        self.client.force_login(self.therapist)
+
+        def add_families():
+            for i in range(5):
+                Family.objects.create(name=f'לוי {i}', address='רחוב', phone='050', therapist=self.therapist)
+
+        self.assertConstantQueries(reverse('treatment_app:search'), add_families, data={'q': 'לוי'})
+
+
+class WorklistTests(TherapistMixin, TestCase):
+    """
+    Bulk status sweep and the stored needs-summary flag.
+    """
+
+    log_in = False
+
+    def setUp(self):
+        super().setUp()
+        self.other = create_user('other')
+
+    def add(self, days, **fields):
+        # bulk_create skips save(), like rows whose date passed since they were saved
+        fields.setdefault('therapist', self.therapist)
+        return Treatment.objects.bulk_create([
+            Treatment(family=self.family, scheduled_date=date.today() + timedelta(days=days), **fields)
+        ])[0]
+
+    def test_save_sets_flag(self):
+        treatment = Treatment.objects.create(family=self.family, scheduled_date=date.today() - timedelta(days=2))
+        self.assertTrue(treatment.needs_summary)
+        treatment.summary = 'סוכם'
+        treatment.save(update_fields=['summary'])
+        treatment.refresh_from_db()
+        self.assertFalse(treatment.needs_summary)
+
+    def test_sweep_updates_statuses_and_flags_in_bulk(self):
+        past, future = self.add(-3), self.add(3)
+        summarized = self.add(-3, summary='סוכם', needs_summary=True)
+        with self.assertNumQueries(3):
+            self.assertEqual(worklist.sweep(), (2, 2))
+
+        for treatment in (past, future, summarized):
+            treatment.refresh_from_db()
+        self.assertEqual((past.status, past.needs_summary), (Treatment.TreatmentStatus.MISSED, True))
+        self.assertEqual((future.status, future.needs_summary), (Treatment.TreatmentStatus.SCHEDULED, False))
+        self.assertEqual((summarized.status, summarized.needs_summary), (Treatment.TreatmentStatus.MISSED, False))
+
+    def test_endpoint_lists_own_treatments_oldest_first(self):
+        older, newer = self.add(-5), self.add(-1)
+        self.add(-2, therapist=self.other)
+        worklist.sweep()
+
+        self.client.force_login(self.therapist)
+        data = self.client.get(reverse('treatment_app:treatment_worklist'), secure=True).json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([entry['id'] for entry in data['results']], [older.pk, newer.pk])
+        self.assertEqual(data['results'][0]['days_overdue'], 5)
+
+
+class TreatmentSeriesTests(TestCase):
+    """
+    Recurring series: generation, validation and series-wide changes.
+    """
+
+    def setUp(self):
+        self.therapist = User.objects.create_user('therapist', password='secret')
+        self.other = User.objects.create_user('other', password='secret')
+        self.family = Family.objects.create(name='כהן', address='רחוב', phone='050', therapist=self.other)
+        # Next Sunday
+        self.sunday = date.today() + timedelta(days=(6 - date.today().weekday()) % 7 or 7)
+
+    def make(self, **fields):
+        values = {
+            'family': self.family, 'therapist': self.therapist, 'start_date': self.sunday,
+            'end_date': self.sunday + timedelta(weeks=52), 'start_time': datetime_time(10), 'end_time': datetime_time(11),
+        }
+        values.update(fields)
+        return TreatmentSeries(**values)
+
+    def test_sessions_are_created_in_bulk(self):
+        # Same number of queries for a short series and a year of weekly sessions
+        with CaptureQueriesContext(connection) as short:
+            series.create_series(self.make(end_date=self.sunday, start_time=datetime_time(8), end_time=datetime_time(9)))
+        with self.assertNumQueries(len(short)):
+            treatments = series.create_series(self.make(frequency=TreatmentSeries.Frequency.BIWEEKLY))
+        self.assertEqual(len(treatments), 27)
+        self.assertEqual({t.scheduled_date.weekday() for t in treatments}, {6})
+        # The therapist can see the generated sessions
+        self.assertEqual(TherapistAccess.objects.filter(user=self.therapist, treatment__isnull=False).count(), 28)
+        # A series may not double-book its therapist
+        with self.assertRaises(ValidationError):
+            series.create_series(self.make(start_time=datetime_time(10, 30), end_time=datetime_time(11, 30)))
+
+    def test_invalid_series_is_rejected(self):
+        cases = {
+            'start_date': {'start_date': self.sunday + timedelta(days=5)},  # Friday
+            'end_time': {'end_time': datetime_time(20, 30)},
+            'end_date': {'end_date': self.sunday + timedelta(days=400)},
+            'child': {'child': Child.objects.create(
+                family=Family.objects.create(name='לוי', address='רחוב', phone='050', therapist=self.other),
+                name='דני', birth_date=date(2015, 1, 1), gender='male',
+            )},
+        }
+        for field, values in cases.items():
+            with self.assertRaises(ValidationError) as raised:
+                series.create_series(self.make(**values))
+            self.assertIn(field, raised.exception.message_dict)
+        self.assertFalse(Treatment.objects.exists())
+
+    def test_remaining_sessions_are_changed_and_cancelled_together(self):
+        created = self.make(end_date=self.sunday + timedelta(weeks=3))
+        first = series.create_series(created)[0]
+        Treatment.objects.filter(pk=first.pk).update(status=Treatment.TreatmentStatus.COMPLETED)
+
+        created.start_time, created.end_time = datetime_time(14), datetime_time(15)
+        # Savepoint, the series row, one UPDATE for all sessions, release
+        with self.assertNumQueries(4):
+            self.assertEqual(series.update_series(created, ['start_time', 'end_time']), 3)
+        self.assertEqual(series.cancel_series(created), 3)
+        self.assertEqual(
+            list(created.treatments.order_by('scheduled_date').values_list('status', 'start_time')),
+            [(Treatment.TreatmentStatus.COMPLETED, datetime_time(10))] +
+            [(Treatment.TreatmentStatus.CANCELLED, datetime_time(14))] * 3
+        )
+
+
+class SchedulingTests(TherapistMixin, TestCase):
+    """
+    Double-booking checks and the free-slot search.
+    """
+
+    log_in = False
+
+    def setUp(self):
+        super().setUp()
+        self.other = create_user('other')
+        self.sunday = date.today() + timedelta(days=(6 - date.today().weekday()) % 7 or 7)
+        self.booked = Treatment.objects.create(
+            family=self.family, therapist=self.therapist, scheduled_date=self.sunday,
+            start_time=datetime_time(10), end_time=datetime_time(11)
+        )
+
+    def test_overlapping_sessions_conflict(self):
+        def conflicts(start, end, therapist=None):
+            return list(scheduling.find_conflicts(therapist or self.therapist, self.sunday, start, end))
+
+        self.assertEqual(conflicts(datetime_time(10, 30), datetime_time(11, 30)), [self.booked])
+        self.assertEqual(conflicts(datetime_time(11), datetime_time(12)), [])
+        self.assertEqual(conflicts(datetime_time(10), datetime_time(11), self.other), [])
+        Treatment.objects.filter(pk=self.booked.pk).update(status=Treatment.TreatmentStatus.CANCELLED)
+        self.assertEqual(conflicts(datetime_time(10), datetime_time(11)), [])
+
+    def test_batch_checks_existing_sessions_and_the_batch_itself(self):
+        slots = [
+            (self.therapist.pk, self.sunday, datetime_time(9), datetime_time(10)),
+            (self.therapist.pk, self.sunday, datetime_time(10, 45), datetime_time(12)),
+            (self.therapist.pk, self.sunday, datetime_time(11, 30), datetime_time(12, 30)),
+            (self.therapist.pk, self.sunday, datetime_time(12), datetime_time(13)),
+        ]
+        with self.assertNumQueries(1):
+            conflicts = scheduling.batch_conflicts(slots)
+        # The second slot is rejected, so the third one is free
+        self.assertEqual(conflicts, {1: [self.booked.pk], 3: [('batch', 2)]})
+
+    def test_free_slots_for_all_therapists_in_one_query(self):
+        TherapistProfile.objects.filter(user__in=[self.therapist, self.other]).update(is_active=True)
+        therapists = scheduling.active_therapists().order_by('username')
+        with self.assertNumQueries(2):
+            week = scheduling.free_slots(self.sunday, therapists, min_minutes=60)
+        other, therapist = week
+        self.assertEqual(len(therapist['days']), 5)
+        self.assertEqual(therapist['days'][0], (self.sunday, [
+            (datetime_time(8), datetime_time(10)), (datetime_time(11), datetime_time(20)),
+        ]))
+        self.assertEqual(other['days'][0][1], [(datetime_time(8), datetime_time(20))])
+
+
+class ExportTests(TherapistMixin, TestCase):
+    """
+    Streaming CSV/XLSX exports.
+    """
+
+    def setUp(self):
+        super().setUp()
+        other = create_user('other')
+        hidden = create_family(other, name='לוי')
+        day = date(2024, 1, 7)
+        Treatment.objects.create(
+            family=self.family, therapist=self.therapist, scheduled_date=day, actual_date=day,
+            start_time=datetime_time(10), end_time=datetime_time(11), summary='סיכום, עם פסיק'
+        )
+        Treatment.objects.create(
+            family=self.family, therapist=self.therapist, scheduled_date=day + timedelta(days=1),
+            start_time=datetime_time(12), end_time=datetime_time(13)
+        )
+        Treatment.objects.create(family=hidden, therapist=other, scheduled_date=day)
+
+    def export(self, kind, fmt, **params):
+        response = self.client.get(reverse('treatment_app:export', args=[kind, fmt]), params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_is_scoped_and_filtered(self):
+        rows = list(csv.reader(io.StringIO(self.export('treatments', 'csv').decode('utf-8-sig'))))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][1:4], ['2024-01-08', '', '12:00'])
+        self.assertEqual(rows[2][7], 'כהן')
+        self.assertEqual(rows[2][10], 'סיכום, עם פסיק')
+
+        rows = list(csv.reader(io.StringIO(self.export('families', 'csv', q='לוי').decode('utf-8-sig'))))
+        self.assertEqual(len(rows), 1)
+        response = self.client.get(reverse('treatment_app:export', args=['treatments', 'csv']), {'status': 'X'}, secure=True)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('treatment_app:export', args=['treatments', 'pdf']), secure=True)
+        self.assertEqual(response.status_code, 404)
+
+    def test_xlsx_is_a_valid_workbook(self):
+        workbook = zipfile.ZipFile(io.BytesIO(self.export('treatments', 'xlsx')))
+        self.assertIsNone(workbook.testzip())
+        sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row '), 3)
+        # 2024-01-08 as an Excel date serial
+        self.assertIn('<c r="B2" s="1"><v>45299</v></c>', sheet)
+        self.assertIn('סיכום, עם פסיק', sheet)
+
+    def test_queries_do_not_grow_with_rows(self):
+        def queries():
+            with CaptureQueriesContext(connection) as captured:
+                self.export('treatments', 'xlsx')
+            return len(captured)
+
+        before = queries()
+        Treatment.objects.bulk_create(
+            Treatment(family=self.family, therapist=self.therapist, scheduled_date=date(2024, 2, 1))
+            for _ in range(50)
+        )
+        self.assertEqual(queries(), before)
+
+
+class ReportTests(TherapistMixin, TestCase):
+    """
+    PDF reports: content keys, background rendering and range requests.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_directory('REPORTS_ROOT')
+        self.child = create_child(self.family)
+        self.treatment = Treatment.objects.create(
+            child=self.child, therapist=self.therapist, scheduled_date=date(2024, 1, 7), actual_date=date(2024, 1, 7),
+            summary='שיחה על בית הספר (כיתה ג) בשעה 10:30',
+        )
+        self.url = reverse('treatment_app:report', args=['child_history', self.child.pk])
+
+    def test_report_is_rendered_in_the_background_and_reused(self):
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(self.url, secure=True).status_code, 202)
+        self.assertEqual(Report.objects.count(), 1)
+        family_url = reverse('treatment_app:report', args=['family_summary', self.family.pk])
+        self.assertEqual(self.client.get(family_url, secure=True).status_code, 202)
+
+        self.assertEqual(reports.render_pending(), {'rendered': 2, 'failed': 0})
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(reports.render_pending(), {'rendered': 0, 'failed': 0})
+
+        # A change to a row in the report makes a new one
+        self.treatment.summary = 'סיכום חדש'
+        self.treatment.save()
+        self.assertEqual(self.client.get(self.url, secure=True).status_code, 202)
+        self.assertEqual(Report.objects.count(), 3)
+
+    def test_range_requests_and_access(self):
+        self.client.get(self.url, secure=True)
+        reports.render_pending()
+        size = Report.objects.get().size
+        content = b''.join(self.client.get(self.url, secure=True).streaming_content)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199', secure=True)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{size}')
+        self.assertEqual(b''.join(response.streaming_content), content[100:200])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10', secure=True)
+        self.assertEqual(b''.join(response.streaming_content), content[-10:])
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={size}-', secure=True)
+        self.assertEqual(response.status_code, 416)
+        etag = self.client.get(self.url, secure=True)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag, secure=True).status_code, 304)
+
+        self.client.force_login(create_user('other'))
+        self.assertEqual(self.client.get(self.url, secure=True).status_code, 404)
+        url = reverse('treatment_app:report', args=['therapist_month', self.therapist.pk])
+        self.assertEqual(self.client.get(url, secure=True).status_code, 404)
+
+    def test_failed_report_is_retried_after_a_backoff(self):
+        report = reports.request_report(Report.Kind.CHILD_HISTORY, self.child.pk)
+        with mock.patch.dict(reports.BUILDERS, {Report.Kind.CHILD_HISTORY: mock.Mock(side_effect=OSError('disk full'))}):
+            self.assertEqual(reports.render_pending(), {'rendered': 0, 'failed': 1})
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(reports.request_report(Report.Kind.CHILD_HISTORY, self.child.pk).status, Report.Status.FAILED)
+
+        Report.objects.filter(pk=report.pk).update(finished_at=timezone.now() - reports.FAILED_RETRY)
+        self.assertEqual(self.client.get(self.url, secure=True).status_code, 202)
+        self.assertEqual(reports.render_pending(), {'rendered': 1, 'failed': 0})
+        self.assertEqual(self.client.get(self.url, secure=True).status_code, 200)
+
+    def test_hebrew_lines_are_reordered_for_drawing(self):
+        self.assertEqual(reports.visual('טיפול ב-10:30 (חדר 2)'), '(2 רדח) 10:30-ב לופיט')
+        self.assertEqual(reports.visual('Room 2'), 'Room 2')
+
+
+class ImportTests(TherapistMixin, TestCase):
+    """
+    Bulk CSV import with the forms' validation rules.
+    """
+
+    log_in = False
+
+    def setUp(self):
+        super().setUp()
+        self.child = create_child(self.family)
+        self.sunday = date.today() + timedelta(days=(6 - date.today().weekday()) % 7 or 7)
+
+    def run_import(self, kind, text, **kwargs):
+        return importing.import_csv(kind, io.StringIO(text), **kwargs)
+
+    @override_settings(ADMIN_IMPORT_MAX_ROWS=2)
+    def test_admin_refuses_files_over_the_row_limit(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        url = reverse('admin:treatment_app_family_import')
+
+        def post(rows):
+            text = 'name,address,phone,family_status\n' + ''.join(
+                f'משפחה {i},הרצל {i},050,משפחה שלמה\n' for i in range(rows)
+            )
+            upload = ContentFile(text.encode('utf-8'), name='families.csv')
+            return self.client.post(url, {'file': upload}, secure=True)
+
+        response = post(3)
+        self.assertIn('import_records families', response.context['error'])
+        self.assertEqual(Family.objects.count(), 1)
+        response = post(2)
+        self.assertIsNone(response.context['error'])
+        self.assertEqual(response.context['result'].created, 2)
+        self.assertEqual(Family.objects.count(), 3)
+
+    def test_families_are_validated_and_indexed(self):
+        result = self.run_import('families', (
+            'name,address,phone,family_status,father_name,mother_name,therapist\n'
+            'לוי,הרצל 1,050,משפחה שלמה,,,therapist\n'
+            'מזרחי,הרצל 2,050,divorced,יוסי,רחל,\n'
+            'פרץ,,050,intact,,,nobody\n'
+        ))
+        self.assertEqual((result.rows, result.created, result.failed), (3, 1, 2))
+        self.assertEqual(
+            {(error.line, error.column) for error in result.errors},
+            {(3, 'father_phone'), (3, 'mother_phone'), (3, 'father_consent_form'), (3, 'mother_consent_form'),
+             (4, 'address')},
+        )
+        family = Family.objects.get(name='לוי')
+        self.assertEqual(family.family_status, 'intact')
+        self.assertTrue(TherapistAccess.objects.filter(user=self.therapist, family=family).exists())
+
+        with self.assertRaises(importing.ImportFileError):
+            self.run_import('families', 'name,colour\nלוי,red\n')
+
+    def test_treatments_follow_the_scheduling_rules(self):
+        friday = self.sunday + timedelta(days=5)
+        result = self.run_import('treatments', (
+            'family,child,therapist,scheduled_date,start_time,end_time,type,status\n'
+            f'כהן,דני,therapist,{self.sunday:%d/%m/%Y},10:00,11:00,טיפול פרטני,SCHEDULED\n'
+            f',דני,therapist,{self.sunday:%Y-%m-%d},10:30,11:30,INDIVIDUAL,SCHEDULED\n'
+            f'כהן,,therapist,{friday:%Y-%m-%d},10:00,11:00,FAMILY,SCHEDULED\n'
+            f'כהן,,therapist,{self.sunday:%Y-%m-%d},19:30,21:00,FAMILY,SCHEDULED\n'
+            f'כהן,רותי,therapist,{self.sunday:%Y-%m-%d},12:00,13:00,FAMILY,SCHEDULED\n'
+            f',,therapist,{self.sunday:%Y-%m-%d},14:00,15:00,FAMILY,SCHEDULED\n'
+            'כהן,,therapist,01/01/2023,09:00,10:00,FAMILY,SCHEDULED\n'
+        ))
+        self.assertEqual(
+            [(error.line, error.column) for error in result.errors],
+            [(4, 'scheduled_date'), (5, 'end_time'), (7, 'family'), (3, 'start_time'), (6, 'child')],
+        )
+        self.assertEqual(result.created, 2)
+        session = Treatment.objects.get(child=self.child)
+        self.assertEqual((session.start_time, session.status), (datetime_time(10), Treatment.TreatmentStatus.SCHEDULED))
+        # Statuses are derived as in save()
+        past = Treatment.objects.get(scheduled_date=date(2023, 1, 1))
+        self.assertEqual(past.status, Treatment.TreatmentStatus.MISSED)
+        self.assertTrue(past.needs_summary)
+        self.assertTrue(TherapistAccess.objects.filter(user=self.therapist, treatment=past).exists())
+
+    def test_rejected_rows_do_not_block_later_ones(self):
+        result = self.run_import('treatments', (
+            'family,therapist,scheduled_date,start_time,end_time,type,status\n'
+            f'כהן,therapist,{self.sunday:%Y-%m-%d},10:00,11:00,FAMILY,SCHEDULED\n'
+            f'כהן,therapist,{self.sunday:%Y-%m-%d},10:30,11:30,FAMILY,SCHEDULED\n'
+            f'כהן,therapist,{self.sunday:%Y-%m-%d},11:00,12:00,FAMILY,SCHEDULED\n'
+        ))
+        self.assertEqual([(error.line, error.column) for error in result.errors], [(3, 'start_time')])
+        self.assertEqual(result.created, 2)
+
+    def test_child_must_belong_to_the_family(self):
+        other = Family.objects.create(name='לוי', address='רחוב', phone='050', therapist=self.therapist)
+        result = self.run_import('treatments', (
+            'family,child,therapist,scheduled_date,start_time,end_time,type,status\n'
+            f'{other.pk},{self.child.pk},therapist,{self.sunday:%Y-%m-%d},10:00,11:00,INDIVIDUAL,SCHEDULED\n'
+            f'{self.family.pk},{self.child.pk},therapist,{self.sunday:%Y-%m-%d},12:00,13:00,INDIVIDUAL,SCHEDULED\n'
+        ))
+        self.assertEqual([(error.line, error.column) for error in result.errors], [(2, 'child')])
+        self.assertEqual(result.created, 1)
+        self.assertFalse(Treatment.objects.filter(family=other).exists())
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def queries(count, day):
+            rows = ''.join(
+                f'{self.family.pk},therapist,{day:%Y-%m-%d},{8 + index % 12:02d}:00,{8 + index % 12:02d}:30,FAMILY,SCHEDULED\n'
+                for index in range(count)
+            )
+            with CaptureQueriesContext(connection) as captured:
+                result = self.run_import(
+                    'treatments', 'family,therapist,scheduled_date,start_time,end_time,type,status\n' + rows,
+                    dry_run=True, chunk_size=500,
+                )
+            self.assertFalse(result.errors)
+            return len(captured)
+
+        self.assertEqual(queries(5, self.sunday), queries(12, self.sunday + timedelta(days=1)))
+
+
+class MediaStorageTests(TherapistMixin, TestCase):
+    """
+    Content-addressed uploads served through the access check.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = self.use_temporary_directory('MEDIA_ROOT')
+        self.content = b'%PDF-1.4 consent ' * 100
+        self.family.consent_form.save('ishur.PDF', ContentFile(self.content))
+
+    def test_same_content_is_stored_once(self):
+        other = create_family(name='לוי')
+        other.confidentiality_waiver.save('copy.pdf', ContentFile(self.content))
+        other.father_consent_form.save('other.pdf', ContentFile(b'other'))
+        self.assertEqual(other.confidentiality_waiver.name, self.family.consent_form.name)
+        self.assertTrue(storage.digest_of(self.family.consent_form.name))
+        self.assertTrue(self.family.consent_form.name.endswith('.pdf'))
+        self.assertEqual(self.family.consent_form.url, f'/media/{self.family.consent_form.name}')
+        files = [name for _, _, names in os.walk(self.media_root) for name in names]
+        self.assertEqual(len(files), 2)
+
+    def test_download_is_authorized_and_cacheable(self):
+        url = self.family.consent_form.url
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        response = self.client.get(url, HTTP_RANGE='bytes=0-3', secure=True)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], secure=True).status_code, 304)
+
+        with override_settings(SENDFILE='x-accel-redirect'):
+            response = self.client.get(url, secure=True)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.family.consent_form.name}')
+        self.assertEqual(response.content, b'')
+
+        self.client.force_login(create_user('other'))
+        self.assertEqual(self.client.get(url, secure=True).status_code, 404)
+        self.assertEqual(self.client.get('/media/../settings.py', secure=True).status_code, 404)
+
+    def test_prune_keeps_referenced_files(self):
+        orphan = storage.default_storage.save('orphan.pdf', ContentFile(b'orphan'))
+        later = time.time() + storage.PRUNE_GRACE.total_seconds() + 60
+        self.assertEqual(storage.prune(now=time.time()), 0)
+        self.assertEqual(storage.prune(now=later), 1)
+        self.assertFalse(storage.default_storage.exists(orphan))
+        self.assertTrue(storage.default_storage.exists(self.family.consent_form.name))
+
+
+class UploadTests(TherapistMixin, TestCase):
+    """
+    Resumable document uploads through the API.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = self.use_temporary_directory('MEDIA_ROOT')
+        self.content = bytes(range(256)) * 1000
+        self.url = reverse('api:upload-list', args=['v1'])
+
+    def start(self, content):
+        response = self.client.post(self.url, {
+            'filename': 'scan.pdf', 'size': len(content), 'sha256': hashlib.sha256(content).hexdigest(),
+        }, content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 201)
+        return reverse('api:upload-detail', args=['v1', response.json()['id']])
+
+    def send(self, url, offset, data):
+        return self.client.patch(
+            url, data, content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=offset, secure=True
+        )
+
+    def test_chunks_are_assembled_and_become_a_document(self):
+        url = self.start(self.content)
+        self.assertEqual(self.send(url, 0, self.content[:100000]).json()['offset'], 100000)
+        # A retried chunk is refused with the offset to carry on from
+        response = self.send(url, 0, self.content[:100000])
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 100000))
+        self.assertEqual(self.send(url, 100000, self.content[100000:]).status_code, 200)
+        self.assertEqual(self.client.get(url, secure=True).json()['offset'], len(self.content))
+
+        response = self.client.post(f'{url}finish/', {
+            'name': 'אבחון', 'document_type': 'psychological', 'family': self.family.pk,
+        }, content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 201)
+        document = Document.objects.get()
+        self.assertEqual(storage.digest_of(document.file.name), hashlib.sha256(self.content).hexdigest())
+        with document.file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, uploads.UPLOAD_DIR)), [])
+
+    def test_checksum_and_access_are_checked(self):
+        url = self.start(self.content)
+        self.send(url, 0, self.content[:-1] + b'x')
+        other = Family.objects.create(name='לוי', address='רחוב', phone='050')
+        data = {'name': 'אבחון', 'document_type': 'psychological', 'family': other.pk}
+        self.assertEqual(self.client.post(f'{url}finish/', data, content_type='application/json', secure=True).status_code, 400)
+        data['family'] = self.family.pk
+        self.assertEqual(self.client.post(f'{url}finish/', data, content_type='application/json', secure=True).status_code, 400)
+        self.assertFalse(Upload.objects.exists())
+        self.assertFalse(Document.objects.exists())
+
+        url = self.start(self.content)
+        self.client.force_login(create_user('other'))
+        self.assertEqual(self.send(url, 0, self.content).status_code, 404)
+
+
+class PerfTests(TherapistMixin, TestCase):
+    """
+    Request timings per view and the report built from them.
+    """
+
+    therapist_fields = {'is_staff': True}
+
+    def setUp(self):
+        super().setUp()
+        # Drop what earlier tests collected
+        perf.flush()
+        ViewTiming.objects.all().delete()
+
+    def test_requests_are_timed_per_view(self):
+        url = reverse('treatment_app:family-detail', args=[self.family.pk])
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", tpl;dur=')
+        self.client.get(url, secure=True)
+
+        self.assertGreaterEqual(perf.flush(), 1)
+        timing = ViewTiming.objects.get(view='treatment_app:family-detail')
+        self.assertEqual(timing.requests, 2)
+        self.assertGreater(timing.db_queries, 0)
+        self.assertGreater(timing.template_ms, 0)
+        self.assertEqual(sum(timing.histogram.values()), 2)
+
+    def test_percentiles_and_repeated_queries_are_reported(self):
+        now = timezone.now()
+        for histogram, repeated in (({perf.bucket(10): 90}, 3), ({perf.bucket(500): 10}, 40)):
+            ViewTiming.objects.create(
+                view='treatment_app:dashboard', recorded_at=now, requests=sum(histogram.values()), total_ms=1000,
+                db_queries=100, db_ms=100, template_ms=100, max_queries=50, histogram=histogram,
+                repeated_sql='SELECT * FROM child WHERE family_id = %s', repeated_count=repeated,
+            )
+        entry, = perf.summarize(now - timedelta(minutes=1))
+        self.assertAlmostEqual(entry['p50'], 10, delta=1.5)
+        self.assertAlmostEqual(entry['p95'], 500, delta=55)
+        self.assertEqual(entry['repeated_count'], 40)
+
+        out = io.StringIO()
+        call_command('perf_report', stdout=out)
+        self.assertIn('treatment_app:dashboard', out.getvalue())
+        self.assertIn('40 times in one request', out.getvalue())
+
+
+class HealthCheckTests(TestCase):
+    """
+    /healthz and /readyz answer before the other middleware, from cached checks.
+    """
+
+    def setUp(self):
+        health._results = None
+        self.addCleanup(setattr, health, '_results', None)
+
+    @override_settings(SECURE_SSL_REDIRECT=True)
+    def test_probes_skip_the_https_redirect_and_sessions(self):
+        response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'ok'})
+        self.assertNotIn('sessionid', response.cookies)
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        checks = response.json()['checks']
+        self.assertEqual(set(checks), {'database', 'media', 'static'})
+        self.assertTrue(all(check['ok'] and check['ms'] >= 0 for check in checks.values()))
+
+    def test_readiness_is_cached_and_fails_with_a_check(self):
+        def broken():
+            raise OSError('disk gone')
+
+        with mock.patch.dict(health.CHECKS, {'media': broken}):
+            response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['checks']['media']['error'], 'OSError: disk gone')
+
+        # Within HEALTH_CHECK_SECONDS the failure is served from the cache
+        with mock.patch.object(health, 'run_checks') as run_checks, CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/readyz').status_code, 503)
+        run_checks.assert_not_called()
+        self.assertEqual(len(queries), 0)
+        with override_settings(HEALTH_CHECK_SECONDS=0):
+            self.assertEqual(self.client.get('/readyz').status_code, 200)
+
+
+class MetricsTests(TestCase):
+    """
+    The /metrics exposition, added up over the processes' files.
+    """
+
+    def setUp(self):
+        # Drop what earlier tests counted
+        metrics._reset_after_fork()
+        self.url = reverse('treatment_app:metrics')
+
+    def scrape(self, **headers):
+        response = self.client.get(self.url, secure=True, **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode()
+
+    def test_requests_cache_lookups_and_business_gauges_are_exposed(self):
+        staff = create_user('staff', is_staff=True)
+        self.client.force_login(staff)
+        family = create_family(staff)
+        Treatment.objects.create(family=family, scheduled_date=date.today() - timedelta(days=2))
+        self.client.get(reverse('treatment_app:family-detail', args=[family.pk]), secure=True)
+        metrics.install_cache_counter()
+        cache.set('dashboard-stats:test', 1)
+        cache.get('dashboard-stats:test')
+        cache.get('dashboard-stats:missing')
+
+        text = self.scrape()
+        self.assertIn('# TYPE treatment_http_request_duration_seconds histogram', text)
+        self.assertIn('treatment_http_request_duration_seconds_count{view="treatment_app:family-detail"} 1', text)
+        self.assertIn('treatment_http_requests_total{status="200",view="treatment_app:family-detail"} 1', text)
+        self.assertIn('treatment_cache_requests_total{kind="dashboard-stats",result="hit"} 1', text)
+        self.assertIn('treatment_cache_hit_ratio{kind="dashboard-stats"} 0.5', text)
+        self.assertIn('treatment_treatments_past_due 1', text)
+        self.assertIn(f'treatment_worker_uptime_seconds{{pid="{os.getpid()}"}}', text)
+
+    def test_files_of_other_processes_add_up(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        metrics.inc('treatment_db_queries_total', 2, view='v')
+        for pid in (os.getppid(), 2 ** 30):  # a live process and one that exited
+            with open(os.path.join(directory, f'{pid}-0.json'), 'w') as f:
+                json.dump({
+                    'pid': pid, 'started': 0, 'rss': 1024,
+                    'counters': [['treatment_db_queries_total', [['view', 'v']], 3]], 'histograms': [],
+                }, f)
+
+        with override_settings(METRICS_DIR=directory):
+            for _ in range(2):
+                merged, live = metrics.gather()
+                self.assertEqual(merged['counters']['treatment_db_queries_total', (('view', 'v'),)], 8)
+                self.assertEqual({data['pid'] for data in live}, {os.getpid(), os.getppid()})
+        # The exited process was folded into the shared file
+        own = f'{os.getpid()}-{int(metrics._started * 1000)}.json'
+        self.assertEqual(sorted(os.listdir(directory)), sorted(['.lock', own, f'{os.getppid()}-0.json', metrics.ARCHIVE]))
+
+    def test_totals_never_decrease_whichever_worker_is_scraped(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # Two workers' in-memory state, swapped in to act as either one
+        workers = {
+            pid: {'_counters': defaultdict(float), '_histograms': {}, '_started': time.time()}
+            for pid in (1001, 1002)
+        }
+
+        def as_worker(pid):
+            stack = ExitStack()
+            stack.enter_context(mock.patch.multiple(metrics, **workers[pid]))
+            stack.enter_context(mock.patch('os.getpid', return_value=pid))
+            stack.enter_context(mock.patch.object(metrics, '_alive', return_value=True))
+            return stack
+
+        totals = []
+        with override_settings(METRICS_DIR=directory, METRICS_FLUSH_SECONDS=3600):
+            for step in range(12):
+                with as_worker(1001 + (step % 3 == 0)):
+                    metrics.inc('treatment_db_queries_total', step + 1, view='v')
+                with as_worker(1001 + step % 2):
+                    merged, _ = metrics.gather()
+                totals.append(merged['counters']['treatment_db_queries_total', (('view', 'v'),)])
+            with as_worker(1001):
+                merged, _ = metrics.gather()
+            with as_worker(1002):
+                merged, _ = metrics.gather()
+        self.assertEqual(totals, sorted(totals))
+        self.assertEqual(merged['counters']['treatment_db_queries_total', (('view', 'v'),)], sum(range(1, 13)))
+
+    def test_scrapers_need_the_token(self):
+        self.assertEqual(self.client.get(self.url, secure=True).status_code, 403)
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(
+                self.client.get(self.url, secure=True, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403
+            )
+            self.scrape(HTTP_AUTHORIZATION='Bearer s3cret')
+
+
+@override_settings(SLOW_QUERY_LOG='')
+class SlowQueryLogTests(TestCase):
+    """
+    Statements over the threshold are logged with their plan and call site.
+    """
+
+    def setUp(self):
+        slowlog.buffer.clear()
+        self.addCleanup(slowlog.buffer.clear)
+        self.family = create_family()
+
+    def test_slow_statements_are_logged_with_plan_and_call_site(self):
+        with override_settings(SLOW_QUERY_MS=0.0001), self.assertLogs('treatment_app.slow_queries') as logs:
+            list(Family.objects.filter(name__icontains='כה'))
+        entry = slowlog.buffer[-1]
+        self.assertIn('LIKE', entry['sql'])
+        self.assertIn('%כה%', entry['params'])
+        self.assertIn('SCAN', entry['plan'])
+        self.assertRegex(entry['call_site'], r'^treatment_app/tests\.py:\d+ SlowQueryLogTests\.')
+        self.assertEqual(json.loads(logs.records[-1].getMessage())['fingerprint'], entry['fingerprint'])
+
+    def test_time_spent_fetching_rows_counts(self):
+        # SQLite's execute() only runs up to the first row, the rest of the
+        # scan happens in fetchmany()
+        for i in range(5):
+            create_family(name=f'משפחה {i}')
+        connection.ensure_connection()
+        connection.connection.create_function('slow_row', 1, lambda value: time.sleep(0.02) or value)
+        families = Family.objects.annotate(slow=Func('id', function='slow_row'))
+
+        timer = perf.RequestTimer()
+        with override_settings(SLOW_QUERY_MS=60), self.assertLogs('treatment_app.slow_queries'):
+            with connection.execute_wrapper(timer):
+                self.assertEqual(len(list(families)), 6)
+        self.assertGreaterEqual(timer.db_time, 0.12)
+        entry = slowlog.buffer[-1]
+        self.assertIn('slow_row', entry['sql'])
+        self.assertGreaterEqual(entry['ms'], 120)
+        self.assertRegex(entry['call_site'], r'^treatment_app/tests\.py:\d+ SlowQueryLogTests\.')
+
+    def test_fingerprints_ignore_literals_and_list_lengths(self):
+        self.assertEqual(
+            slowlog.fingerprint('SELECT * FROM t WHERE id IN (%s, %s) LIMIT 21'),
+            slowlog.fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s) LIMIT 10'),
+        )
+        self.assertNotEqual(slowlog.fingerprint('SELECT a FROM t'), slowlog.fingerprint('SELECT b FROM t'))
+
+    def test_page_is_staff_only_and_groups_entries(self):
+        with override_settings(SLOW_QUERY_MS=0.0001), self.assertLogs('treatment_app.slow_queries'):
+            for _ in range(3):
+                Family.objects.filter(pk=self.family.pk).exists()
+        url = reverse('treatment_app:slow-queries')
+        self.client.force_login(create_user('therapist'))
+        self.assertEqual(self.client.get(url, secure=True).status_code, 302)
+        self.client.force_login(create_user('staff', is_staff=True))
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        group, = [group for group in response.context['groups'] if 'LIMIT' in group['sql']]
+        self.assertEqual(group['count'], 3)
+
+
+class LoggingTests(SimpleTestCase):
+    """
+    Records go out as JSON lines through a queue, hot-path INFO lines sampled.
+    """
+
+    def test_json_lines_carry_extra_fields(self):
+        record = logging.makeLogRecord({
+            'name': 'treatment_app.views', 'levelname': 'INFO', 'levelno': logging.INFO,
+            'msg': 'Dashboard for %s', 'args': ('dana',), 'user_id': 7,
+        })
+        entry = json.loads(log.JsonFormatter().format(record))
+        self.assertEqual(entry['message'], 'Dashboard for dana')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['user_id'], 7)
+
+    def test_sampling_keeps_one_in_n_info_records_per_message(self):
+        sampling = log.SamplingFilter({'treatment_app.views': 3})
+
+        def kept(name, level, msg):
+            return sampling.filter(logging.makeLogRecord({'name': name, 'levelno': level, 'msg': msg}))
+
+        self.assertEqual([kept('treatment_app.views', logging.INFO, 'a %s') for _ in range(7)],
+                         [True, False, False, True, False, False, True])
+        self.assertTrue(kept('treatment_app.views', logging.INFO, 'b %s'))
+        self.assertTrue(all(kept('treatment_app.views', logging.WARNING, 'a %s') for _ in range(3)))
+        self.assertTrue(all(kept('treatment_app.auth', logging.INFO, 'a %s') for _ in range(3)))
+
+    def test_queued_handler_defers_formatting_and_rotates(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'app.log')
+        # Every record is bigger than maxBytes, so each one starts a new file
+        handler = log.QueuedFileHandler(path, maxBytes=1, backupCount=1)
+        self.addCleanup(handler.close)
+        handler.setFormatter(log.JsonFormatter())
+
+        # Immutable arguments are formatted by the listener, others right away
+        lazy = handler.prepare(logging.makeLogRecord({'msg': 'user %s', 'args': ('dana',)}))
+        self.assertEqual((lazy.msg, lazy.args), ('user %s', ('dana',)))
+        eager = handler.prepare(logging.makeLogRecord({'msg': 'ids %s', 'args': ([1, 2],)}))
+        self.assertEqual((eager.msg, eager.args), ('ids [1, 2]', None))
+
+        for i in range(3):
+            handler.handle(logging.makeLogRecord({'msg': 'line %d', 'args': (i,), 'levelno': logging.INFO}))
+        handler.close()
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(json.loads(f.read())['message'], 'line 2')
+        with open(path + '.1', encoding='utf-8') as f:
+            self.assertEqual(json.loads(f.read())['message'], 'line 1')
+        self.assertFalse(os.path.exists(path + '.2'))
+
+
+class JobRunnerTests(TestCase):
+    """
+    Scheduled jobs: due times, locking and run history.
+    """
+
+    def setUp(self):
+        self.calls = []
+        registry = {
+            'ok': jobs.Job('ok', lambda: self.calls.append('ok') or {'done': 1}, every=timedelta(minutes=5)),
+            'broken': jobs.Job('broken', lambda: 1 / 0, at=datetime_time(0, 15)),
+        }
+        patcher = mock.patch.dict(jobs.REGISTRY, registry, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        jobs.sync_jobs()
+        ScheduledJob.objects.update(next_run_at=timezone.now())
+
+    def test_due_jobs_run_once_and_are_rescheduled(self):
+        with self.assertLogs('treatment_app.jobs', 'ERROR'):
+            runs = jobs.run_due_jobs()
+        self.assertEqual(sorted((run.job.name, run.status) for run in runs), [
+            ('broken', JobRun.Status.FAILED), ('ok', JobRun.Status.SUCCEEDED),
+        ])
+        self.assertIn('ZeroDivisionError', JobRun.objects.get(job__name='broken').error)
+        self.assertEqual(JobRun.objects.get(job__name='ok').result, {'done': 1})
+
+        self.assertEqual(jobs.run_due_jobs(), [])
+        job = ScheduledJob.objects.get(name='broken')
+        self.assertEqual(timezone.localtime(job.next_run_at).time(), datetime_time(0, 15))
+        self.assertEqual((job.locked_by, job.last_status), ('', JobRun.Status.FAILED))
+
+    def test_job_held_by_another_worker_is_skipped(self):
+        ScheduledJob.objects.filter(name='ok').update(
+            locked_by='other:1', locked_until=timezone.now() + timedelta(minutes=10)
+        )
+        self.assertIsNone(jobs.run_job('ok', force=True))
+        self.assertEqual(self.calls, [])
+
+        # An expired lease means the other worker died
+        ScheduledJob.objects.filter(name='ok').update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertIsNotNone(jobs.run_job('ok'))
+        self.assertEqual(self.calls, ['ok'])
+
+    @mock.patch('treatment_app.jobs.warm_dashboard_counters')
+    def test_dashboard_cache_is_only_warmed_when_shared(self, warm):
+        User.objects.create_superuser('admin', password='secret', last_login=timezone.now())
+        with self.assertLogs('treatment_app.jobs', 'WARNING'):
+            self.assertEqual(jobs.warm_dashboard_cache(), {'skipped': 'locmem'})
+        warm.assert_not_called()
+
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertEqual(jobs.warm_dashboard_cache(), {'users': 1})
+        warm.assert_called_once()
+
+
+class SqliteBackendTests(SimpleTestCase):
+    """
+    New connections get the pragmas, and transactions take the write lock up front.
+    """
+
+    def connect(self, **options):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        wrapper = type(connections['default'])(
+            {**connection.settings_dict, 'NAME': os.path.join(directory, 'db.sqlite3'), 'OPTIONS': options},
+            alias='pragmas',
+        )
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        return wrapper.connection.execute(f'PRAGMA {name}').fetchone()[0]
+
+    def test_pragmas_follow_the_options(self):
+        wrapper = self.connect(timeout=20, pragmas={'cache_size': -1000})
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 20000)
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma(wrapper, 'cache_size'), -1000)
+        self.assertEqual(self.pragma(self.connect(), 'busy_timeout'), 5000)
+
+    def test_transactions_begin_immediate(self):
+        wrapper = self.connect(timeout=20)
+        with CaptureQueriesContext(wrapper) as queries:
+            wrapper._start_transaction_under_autocommit()
+        self.assertEqual(queries.captured_queries[-1]['sql'], 'BEGIN IMMEDIATE')
+        # The write lock is already held, before anything was written
+        other = sqlite3.connect(wrapper.settings_dict['NAME'], timeout=0, isolation_level=None)
+        self.addCleanup(other.close)
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+            other.execute('BEGIN IMMEDIATE')
+        wrapper.connection.execute('ROLLBACK')
+
+
+@mock.patch.object(routers, 'replica_available', return_value=True)
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    """
+    Read-only views read from the replica until the request writes.
+    """
+
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+
+    def read_in_view(self, model=Family, before=None, pinned=False):
+        @routers.replica_reads
+        def view():
+            if before:
+                before()
+            return self.router.db_for_read(model)
+
+        token = routers.begin_request(pinned)
+        try:
+            return view()
+        finally:
+            routers.end_request(token)
+
+    def test_reads_use_replica_only_inside_read_only_views(self, _):
+        self.assertEqual(self.read_in_view(), 'replica')
+        self.assertEqual(self.router.db_for_read(Family), 'default')
+
+    def test_writes_pin_request_to_primary(self, _):
+        self.assertEqual(self.read_in_view(before=lambda: self.router.db_for_write(Family)), 'default')
+        self.assertEqual(self.read_in_view(pinned=True), 'default')
+        self.assertEqual(self.read_in_view(), 'replica')
+
+    def test_sessions_and_users_stay_on_primary(self, _):
+        self.assertEqual(self.read_in_view(model=User), 'default')
+
+    def test_middleware_pins_client_after_write(self, _):
+        factory = RequestFactory()
+
+        def write(request):
+            self.router.db_for_write(Family)
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(write)(factory.post('/'))
+        self.assertIn(REPLICA_PIN_COOKIE, response.cookies)
+
+        def read(request):
+            return HttpResponse(self.router.db_for_read(Family))
+
+        read = routers.replica_reads(read)
+        request = factory.get('/')
+        request.COOKIES[REPLICA_PIN_COOKIE] = '1'
+        self.assertEqual(ReplicaPinningMiddleware(read)(request).content, b'default')
+        self.assertEqual(ReplicaPinningMiddleware(read)(factory.get('/')).content, b'replica')
@@ -0,0 +1,141 @@
+"""
+Resumable uploads of large documents, in chunks.
+
+A client starts an upload with the file's name, size and SHA-256
+(``start``), sends the bytes in chunks of at most ``MAX_CHUNK_SIZE``, each
+at the offset the server has reached (``write_chunk``), and finishes it
+(``finish``), which checks the size and checksum and moves the file into
+the content-addressed store. Chunks are streamed from the request to
+``partial_path`` on disk, so neither a worker's memory nor its time is
+held by the whole file. After a dropped connection the client asks for
+the offset and carries on from there.
+
+Uploads untouched for ``EXPIRY`` are removed by the ``prune_uploads`` job.
+"""
+
+import hashlib
+import os
+import re
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import Upload
+
+MAX_UPLOAD_SIZE = 512 * 1024 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+COPY_SIZE = 64 * 1024
+EXPIRY = timedelta(days=1)
+UPLOAD_DIR = 'uploads'
+
+_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    """
+    A chunk was sent for another offset than the one the upload is at,
+    e.g. a retry of a chunk that did arrive.
+    """
+
+    def __init__(self, offset):
+        super().__init__(f'the upload is at offset {offset}')
+        self.offset = offset
+
+
+def partial_path(upload):
+    # Next to the store, so finishing an upload is a rename
+    return os.path.join(default_storage.location, UPLOAD_DIR, f'{upload.pk}.part')
+
+
+def start(user, filename, size, sha256):
+    """
+    Create an upload of ``size`` bytes with the given (hex) SHA-256.
+    """
+    sha256 = sha256.lower()
+    if not _SHA256.match(sha256):
+        raise UploadError('sha256 must be 64 hex digits')
+    if not 0 < size <= MAX_UPLOAD_SIZE:
+        raise UploadError(f'size must be between 1 and {MAX_UPLOAD_SIZE} bytes')
+    upload = Upload.objects.create(user=user, filename=os.path.basename(filename), size=size, sha256=sha256)
+    path = partial_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return upload
+
+
+def write_chunk(upload, offset, stream):
+    """
+    Write the bytes in ``stream`` at ``offset`` and return the new offset.
+    A chunk cut off by a dropped connection counts for what arrived.
+    """
+    if offset != upload.offset:
+        raise OffsetMismatch(upload.offset)
+    limit = min(MAX_CHUNK_SIZE, upload.size - offset)
+    received = 0
+    with open(partial_path(upload), 'r+b') as f:
+        f.seek(offset)
+        while True:
+            try:
+                data = stream.read(min(COPY_SIZE, limit + 1 - received))
+            except OSError:
+                break
+            if not data:
+                break
+            if received + len(data) > limit:
+                raise UploadError(f'a chunk may hold at most {limit} bytes here')
+            f.write(data)
+            received += len(data)
+
+    # Of two requests for the same offset only one moves the upload on
+    moved = Upload.objects.filter(pk=upload.pk, offset=offset).update(
+        offset=offset + received, updated_at=timezone.now()
+    )
+    if not moved:
+        upload.refresh_from_db(fields=['offset'])
+        raise OffsetMismatch(upload.offset)
+    upload.offset = offset + received
+    return upload.offset
+
+
+def finish(upload):
+    """
+    Check the complete upload against its checksum and move it into the
+    store; returns the stored name. A file that does not match is
+    discarded along with the upload.
+    """
+    if upload.offset != upload.size:
+        raise UploadError(f'only {upload.offset} of {upload.size} bytes have arrived')
+    path = partial_path(upload)
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while data := f.read(1024 * 1024):
+            sha.update(data)
+    if sha.hexdigest() != upload.sha256:
+        abort(upload)
+        raise UploadError('the file does not match its sha256; upload it again')
+    return default_storage.adopt(path, upload.sha256, os.path.splitext(upload.filename)[1])
+
+
+def abort(upload):
+    try:
+        os.unlink(partial_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def prune(now=None):
+    """
+    Remove uploads untouched for ``EXPIRY``. Returns the number removed.
+    """
+    stale = Upload.objects.filter(updated_at__lt=(now or timezone.now()) - EXPIRY)
+    count = 0
+    for upload in stale:
+        abort(upload)
+        count += 1
+    return count
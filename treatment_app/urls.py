@@ -5,6 +5,12 @@ app_name = 'treatment_app'
 
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
+    path('search/', views.global_search, name='search'),
+    path('export/<slug:kind>.<slug:fmt>', views.export_data, name='export'),
+    path('reports/<slug:kind>/<int:subject_id>.pdf', views.report_view, name='report'),
+    path('media/<path:name>', views.media_file, name='media'),
+    path('slow-queries/', views.slow_queries, name='slow-queries'),
+    path('metrics', views.metrics_view, name='metrics'),
     
     # Family URLs
     path('families/', views.FamilyListView.as_view(), name='family-list'),
@@ -26,12 +32,16 @@ urlpatterns = [
     path('treatments/weekly/', views.weekly_calendar_view, name='weekly_calendar'),
     path('treatments/calendar/', views.treatment_calendar_data, name='treatment_calendar_data'),
     path('treatments/calendar/view/', views.calendar_view, name='calendar_view'),
+    path('treatments/worklist/', views.treatment_worklist, name='treatment_worklist'),
     path('treatment/new/', views.TreatmentCreateView.as_view(), name='treatment-create'),
     path('family/<int:family_id>/treatment/create/', views.TreatmentCreateView.as_view(), name='family-treatment-create'),
     path('child/<int:child_id>/treatment/create/', views.TreatmentCreateView.as_view(), name='child-treatment-create'),
     path('treatment/<int:pk>/', views.TreatmentDetailView.as_view(), name='treatment-detail'),
     path('treatment/<int:pk>/update/', views.TreatmentUpdateView.as_view(), name='treatment-update'),
     path('treatment/<int:pk>/delete/', views.TreatmentDeleteView.as_view(), name='treatment-delete'),
+    path('treatment/series/new/', views.TreatmentSeriesCreateView.as_view(), name='treatment-series-create'),
+    path('treatment/series/<int:pk>/edit/', views.TreatmentSeriesUpdateView.as_view(), name='treatment-series-update'),
+    path('treatment/series/<int:pk>/cancel/', views.TreatmentSeriesCancelView.as_view(), name='treatment-series-cancel'),
     
     # Therapist management
     path('therapists/', views.TherapistListView.as_view(), name='therapist-list'),
@@ -4,7 +4,8 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
-from django.db.models import Q
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from datetime import datetime, timedelta, date
 from django.utils.translation import gettext_lazy as _
@@ -14,14 +15,25 @@ from .models import (
     Family, 
     Child, 
     TherapistProfile,
-    Document
+    Document,
+    TreatmentSeries,
+    Report
 )
-from .forms import TreatmentForm, DocumentForm, FamilyForm, ChildForm, TherapistForm
+from .forms import (
+    TreatmentForm, TreatmentSeriesForm, TreatmentSeriesUpdateForm, DocumentForm, FamilyForm, ChildForm, TherapistForm
+)
+from .access import scope_queryset
+from .stats import dashboard_counters
+from .caching import CachedFragmentMixin
+from .routers import ReplicaReadMixin, replica_reads
+from . import downloads, exports, metrics, reports, search, series, slowlog, storage, worklist
 
 import logging
 logger = logging.getLogger(__name__)
+# Not sampled (see settings.LOG_SAMPLE_RATES): every login is kept
+auth_logger = logging.getLogger('treatment_app.auth')
 
-class TreatmentListView(LoginRequiredMixin, ListView):
+class TreatmentListView(LoginRequiredMixin, ReplicaReadMixin, CachedFragmentMixin, ListView):
     """
     List view for treatments with advanced filtering and sorting
     """
@@ -29,20 +41,11 @@ class TreatmentListView(LoginRequiredMixin, ListView):
     template_name = 'treatment_app/treatment_list.html'
     context_object_name = 'treatments'
     paginate_by = 10
+    cache_models = (Treatment, Family, Child)
 
     def get_queryset(self):
-        user = self.request.user
-        
-        # Superuser sees all treatments
-        if user.is_superuser:
-            return Treatment.objects.all()
-        
-        # Regular therapist sees only their treatments
-        return Treatment.objects.filter(
-            Q(therapist=user) |  # Treatments created by therapist
-            Q(child__therapist__user=user) |  # Treatments for children assigned to therapist
-            Q(family__therapist=user)  # Treatments for families assigned to therapist
-        ).distinct()
+        # Superuser sees all treatments, a therapist only those in the access index
+        return scope_queryset(Treatment.objects.all(), self.request.user).select_related('family', 'child')
 
     def get_context_data(self, **kwargs):
         """
@@ -52,10 +55,9 @@ class TreatmentListView(LoginRequiredMixin, ListView):
         context['status_choices'] = Treatment.TreatmentStatus.choices
         context['type_choices'] = Treatment.TreatmentType.choices
         
-        # Add past due treatments
-        context['past_due_treatments'] = Treatment.objects.filter(
-            status=Treatment.TreatmentStatus.SCHEDULED,
-            scheduled_date__lt=timezone.now().date()
+        # Past-due treatments come from the stored flag, within the user's scope
+        context['past_due_treatments'] = scope_queryset(
+            Treatment.objects.filter(needs_summary=True), self.request.user
         )
         
         return context
@@ -106,6 +108,17 @@ class TreatmentCreateView(LoginRequiredMixin, CreateView):
         
         return initial
 
+    def get_form_kwargs(self):
+        """
+        The current user is always the therapist (see form_valid), so
+        validate the form, including the double-booking check, with them
+        """
+        kwargs = super().get_form_kwargs()
+        if 'data' in kwargs:
+            kwargs['data'] = kwargs['data'].copy()
+            kwargs['data']['therapist'] = self.request.user.pk
+        return kwargs
+
     def form_valid(self, form):
         """
         Set the current user as therapist and save
@@ -157,6 +170,73 @@ class TreatmentDeleteView(LoginRequiredMixin, DeleteView):
     template_name = 'treatment_app/treatment_confirm_delete.html'
     success_url = reverse_lazy('treatment_list')
 
+class TreatmentSeriesQuerysetMixin:
+    """
+    Superusers manage every series, therapists the ones they run or created.
+    """
+
+    def get_queryset(self):
+        queryset = TreatmentSeries.objects.select_related('family', 'child')
+        if self.request.user.is_superuser:
+            return queryset
+        return queryset.filter(Q(therapist=self.request.user) | Q(created_by=self.request.user))
+
+class TreatmentSeriesCreateView(LoginRequiredMixin, CreateView):
+    """
+    Schedule a recurring series; all its sessions are created at once
+    """
+    model = TreatmentSeries
+    form_class = TreatmentSeriesForm
+    template_name = 'treatment_app/treatment_series_form.html'
+
+    def get_initial(self):
+        initial = {'therapist': self.request.user}
+        family_id = self.request.GET.get('family')
+        child_id = self.request.GET.get('child')
+        if family_id:
+            initial['family'] = get_object_or_404(Family, pk=family_id)
+        if child_id:
+            child = get_object_or_404(Child, pk=child_id)
+            initial['child'] = child
+            initial['family'] = child.family
+        return initial
+
+    def form_valid(self, form):
+        treatments = series.create_series(form.instance, created_by=self.request.user)
+        self.object = form.instance
+        messages.success(self.request, _('נוצרו %(count)d טיפולים בסדרה') % {'count': len(treatments)})
+        return redirect('treatment_app:treatment-list')
+
+class TreatmentSeriesUpdateView(LoginRequiredMixin, TreatmentSeriesQuerysetMixin, UpdateView):
+    """
+    Change the remaining sessions of a series with one UPDATE
+    """
+    model = TreatmentSeries
+    form_class = TreatmentSeriesUpdateForm
+    template_name = 'treatment_app/treatment_series_form.html'
+
+    def form_valid(self, form):
+        changed = series.update_series(form.instance, form.changed_data)
+        messages.success(self.request, _('עודכנו %(count)d טיפולים בסדרה') % {'count': changed})
+        return redirect('treatment_app:treatment-list')
+
+class TreatmentSeriesCancelView(LoginRequiredMixin, TreatmentSeriesQuerysetMixin, DetailView):
+    """
+    Cancel the remaining sessions of a series
+    """
+    model = TreatmentSeries
+    template_name = 'treatment_app/treatment_series_confirm_cancel.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['remaining'] = series.remaining_sessions(self.object).count()
+        return context
+
+    def post(self, request, *args, **kwargs):
+        cancelled = series.cancel_series(self.get_object())
+        messages.success(request, _('בוטלו %(count)d טיפולים בסדרה') % {'count': cancelled})
+        return redirect('treatment_app:treatment-list')
+
 @login_required
 def weekly_calendar_view(request):
     """
@@ -182,131 +262,62 @@ def weekly_calendar_view(request):
     return render(request, 'treatment_app/weekly_calendar.html', context)
 
 @login_required
+@replica_reads
 def dashboard(request):
     try:
-        # Log user details for debugging
-        logger.info(f"Dashboard access attempt by user: {request.user}")
-        logger.info(f"User is superuser: {request.user.is_superuser}")
-        logger.info(f"User ID: {request.user.id}")
-        logger.info(f"Username: {request.user.username}")
-
-        # For admin users
-        if request.user.is_superuser:
-            treatments = Treatment.objects.all()
-            families = Family.objects.all()
-            children = Child.objects.all()
-            
-            context = {
-                'total_treatments': treatments.count(),
-                'upcoming_treatments': treatments.filter(
-                    status='SCHEDULED', 
-                    scheduled_date__gte=timezone.now()
-                ).count(),
-                'total_families': families.count(),
-                'new_families_this_month': families.filter(
-                    created_at__month=timezone.now().month, 
-                    created_at__year=timezone.now().year
-                ).count(),
-                'total_children': children.count(),
-                'active_children': children.count(),  # Remove the is_active filter
-                'recent_treatments': treatments.order_by('-scheduled_date')[:5],
-                'recent_families': families.order_by('-created_at')[:5]
-            }
-            
-            return render(request, 'treatment_app/dashboard.html', context)
-        
-        # For regular users
-        try:
-            # Explicitly get the user object to ensure it's a valid User instance
-            user = User.objects.get(pk=request.user.pk)
-            
-            # Try to get the TherapistProfile
-            try:
-                therapist_profile = TherapistProfile.objects.get(user=user)
-                logger.info(f"Found TherapistProfile for user: {user.username}")
-                
-                # Treatments query
-                treatments = Treatment.objects.filter(
-                    Q(therapist=therapist_profile) | 
-                    Q(family__therapist=therapist_profile) | 
-                    Q(child__family__therapist=therapist_profile)
-                ).distinct()
-                
-                # Families query
-                families = Family.objects.filter(therapist=therapist_profile)
-                
-                # Children query
-                children = Child.objects.filter(family__therapist=therapist_profile)
-                
-                # Context for dashboard
-                context = {
-                    'total_treatments': treatments.count(),
-                    'upcoming_treatments': treatments.filter(
-                        status='SCHEDULED', 
-                        scheduled_date__gte=timezone.now()
-                    ).count(),
-                    'total_families': families.count(),
-                    'new_families_this_month': families.filter(
-                        created_at__month=timezone.now().month, 
-                        created_at__year=timezone.now().year
-                    ).count(),
-                    'total_children': children.count(),
-                    'active_children': children.count(),  # Remove the is_active filter
-                    'recent_treatments': treatments.order_by('-scheduled_date')[:5],
-                    'recent_families': families.order_by('-created_at')[:5]
-                }
-                
-            except TherapistProfile.DoesNotExist:
-                logger.warning(f"No TherapistProfile found for user: {user.username}")
-                messages.warning(request, 'אנא צור פרופיל מטפל כדי לגשת ללוח הבקרה המלא')
-                context = {}
-            
-        except User.DoesNotExist:
-            logger.error("User does not exist in database")
-            messages.error(request, 'אירעה שגיאה בזיהוי המשתמש')
-            return redirect('login')
+        logger.info(
+            'Dashboard for %s', request.user.username,
+            extra={'user_id': request.user.id, 'superuser': request.user.is_superuser},
+        )
+
+        # Therapists without a profile get an empty dashboard
+        if not request.user.is_superuser and not TherapistProfile.objects.filter(user=request.user).exists():
+            logger.warning('No TherapistProfile found for user: %s', request.user.username)
+            messages.warning(request, 'אנא צור פרופיל מטפל כדי לגשת ללוח הבקרה המלא')
+            return render(request, 'treatment_app/dashboard.html', {})
+
+        # Superusers see everything, therapists what the access index grants them
+        treatments = scope_queryset(Treatment.objects.all(), request.user)
+        families = scope_queryset(Family.objects.all(), request.user)
+
+        # Counters come from the cached aggregation layer
+        context = dict(dashboard_counters(request.user))
+        context.update({
+            'recent_treatments': treatments.select_related('child').order_by('-scheduled_date')[:5],
+            'recent_families': families.order_by('-created_at')[:5]
+        })
         
         return render(request, 'treatment_app/dashboard.html', context)
     
     except Exception as e:
         # Catch-all for any unexpected errors
-        logger.error(f"Unexpected error in dashboard view: {str(e)}", exc_info=True)
+        logger.exception('Unexpected error in dashboard view: %s', e)
         messages.error(request, 'אירעה שגיאה לא צפויה. אנא נסה שוב או פנה לתמיכה.')
         return redirect('login')
 
-class FamilyListView(LoginRequiredMixin, ListView):
+class FamilyListView(LoginRequiredMixin, ReplicaReadMixin, CachedFragmentMixin, ListView):
     model = Family
     template_name = 'treatment_app/family_list.html'
     context_object_name = 'families'
     paginate_by = 10
+    cache_models = (Family, Child, TherapistProfile)
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        
-        # If not a superuser, filter families by therapist
-        user = self.request.user
-        if not user.is_superuser:
-            try:
-                therapist_profile = TherapistProfile.objects.get(user=user)
-                queryset = queryset.filter(
-                    Q(therapist=therapist_profile) | 
-                    Q(children__therapist=therapist_profile)
-                ).distinct()
-            except TherapistProfile.DoesNotExist:
-                # If no therapist profile, return no families
-                queryset = queryset.none()
+        # If not a superuser, filter families through the access index
+        queryset = scope_queryset(super().get_queryset(), self.request.user)
         
         # Search functionality
-        search_query = self.request.GET.get('q', '').strip()
-        if search_query:
-            queryset = queryset.filter(
-                Q(name__icontains=search_query) |  # Family name
-                Q(phone__icontains=search_query) |  # Phone number
-                Q(address__icontains=search_query) |  # Address
-                Q(therapist__user__first_name__icontains=search_query) |  # Therapist first name
-                Q(therapist__user__last_name__icontains=search_query) |  # Therapist last name
-                Q(children__name__icontains=search_query)  # Child name
-            ).distinct()
+        queryset = search.filter_families(queryset, self.request.GET.get('q'))
+        
+        # One query for the page: therapist joined, children counted in a
+        # correlated subquery rather than a join and GROUP BY, so the page
+        # walks the name index and the paginator's COUNT(*) drops it
+        child_count = Child.objects.filter(family=OuterRef('pk')).order_by().values('family').annotate(
+            count=Count('pk')
+        ).values('count')
+        queryset = queryset.select_related('therapist').annotate(
+            child_count=Coalesce(Subquery(child_count), 0)
+        )
         
         return queryset.order_by('name')
 
@@ -441,7 +452,7 @@ class FamilyDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         messages.success(request, 'המשפחה נמחקה בהצלחה')
         return super().delete(request, *args, **kwargs)
 
-class ChildListView(LoginRequiredMixin, ListView):
+class ChildListView(LoginRequiredMixin, ReplicaReadMixin, CachedFragmentMixin, ListView):
     """
     List view for children with filtering and sorting
     """
@@ -449,6 +460,7 @@ class ChildListView(LoginRequiredMixin, ListView):
     template_name = 'treatment_app/child_list.html'
     context_object_name = 'children'
     ordering = ['family', 'name']
+    cache_models = (Child, Family, TherapistProfile)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -653,11 +665,12 @@ class ChildDeleteView(LoginRequiredMixin, DeleteView):
         messages.success(request, 'הילד נמחק בהצלחה')
         return super().delete(request, *args, **kwargs)
 
-class DocumentListView(LoginRequiredMixin, ListView):
+class DocumentListView(LoginRequiredMixin, ReplicaReadMixin, CachedFragmentMixin, ListView):
     model = Document
     template_name = 'treatment_app/document_list.html'
     context_object_name = 'documents'
     ordering = ['-created_at']
+    cache_models = (Document, Family, Child)
 
 class DocumentDetailView(LoginRequiredMixin, DetailView):
     model = Document
@@ -724,6 +737,7 @@ class TherapistListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     model = TherapistProfile
     template_name = 'treatment_app/therapist_list.html'
     context_object_name = 'therapists'
+    queryset = TherapistProfile.objects.select_related('user')
 
     def test_func(self):
         return self.request.user.is_superuser
@@ -764,63 +778,48 @@ class TherapistDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def test_func(self):
         return self.request.user.is_superuser
 
-from django.http import JsonResponse
+import mimetypes
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import PermissionDenied, SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
-from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import quote_etag
+from .calendar_feed import CalendarFeed, FeedError
+
+# How often the page of a report still being rendered reloads itself
+REPORT_RETRY_SECONDS = 5
 
 @login_required
+@replica_reads
 def treatment_calendar_data(request):
     """
-    Provide treatment data for FullCalendar with optional filtering
+    Provide treatment data for FullCalendar with optional filtering.
+
+    Answers 304 when the client's ETag still matches the window and supports
+    a ``since`` cursor for incremental refetches (see ``calendar_feed``).
     """
-    start_date = request.GET.get('start')
-    end_date = request.GET.get('end')
-    treatment_type = request.GET.get('type')
-    treatment_status = request.GET.get('status')
+    try:
+        feed = CalendarFeed(request)
+    except FeedError as e:
+        return JsonResponse({'error': f'invalid {e}'}, status=400)
 
-    # Base queryset with date range filter
-    treatments = Treatment.objects.filter(
-        scheduled_date__range=[start_date, end_date]
-    ).select_related('family', 'child', 'therapist')
+    etag = quote_etag(feed.etag())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(feed.events(), safe=False)
 
-    # Apply type filter if provided
-    if treatment_type:
-        treatments = treatments.filter(type=treatment_type)
-
-    # Apply status filter if provided
-    if treatment_status:
-        treatments = treatments.filter(status=treatment_status)
-
-    # Prepare event data
-    events = []
-    for treatment in treatments:
-        # Determine client name and color
-        if treatment.child:
-            client_name = treatment.child.name
-            color = '#007bff'  # Bootstrap primary blue
-        elif treatment.family:
-            client_name = treatment.family.name
-            color = '#28a745'  # Bootstrap success green
-        else:
-            client_name = 'לקוח לא מזוהה'
-            color = '#6c757d'  # Bootstrap secondary gray
-
-        # Determine status color
-        if treatment.is_past_due():
-            color = '#dc3545'  # Bootstrap danger red
-
-        # Create event
-        event = {
-            'id': treatment.id,
-            'title': f"{client_name} - {treatment.get_type_display()}",
-            'start': treatment.scheduled_date.strftime('%Y-%m-%d') + f'T{treatment.start_time}',
-            'end': treatment.scheduled_date.strftime('%Y-%m-%d') + f'T{treatment.end_time}',
-            'color': color,
-            'url': reverse('treatment_detail', kwargs={'pk': treatment.pk})
-        }
-        events.append(event)
-
-    return JsonResponse(events, safe=False)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    response['X-Calendar-Cursor'] = feed.cursor()
+    response['X-Calendar-Total'] = feed.summary()[0]
+    return response
 
 def calendar_view(request):
     """
@@ -832,14 +831,170 @@ def calendar_view(request):
     }
     return render(request, 'treatment_app/calendar.html', context)
 
+@login_required
+def global_search(request):
+    """
+    Ranked full-text search across families, children, treatments and
+    documents the user may see.
+
+    ``?q=`` is the query, ``?kind=`` (repeatable) limits the result kinds
+    and ``?limit=`` caps the number of results.
+    """
+    query = request.GET.get('q', '')
+    try:
+        limit = int(request.GET.get('limit', search.DEFAULT_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'invalid limit'}, status=400)
+
+    results = search.search(request.user, query, kinds=request.GET.getlist('kind') or None, limit=limit)
+    return JsonResponse({'query': query, 'results': results})
+
+@login_required
+@replica_reads
+def treatment_worklist(request):
+    """
+    Treatments of the current therapist that are past their date and still
+    have no summary, oldest first.
+
+    Superusers may pass ``?therapist=<user id>``; ``?limit=`` caps the list.
+    """
+    therapist = request.user.pk
+    try:
+        if request.user.is_superuser and request.GET.get('therapist'):
+            therapist = int(request.GET['therapist'])
+        limit = min(int(request.GET.get('limit', worklist.DEFAULT_LIMIT)), worklist.MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': 'invalid therapist or limit'}, status=400)
+
+    treatments = worklist.therapist_worklist(therapist).select_related('family', 'child')
+    total = treatments.count()
+    entries = [worklist.worklist_entry(treatment) for treatment in treatments[:max(limit, 0)]]
+    return JsonResponse({'therapist': therapist, 'count': total, 'results': entries})
+
+@login_required
+def export_data(request, kind, fmt):
+    """
+    Stream the treatments, families or children the user may see as CSV or
+    XLSX, filtered like the list views (see ``exports``).
+    """
+    exporter = exports.EXPORTS.get(kind)
+    if exporter is None or fmt not in ('csv', 'xlsx'):
+        raise Http404
+    queryset, errors = exporter.queryset(request)
+    if errors:
+        return JsonResponse({'error': errors}, status=400)
+
+    # The rows are read while the response is sent, after this view (and the
+    # replica routing context) has returned, so exports read from the primary
+    rows = exporter.rows(queryset)
+    if fmt == 'csv':
+        content, content_type = exports.stream_csv(exporter.headers, rows), 'text/csv; charset=utf-8'
+    else:
+        content = exports.stream_xlsx(exporter.headers, rows, sheet_name=kind)
+        content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{kind}-{timezone.localdate():%Y-%m-%d}.{fmt}"'
+    response['Cache-Control'] = 'private, no-store'
+    # Let nginx pass the chunks on instead of buffering the whole file
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+def report_view(request, kind, subject_id):
+    """
+    A PDF report (see ``reports``). Answers with the PDF once the background
+    worker has rendered it, until then with a page that reloads itself.
+
+    The monthly therapist report takes ``?month=YYYY-MM`` (default: this
+    month); therapists may only request their own.
+    """
+    try:
+        kind = Report.Kind(kind)
+    except ValueError:
+        raise Http404
+    subjects = reports.SUBJECT_MODELS[kind].objects.all()
+    period = None
+    if kind == Report.Kind.THERAPIST_MONTH:
+        if not request.user.is_superuser:
+            subjects = subjects.filter(pk=request.user.pk)
+        try:
+            period = datetime.strptime(request.GET.get('month') or f'{timezone.localdate():%Y-%m}', '%Y-%m').date()
+        except ValueError:
+            return JsonResponse({'error': 'invalid month'}, status=400)
+    else:
+        subjects = scope_queryset(subjects, request.user)
+    get_object_or_404(subjects, pk=subject_id)
+
+    report = reports.request_report(kind, subject_id, period, request.user)
+    if report.status == Report.Status.READY:
+        return downloads.file_response(
+            request, reports.report_path(report), 'application/pdf', report.content_key,
+            filename=reports.filename(report),
+        )
+    failed = report.status == Report.Status.FAILED
+    response = render(
+        request, 'treatment_app/report_status.html', {'report': report}, status=500 if failed else 202
+    )
+    if not failed:
+        response['Retry-After'] = response['Refresh'] = REPORT_RETRY_SECONDS
+    return response
+
+@login_required
+def media_file(request, name):
+    """
+    An uploaded file, for users who may see a record it belongs to.
+    Content-addressed files never change, so browsers may keep them.
+    """
+    found = storage.find_visible(request.user, name)
+    if found is None:
+        raise Http404
+    try:
+        path = default_storage.path(name)
+        stat = os.stat(path)
+    except (OSError, SuspiciousFileOperation):
+        raise Http404
+    digest = storage.digest_of(name)
+    return downloads.file_response(
+        request, path, mimetypes.guess_type(name)[0] or 'application/octet-stream',
+        digest or f'{stat.st_mtime_ns:x}-{stat.st_size:x}',
+        filename=storage.download_name(*found, name),
+        accel_url=settings.SENDFILE_ACCEL_PREFIX + quote(name),
+        cache_control='private, max-age=31536000, immutable' if digest else 'private, no-cache',
+    )
+
+@staff_member_required
+def slow_queries(request):
+    """
+    Recent slow statements grouped by fingerprint, costliest first.
+    """
+    entries = slowlog.recent_entries()
+    return render(request, 'treatment_app/slow_queries.html', {
+        'groups': slowlog.group(entries),
+        'entries': len(entries),
+        'threshold': settings.SLOW_QUERY_MS,
+    })
+
+def metrics_view(request):
+    """
+    Prometheus metrics, for a scraper sending ``METRICS_TOKEN`` as a bearer
+    token or for staff users.
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    authorized = (
+        settings.METRICS_TOKEN and scheme.lower() == 'bearer'
+        and constant_time_compare(token.strip(), settings.METRICS_TOKEN)
+    )
+    if not authorized and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 def login_view(request):
     if request.method == 'POST':
         username = request.POST.get('username')
         password = request.POST.get('password')
         
         try:
-            # Log login attempt
-            logger.info(f"Login attempt for username: {username}")
+            auth_logger.debug('Login attempt for username: %s', username)
             
             # Validate input
             if not username or not password:
@@ -849,15 +1004,15 @@ def login_view(request):
             # Attempt to find the user
             try:
                 user = User.objects.get(username=username)
-                logger.info(f"User found: {username}")
+                auth_logger.debug('User found: %s', username)
             except User.DoesNotExist:
-                logger.warning(f"Login attempt for non-existent user: {username}")
+                auth_logger.warning('Login attempt for non-existent user: %s', username)
                 messages.error(request, 'שם משתמש או סיסמה שגויים')
                 return render(request, 'treatment_app/login.html')
             
             # Check user is active
             if not user.is_active:
-                logger.warning(f"Login attempt for inactive user: {username}")
+                auth_logger.warning('Login attempt for inactive user: %s', username)
                 messages.error(request, 'החשבון שלך אינו פעיל. אנא צור קשר עם מנהל המערכת.')
                 return render(request, 'treatment_app/login.html')
             
@@ -867,7 +1022,7 @@ def login_view(request):
             if auth_user is not None:
                 # Successful login
                 login(request, auth_user)
-                logger.info(f"Successful login for user: {username}")
+                auth_logger.info('Successful login for user: %s', username)
                 
                 # Redirect based on user type
                 if auth_user.is_superuser:
@@ -884,13 +1039,12 @@ def login_view(request):
             
             else:
                 # Authentication failed
-                logger.warning(f"Failed login attempt for user: {username}")
+                auth_logger.warning('Failed login attempt for user: %s', username)
                 messages.error(request, 'שם משתמש או סיסמה שגויים')
                 return render(request, 'treatment_app/login.html')
         
         except Exception as e:
-            # Comprehensive error logging
-            logger.error(f"Unexpected error during login: {str(e)}", exc_info=True)
+            auth_logger.exception('Unexpected error during login: %s', e)
             messages.error(request, f'אירעה שגיאה לא צפויה: {str(e)}. אנא נסה שוב או פנה לתמיכה.')
             return redirect('login')
 
@@ -0,0 +1,92 @@
+"""
+Treatment worklist.
+
+``Treatment.save()`` moves a treatment out of SCHEDULED and sets its
+``needs_summary`` flag, but only when the row is saved. Rows nobody touches
+keep a stale status and flag once their date passes, so ``sweep()`` applies
+the same rules to the whole table with set-based UPDATEs. Run it daily
+(``manage.py sweep_treatments``), shortly after midnight.
+
+The worklist itself is a plain filter on the stored flag, served by the
+partial ``treatment_worklist_idx`` index (therapist, scheduled_date,
+start_time WHERE needs_summary).
+"""
+
+from django.db.models import Case, Q, Value, When
+from django.utils import timezone
+
+from .caching import bump_cache_version
+from .models import Treatment
+
+Status = Treatment.TreatmentStatus
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+# Same conditions as Treatment.save()
+_SUMMARY_MISSING = Q(summary__isnull=True) | Q(summary='')
+
+
+def sweep_statuses(today=None):
+    """
+    Move SCHEDULED treatments whose status ``save()`` would change, in one
+    UPDATE. Returns the number of rows changed.
+    """
+    today = today or timezone.localdate()
+    return Treatment.objects.filter(
+        Q(actual_date__isnull=False) | Q(scheduled_date__isnull=True) | Q(scheduled_date__lt=today),
+        status=Status.SCHEDULED,
+    ).update(
+        status=Case(
+            When(actual_date__isnull=False, then=Value(Status.COMPLETED)),
+            When(scheduled_date__isnull=True, then=Value(Status.PENDING_SUMMARY)),
+            default=Value(Status.MISSED),
+        ),
+        updated_at=timezone.now(),
+    )
+
+
+def refresh_summary_flags(today=None):
+    """
+    Bring the stored ``needs_summary`` flag in line with the date. Returns
+    the number of rows changed.
+    """
+    today = today or timezone.localdate()
+    due = Q(scheduled_date__lt=today) & _SUMMARY_MISSING & ~Q(status=Status.CANCELLED)
+    now = timezone.now()
+    raised = Treatment.objects.filter(due, needs_summary=False).update(needs_summary=True, updated_at=now)
+    # Rows rescheduled or summarized through bulk updates that skipped save()
+    cleared = Treatment.objects.filter(needs_summary=True).exclude(due).update(needs_summary=False, updated_at=now)
+    return raised + cleared
+
+
+def sweep(today=None):
+    """
+    Run both passes. Returns ``(statuses changed, flags changed)``.
+    """
+    today = today or timezone.localdate()
+    changed = (sweep_statuses(today), refresh_summary_flags(today))
+    if any(changed):
+        # update() sends no signals, so drop the cached lists and counters here
+        bump_cache_version(Treatment)
+    return changed
+
+
+def therapist_worklist(therapist):
+    """
+    Treatments of ``therapist`` waiting for a summary, oldest first.
+    """
+    return Treatment.objects.filter(therapist=therapist, needs_summary=True).order_by('scheduled_date', 'start_time')
+
+
+def worklist_entry(treatment):
+    return {
+        'id': treatment.pk,
+        'scheduled_date': treatment.scheduled_date.isoformat(),
+        'start_time': treatment.start_time.strftime('%H:%M') if treatment.start_time else None,
+        'status': treatment.status,
+        'status_display': treatment.get_status_display(),
+        'client': treatment.child.name if treatment.child else treatment.family.name if treatment.family else None,
+        'days_overdue': (timezone.localdate() - treatment.scheduled_date).days,
+        'url': treatment.get_absolute_url(),
+    }
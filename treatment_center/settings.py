@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -62,7 +64,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'treatment_app.middleware.HealthCheckMiddleware',
+    'treatment_app.middleware.PerfMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'treatment_app.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -97,12 +102,68 @@ WSGI_APPLICATION = 'treatment_center.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Database engine is chosen with DB_ENGINE:
+#   sqlite (default)  - the tuned SQLite backend, which enables WAL, busy
+#                       timeouts and BEGIN IMMEDIATE (treatment_app/backends/sqlite3)
+#   postgresql        - DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+# Connections are kept for DB_CONN_MAX_AGE seconds and checked before reuse
+# instead of being reopened on every request. Behind PgBouncer in transaction
+# pooling mode set DB_PGBOUNCER=1, which disables server-side cursors.
+#
+# A read replica is added as the 'replica' alias when DB_REPLICA_HOST
+# (PostgreSQL) or DB_REPLICA_NAME (SQLite file) is set; read-only views then
+# read from it through treatment_app.routers.PrimaryReplicaRouter.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'treatment_center'),
+            'USER': os.environ.get('DB_USER', 'treatment_center'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_PGBOUNCER') == '1',
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
+        }
     }
-}
+    if os.environ.get('DB_REPLICA_HOST'):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.environ['DB_REPLICA_HOST'],
+            'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        }
+elif DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'treatment_app.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'timeout': 20,  # seconds sqlite3 waits for a lock before raising
+            },
+        }
+    }
+    if os.environ.get('DB_REPLICA_NAME'):
+        DATABASES['replica'] = {**DATABASES['default'], 'NAME': os.environ['DB_REPLICA_NAME']}
+else:
+    raise ImproperlyConfigured(f"DB_ENGINE must be 'sqlite' or 'postgresql', not {DB_ENGINE!r}")
+
+if 'replica' in DATABASES:
+    # Tests run against the primary only
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['treatment_app.routers.PrimaryReplicaRouter']
+
+# Seconds a client keeps reading from the primary after it wrote, to cover replication lag
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 15))
 
 
 # Password validation
@@ -153,44 +214,179 @@ STATICFILES_DIRS = [
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 # Media files (Uploaded files)
+# Uploads are stored by the SHA-256 of their content (treatment_app.storage)
+# and served only through the app, which checks access. SENDFILE lets the
+# web server send them: 'x-accel-redirect' (nginx, with MEDIA_ROOT exposed
+# as an internal location at SENDFILE_ACCEL_PREFIX:
+#   location /protected-media/ { internal; alias /path/to/media/; }
+# ) or 'x-sendfile' (Apache mod_xsendfile, LiteSpeed). Leave it empty to
+# stream files from Django.
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+STORAGES = {
+    'default': {'BACKEND': 'treatment_app.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+SENDFILE = os.environ.get('SENDFILE', '')
+SENDFILE_ACCEL_PREFIX = os.environ.get('SENDFILE_ACCEL_PREFIX', '/protected-media/')
+
+# PDF reports, rendered by the render_reports job and kept until their data
+# changes. Not under MEDIA_ROOT: reports are only served through the app,
+# which checks access. REPORT_FONT is a TrueType font with Hebrew glyphs
+# (e.g. DejaVuSans.ttf or Arial); reportlab's built-in fonts have none.
+REPORTS_ROOT = Path(os.environ.get('REPORTS_ROOT', BASE_DIR / 'reports'))
+REPORT_FONT = os.environ.get('REPORT_FONT', '')
+
+# CSV imports through the admin run in the request and must finish well
+# within gunicorn's timeout; larger files go through manage.py import_records
+ADMIN_IMPORT_MAX_ROWS = int(os.environ.get('ADMIN_IMPORT_MAX_ROWS', 10000))
 
 # Crispy forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap4"
 CRISPY_TEMPLATE_PACK = "bootstrap4"
 
-# Logging configuration
+# REST API
+REST_FRAMEWORK = {
+    'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.URLPathVersioning',
+    'ALLOWED_VERSIONS': ['v1'],
+    'DEFAULT_VERSION': 'v1',
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': [
+        'rest_framework.permissions.IsAuthenticated',
+    ],
+    'DEFAULT_FILTER_BACKENDS': [
+        'django_filters.rest_framework.DjangoFilterBackend',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'treatment_app.pagination.IdCursorPagination',
+    'PAGE_SIZE': 50,
+}
+
+# Cache
+# TREATMENT_CACHE_BACKEND selects the backend:
+# - locmem: per-process memory, only for a single process; gunicorn_config.py
+#           switches the default to file when it runs several workers
+# - file:   a directory shared by all gunicorn workers on the host
+# - db:     a table in the main database (run `manage.py createcachetable` once)
+CACHE_BACKEND = os.environ.get('TREATMENT_CACHE_BACKEND', 'locmem')
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'treatment-center',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('TREATMENT_CACHE_DIR', str(BASE_DIR / 'cache')),
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'treatment_cache',
+    },
+}
+
+CACHES = {
+    'default': {
+        **CACHE_BACKENDS[CACHE_BACKEND],
+        'TIMEOUT': 300,
+        'KEY_PREFIX': 'treatment_center',
+    },
+}
+
+# Lifetime of cached list fragments and calendar feeds (seconds)
+FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('FRAGMENT_CACHE_TIMEOUT', 300))
+
+# Request timings per view (treatment_app.perf): every PERF_FLUSH_SECONDS each
+# process saves what it has collected, for `manage.py perf_report`
+PERF_ENABLED = os.environ.get('PERF_ENABLED', '1') == '1'
+PERF_FLUSH_SECONDS = int(os.environ.get('PERF_FLUSH_SECONDS', 60))
+
+# /readyz runs its checks at most once every HEALTH_CHECK_SECONDS per process
+# (treatment_app.health)
+HEALTH_CHECK_SECONDS = float(os.environ.get('HEALTH_CHECK_SECONDS', 5))
+
+# Prometheus metrics at /metrics (treatment_app.metrics). Each process writes
+# its counters to METRICS_DIR every METRICS_FLUSH_SECONDS; with no directory a
+# process reports only itself. Scrapers authenticate with METRICS_TOKEN as a
+# bearer token; staff users can open the page without it
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = int(os.environ.get('METRICS_FLUSH_SECONDS', 10))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Statements slower than SLOW_QUERY_MS (0 turns this off) are logged with their
+# plan and call site to SLOW_QUERY_LOG (treatment_app.slowlog)
+SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', str(BASE_DIR / 'slow_queries.log'))
+
+# Logging: JSON lines written by a background thread per process (see
+# treatment_app.log), rotated by size. LOG_SAMPLE_RATES keeps one in N
+# INFO lines of each message of these loggers, e.g. "treatment_app.views=20"
+LOG_FILE = os.environ.get('LOG_FILE', str(BASE_DIR / 'debug.log'))
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_CONSOLE_LEVEL = os.environ.get('LOG_CONSOLE_LEVEL', 'WARNING')
+LOG_SAMPLE_RATES = {
+    name.strip(): int(rate)
+    for name, _, rate in (
+        item.partition('=') for item in os.environ.get('LOG_SAMPLE_RATES', 'treatment_app.views=20').split(',')
+    )
+    if name.strip()
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': {
-        'verbose': {
-            'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
-            'style': '{',
+        'json': {
+            '()': 'treatment_app.log.JsonFormatter',
         },
         'simple': {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'message': {
+            'format': '{message}',
+            'style': '{',
+        },
+    },
+    'filters': {
+        'sampling': {
+            '()': 'treatment_app.log.SamplingFilter',
+            'rates': LOG_SAMPLE_RATES,
+        },
     },
     'handlers': {
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': BASE_DIR / 'debug.log',
-            'formatter': 'verbose',
+            'class': 'treatment_app.log.QueuedFileHandler',
+            'filename': LOG_FILE,
+            'maxBytes': LOG_MAX_BYTES,
+            'backupCount': LOG_BACKUP_COUNT,
+            'formatter': 'json',
+            'filters': ['sampling'],
         },
         'console': {
-            'level': 'INFO',
+            'level': LOG_CONSOLE_LEVEL,
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
+            'filters': ['sampling'],
+        },
+        'slow_queries': {
+            'level': 'INFO',
+            'class': 'treatment_app.log.QueuedFileHandler',
+            'filename': SLOW_QUERY_LOG or os.devnull,
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 2,
+            'formatter': 'message',
         },
     },
     'loggers': {
         'treatment_app': {
             'handlers': ['file', 'console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': True,
         },
         'django': {
@@ -198,13 +394,14 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'treatment_app.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
-# CSRF and Security Settings
-    "https://mh.bigdigital.co.il",
-    "https://www.mh.bigdigital.co.il"
-]
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -226,10 +423,6 @@ SECURE_HSTS_SECONDS = 31536000  # 1 year
 SECURE_HSTS_INCLUDE_SUBDOMAINS = True
 SECURE_HSTS_PRELOAD = True
 
-# Trusted Origins for CSRF
-    "https://mh.bigdigital.co.il",
-    "https://www.mh.bigdigital.co.il"
-]
 
 
 # SSL and Security Settings
@@ -242,8 +435,4 @@ SECURE_HSTS_SECONDS = 31536000  # 1 year
 SECURE_HSTS_INCLUDE_SUBDOMAINS = True
 SECURE_HSTS_PRELOAD = True
 
-# Trusted Origins for CSRF
-    "https://mh.bigdigital.co.il",
-    "https://www.mh.bigdigital.co.il"
-]
 
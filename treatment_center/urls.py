@@ -16,8 +16,6 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views, logout
 from django.contrib import messages
 from django.shortcuts import redirect
@@ -32,6 +30,7 @@ def custom_logout(request):
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('treatment_app.urls')),
+    path('api/<str:version>/', include('treatment_app.api_urls')),
     path('accounts/login/', auth_views.LoginView.as_view(template_name='treatment_app/login.html'), name='login'),
     path('logout/', custom_logout, name='logout'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]